@@ -10,6 +10,7 @@ For the full list of settings and their values, see
 https://docs.djangoproject.com/en/5.2/ref/settings/
 """
 
+import os
 from pathlib import Path
 
 # Build paths inside the project like this: BASE_DIR / 'subdir'.
@@ -20,12 +21,14 @@ BASE_DIR = Path(__file__).resolve().parent.parent
 # See https://docs.djangoproject.com/en/5.2/howto/deployment/checklist/
 
 # SECURITY WARNING: keep the secret key used in production secret!
-SECRET_KEY = 'django-insecure-s!jks#1gq%$d^*u5i^cz7&)!x2_4l2p0@bih!7_pnrtd!lo1@s'
+SECRET_KEY = os.environ.get(
+    'DJANGO_SECRET_KEY', 'django-insecure-s!jks#1gq%$d^*u5i^cz7&)!x2_4l2p0@bih!7_pnrtd!lo1@s'
+)
 
 # SECURITY WARNING: don't run with debug turned on in production!
-DEBUG = True
+DEBUG = os.environ.get('DJANGO_DEBUG', '1') == '1'
 
-ALLOWED_HOSTS = ['localhost', '127.0.0.1']
+ALLOWED_HOSTS = os.environ.get('DJANGO_ALLOWED_HOSTS', 'localhost,127.0.0.1').split(',')
 
 
 # Application definition
@@ -42,6 +45,7 @@ INSTALLED_APPS = [
 
 MIDDLEWARE = [
     'django.middleware.security.SecurityMiddleware',
+    'core.middleware.InstrumentacaoMiddleware',
     'django.contrib.sessions.middleware.SessionMiddleware',
     'django.middleware.common.CommonMiddleware',
     'django.middleware.csrf.CsrfViewMiddleware',
@@ -73,12 +77,90 @@ WSGI_APPLICATION = 'controle_almoxarifado.wsgi.application'
 # Database
 # https://docs.djangoproject.com/en/5.2/ref/settings/#databases
 
-DATABASES = {
-    'default': {
-        'ENGINE': 'django.db.backends.sqlite3',
-        'NAME': BASE_DIR / 'db.sqlite3',
+# DJANGO_BANCO escolhe o perfil do banco:
+# - sqlite (padrao): arquivo local sem ajustes, para desenvolvimento;
+# - sqlite-wal: SQLite de producao, em modo WAL (leitores nao bloqueiam o
+#   escritor), com espera por bloqueio e transacoes IMMEDIATE, que reservam a
+#   escrita no BEGIN em vez de falhar com "database is locked" ao promover o
+#   bloqueio no meio da transacao;
+# - postgres: PostgreSQL com pool de conexoes (psycopg[pool]); com
+#   POSTGRES_POOL_MAX=0 usa conexoes persistentes (CONN_MAX_AGE) sem pool.
+BANCO = os.environ.get('DJANGO_BANCO', 'sqlite')
+
+if BANCO == 'postgres':
+    POSTGRES_POOL_MAX = int(os.environ.get('POSTGRES_POOL_MAX', '10'))
+    DATABASES = {
+        'default': {
+            'ENGINE': 'django.db.backends.postgresql',
+            'NAME': os.environ.get('POSTGRES_DB', 'almoxarifado'),
+            'USER': os.environ.get('POSTGRES_USER', 'almoxarifado'),
+            'PASSWORD': os.environ.get('POSTGRES_PASSWORD', ''),
+            'HOST': os.environ.get('POSTGRES_HOST', 'localhost'),
+            'PORT': os.environ.get('POSTGRES_PORT', '5432'),
+            # O pool ja reaproveita conexoes; CONN_MAX_AGE so vale sem ele.
+            'CONN_MAX_AGE': 0 if POSTGRES_POOL_MAX else int(os.environ.get('POSTGRES_CONN_MAX_AGE', '60')),
+            'CONN_HEALTH_CHECKS': True,
+            'OPTIONS': {
+                'pool': {
+                    'min_size': int(os.environ.get('POSTGRES_POOL_MIN', '2')),
+                    'max_size': POSTGRES_POOL_MAX,
+                    'timeout': 10,
+                },
+            } if POSTGRES_POOL_MAX else {},
+        }
+    }
+elif BANCO == 'sqlite-wal':
+    DATABASES = {
+        'default': {
+            'ENGINE': 'django.db.backends.sqlite3',
+            'NAME': os.environ.get('SQLITE_ARQUIVO', BASE_DIR / 'db.sqlite3'),
+            'OPTIONS': {
+                # Segundos de espera por um bloqueio antes de desistir (busy_timeout).
+                'timeout': int(os.environ.get('SQLITE_TIMEOUT', '20')),
+                'transaction_mode': 'IMMEDIATE',
+                'init_command': (
+                    'PRAGMA journal_mode=WAL;'
+                    'PRAGMA synchronous=NORMAL;'
+                    f"PRAGMA mmap_size={int(os.environ.get('SQLITE_MMAP_MB', '256')) * 1024 * 1024};"
+                    f"PRAGMA cache_size=-{int(os.environ.get('SQLITE_CACHE_MB', '64')) * 1024};"
+                    'PRAGMA temp_store=MEMORY;'
+                ),
+            },
+        }
+    }
+else:
+    DATABASES = {
+        'default': {
+            'ENGINE': 'django.db.backends.sqlite3',
+            'NAME': BASE_DIR / 'db.sqlite3',
+        }
+    }
+
+
+# Cache: mapa de estoques, marcadores de alteracao (ETags) e fragmentos do
+# relatorio. O padrao em memoria e por processo; com varios workers (uvicorn,
+# gunicorn, manage.py worker) use um cache compartilhado.
+CACHE = os.environ.get('DJANGO_CACHE', 'memoria')
+if CACHE == 'redis':
+    CACHES = {
+        'default': {
+            'BACKEND': 'django.core.cache.backends.redis.RedisCache',
+            'LOCATION': os.environ.get('REDIS_URL', 'redis://127.0.0.1:6379/0'),
+        }
+    }
+elif CACHE == 'arquivo':
+    CACHES = {
+        'default': {
+            'BACKEND': 'django.core.cache.backends.filebased.FileBasedCache',
+            'LOCATION': os.environ.get('DJANGO_CACHE_DIR', BASE_DIR / 'cache'),
+        }
+    }
+else:
+    CACHES = {
+        'default': {
+            'BACKEND': 'django.core.cache.backends.locmem.LocMemCache',
+        }
     }
-}
 
 
 # Password validation
@@ -117,6 +199,10 @@ USE_TZ = True
 
 STATIC_URL = 'static/'
 
+# Arquivos gerados pelas tarefas em segundo plano (exportacoes). Nao ha
+# MEDIA_URL: o download passa pela view, que confere o dono da tarefa.
+MEDIA_ROOT = Path(os.environ.get('DJANGO_MEDIA_ROOT', BASE_DIR / 'media'))
+
 # Default primary key field type
 # https://docs.djangoproject.com/en/5.2/ref/settings/#default-auto-field
 
@@ -124,3 +210,22 @@ DEFAULT_AUTO_FIELD = 'django.db.models.BigAutoField'
 
 LOGIN_URL = '/login/'
 LOGOUT_REDIRECT_URL = '/login/'
+
+# Fracao das requisicoes medidas pelo InstrumentacaoMiddleware (0 desliga) e
+# quantas repeticoes do mesmo SQL numa requisicao indicam suspeita de N+1.
+INSTRUMENTACAO_AMOSTRAGEM = float(os.environ.get('INSTRUMENTACAO_AMOSTRAGEM', '0'))
+INSTRUMENTACAO_LIMITE_REPETICOES = 5
+
+# Destino dos alertas de estoque baixo (core.alertas): `log` (padrao),
+# `console` ou `arquivo` (uma linha JSON por alerta em DJANGO_ALERTAS_ARQUIVO).
+# Outros destinos: qualquer classe com enviar(alertas) em BACKEND.
+ALERTAS = os.environ.get('DJANGO_ALERTAS', 'log')
+if ALERTAS == 'arquivo':
+    ALERTAS_ESTOQUE = {
+        'BACKEND': 'core.alertas.NotificadorArquivo',
+        'OPCOES': {'caminho': os.environ.get('DJANGO_ALERTAS_ARQUIVO', BASE_DIR / 'alertas_estoque.jsonl')},
+    }
+elif ALERTAS == 'console':
+    ALERTAS_ESTOQUE = {'BACKEND': 'core.alertas.NotificadorConsole'}
+else:
+    ALERTAS_ESTOQUE = {'BACKEND': 'core.alertas.NotificadorLog'}
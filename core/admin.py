@@ -1,25 +1,135 @@
+from datetime import datetime, timedelta
+
 from django.contrib import admin
+from django.db import transaction
+from django.db.models import Min, QuerySet, Sum
+from django.urls import reverse
+from django.utils import timezone
 
+from .busca import buscar_acessos, filtrar_busca
 from .models import (
     Acesso,
     Almoxarifado,
     Autorizador,
+    EstoqueAlmoxarifado,
     Funcionario,
+    LancamentoEstoque,
     Material,
     Movimentacao,
+    ResumoMensal,
+    Tarefa,
 )
+from .paginacao import PaginadorEstimado
+
+
+class FiltroAutocomplete(admin.RelatedFieldListFilter):
+    """Filtro por FK que nao lista o cadastro inteiro.
+
+    Renderiza so o item escolhido; os demais vem de
+    ``/api/autocomplete/<entidade>/`` conforme o usuario digita, como o
+    ``SelectAutocomplete`` das telas.
+    """
+
+    template = 'admin/core/filtro_autocomplete.html'
+    entidade = None
+
+    def has_output(self):
+        return True
+
+    def field_choices(self, field, request, model_admin):
+        selecionados = [valor for valor in self.lookup_val or [] if str(valor).isdigit()]
+        if not selecionados:
+            return []
+        return [(obj.pk, str(obj)) for obj in field.remote_field.model.objects.filter(pk__in=selecionados)]
+
+    def choices(self, changelist):
+        self.url_autocomplete = reverse('core:api_autocomplete', args=[self.entidade])
+        self.parametros_mantidos = [
+            (nome, valor) for nome, valor in changelist.params.items() if nome not in self.expected_parameters()
+        ]
+        yield from super().choices(changelist)
+
+
+class FiltroMaterial(FiltroAutocomplete):
+    entidade = 'materiais'
+
+
+class DatasPorSaltosQuerySet(QuerySet):
+    """QuerySet cujo ``datetimes`` salta pelo indice da data em vez de agrupar.
+
+    O ``date_hierarchy`` do admin lista anos, meses ou dias com
+    ``SELECT DISTINCT`` sobre a data truncada, que percorre todas as linhas
+    do periodo. Aqui cada item custa um ``MIN`` a partir do inicio do
+    seguinte, resolvido pelo indice: no maximo 32 consultas curtas por nivel.
+    """
+
+    def datetimes(self, field_name, kind, order='ASC', tzinfo=None):
+        if kind not in ('year', 'month', 'day') or order != 'ASC':
+            return super().datetimes(field_name, kind, order, tzinfo)
+        fuso = tzinfo or timezone.get_current_timezone()
+        consulta = self.order_by()
+        datas = []
+        proxima = consulta.aggregate(primeira=Min(field_name))['primeira']
+        while proxima is not None:
+            local = timezone.localtime(proxima, fuso)
+            inicio = datetime(local.year, local.month if kind != 'year' else 1, local.day if kind == 'day' else 1)
+            datas.append(timezone.make_aware(inicio, fuso))
+            if kind == 'day':
+                seguinte = inicio + timedelta(days=1)
+            elif kind == 'month':
+                seguinte = (inicio + timedelta(days=31)).replace(day=1)
+            else:
+                seguinte = inicio.replace(year=inicio.year + 1)
+            filtro = {f'{field_name}__gte': timezone.make_aware(seguinte, fuso)}
+            proxima = consulta.filter(**filtro).aggregate(primeira=Min(field_name))['primeira']
+        return datas
+
+
+class EscalaAdminMixin:
+    """Changelist para tabelas grandes: sem contagem total e com busca pelo indice FTS.
+
+    ``busca_indexada`` lista pares ``(caminho, cadastro)`` pesquisados com
+    ``filtrar_busca``; um registro aparece se casar com qualquer um deles.
+    ``search_fields`` continua declarado para o admin mostrar a caixa de busca.
+    """
+
+    paginator = PaginadorEstimado
+    show_full_result_count = False
+    busca_indexada = ()
+
+    def get_search_results(self, request, queryset, search_term):
+        if not self.busca_indexada or not search_term.strip():
+            return super().get_search_results(request, queryset, search_term)
+        resultado = None
+        for caminho, modelo in self.busca_indexada:
+            filtrado = filtrar_busca(queryset, search_term, modelo=modelo, caminho=caminho)
+            resultado = filtrado if resultado is None else resultado | filtrado
+        return resultado, False
+
+
+class ExclusaoPorObjetoMixin:
+    """``delete_selected`` chamando o ``delete`` de cada objeto.
+
+    O padrao do admin exclui com ``QuerySet.delete``, que nao passa pelo
+    ``delete`` do modelo e deixaria o resumo mensal contando o que saiu.
+    """
+
+    def delete_queryset(self, request, queryset):
+        with transaction.atomic():
+            for objeto in queryset:
+                objeto.delete()
 
 
 @admin.register(Funcionario)
 class FuncionarioAdmin(admin.ModelAdmin):
-    list_display = ('nome',)
-    search_fields = ('nome',)
+    list_display = ('nome', 'matricula')
+    search_fields = ('nome', 'matricula')
 
 
 @admin.register(Autorizador)
 class AutorizadorAdmin(admin.ModelAdmin):
-    list_display = ('nome',)
-    search_fields = ('nome',)
+    list_display = ('nome', 'matricula')
+    search_fields = ('nome', 'matricula')
 
 
 @admin.register(Almoxarifado)
@@ -28,27 +138,98 @@ class AlmoxarifadoAdmin(admin.ModelAdmin):
     search_fields = ('nome', 'localizacao')
 
 
+class EstoqueAlmoxarifadoInline(admin.TabularInline):
+    model = EstoqueAlmoxarifado
+    extra = 0
+
+
 @admin.register(Material)
-class MaterialAdmin(admin.ModelAdmin):
-    list_display = ('nome', 'quantidade_estoque')
+class MaterialAdmin(EscalaAdminMixin, admin.ModelAdmin):
+    list_display = ('nome', 'estoque_total', 'estoque_minimo')
     search_fields = ('nome',)
+    busca_indexada = ((None, Material),)
+    inlines = [EstoqueAlmoxarifadoInline]
+
+    def get_queryset(self, request):
+        return super().get_queryset(request).annotate(estoque_total=Sum('estoques__quantidade'))
+
+    @admin.display(description='Estoque total', ordering='estoque_total')
+    def estoque_total(self, obj):
+        return obj.estoque_total or 0
+
+
+@admin.register(EstoqueAlmoxarifado)
+class EstoqueAlmoxarifadoAdmin(EscalaAdminMixin, admin.ModelAdmin):
+    list_display = ('material', 'almoxarifado', 'quantidade', 'minimo_efetivo', 'abaixo_do_minimo')
+    list_filter = ('abaixo_do_minimo', 'almoxarifado')
+    list_select_related = ('material', 'almoxarifado')
+    search_fields = ('material__nome',)
+    busca_indexada = (('material', Material),)
+    raw_id_fields = ('material',)
 
 
 @admin.register(Acesso)
-class AcessoAdmin(admin.ModelAdmin):
-    list_display = ('funcionario', 'almoxarifado', 'tipo', 'data_hora')
-    list_filter = ('tipo', 'almoxarifado')
+class AcessoAdmin(ExclusaoPorObjetoMixin, EscalaAdminMixin, admin.ModelAdmin):
+    list_display = ('funcionario', 'almoxarifado', 'tipo', 'status', 'data_hora')
+    list_filter = ('tipo', 'status', 'almoxarifado')
+    list_select_related = ('funcionario', 'almoxarifado')
     search_fields = (
         'funcionario__nome',
         'autorizador__nome',
-        'justificativa_padrao',
         'observacao',
     )
+    search_help_text = 'Busca por funcionario, autorizador, almoxarifado, material ou observacao.'
     date_hierarchy = 'data_hora'
+    raw_id_fields = ('funcionario', 'autorizador', 'encerrado_por')
+
+    def get_queryset(self, request):
+        consulta = super().get_queryset(request)
+        return DatasPorSaltosQuerySet(model=consulta.model, query=consulta.query, using=consulta.db)
+
+    def get_search_results(self, request, queryset, search_term):
+        # Mesmo indice da busca do historico (core_acesso_busca).
+        if not search_term.strip():
+            return queryset, False
+        return buscar_acessos(queryset, search_term), False
 
 
 @admin.register(Movimentacao)
-class MovimentacaoAdmin(admin.ModelAdmin):
+class MovimentacaoAdmin(ExclusaoPorObjetoMixin, EscalaAdminMixin, admin.ModelAdmin):
     list_display = ('material', 'tipo', 'quantidade', 'acesso')
-    list_filter = ('tipo', 'material')
+    list_filter = ('tipo', ('material', FiltroMaterial), 'acesso__almoxarifado')
+    # Sem isso o admin usa ``select_related()`` completo, que junta todas as FKs do acesso.
+    list_select_related = ('material', 'acesso__funcionario')
     search_fields = ('material__nome', 'acesso__funcionario__nome')
+    busca_indexada = (('material', Material), ('acesso__funcionario', Funcionario))
+    # A ordem padrao do modelo (data do acesso) exige ordenar o JOIN inteiro; o id segue a ordem de gravacao.
+    ordering = ('-id',)
+    raw_id_fields = ('acesso', 'material')
+
+
+@admin.register(ResumoMensal)
+class ResumoMensalAdmin(admin.ModelAdmin):
+    list_display = ('ano', 'mes', 'almoxarifado', 'funcionario', 'material', 'tipo', 'quantidade', 'total_movimentacoes')
+    list_filter = ('ano', 'mes', 'tipo')
+    list_select_related = ('almoxarifado', 'funcionario', 'material')
+
+
+@admin.register(LancamentoEstoque)
+class LancamentoEstoqueAdmin(EscalaAdminMixin, admin.ModelAdmin):
+    list_display = ('material', 'origem', 'delta', 'almoxarifado', 'criado_em')
+    list_filter = ('origem', ('material', FiltroMaterial))
+    list_select_related = ('material', 'almoxarifado')
+    raw_id_fields = ('material', 'almoxarifado', 'movimentacao')
+
+    def has_change_permission(self, request, obj=None):
+        return False
+
+    def has_delete_permission(self, request, obj=None):
+        return False
+
+
+@admin.register(Tarefa)
+class TarefaAdmin(admin.ModelAdmin):
+    list_display = ('id', 'tipo', 'status', 'progresso', 'criado_por', 'criado_em', 'concluido_em')
+    list_filter = ('status', 'tipo')
+    list_select_related = ('criado_por',)
+    readonly_fields = ('worker', 'tentativas', 'iniciado_em', 'atualizado_em', 'concluido_em')
@@ -0,0 +1,99 @@
+"""Alertas de estoque baixo e os notificadores que os entregam.
+
+``EstoqueAlmoxarifado.enviar_alertas`` monta um ``AlertaEstoque`` para cada
+saldo que acabou de ficar abaixo do minimo e chama ``notificar``, que usa o
+notificador de ``settings.ALERTAS_ESTOQUE``::
+
+    ALERTAS_ESTOQUE = {'BACKEND': 'core.alertas.NotificadorArquivo', 'OPCOES': {'caminho': 'alertas.jsonl'}}
+
+Um notificador e uma subclasse de ``Notificador`` que implementa
+``enviar(alertas)``; as ``OPCOES`` vao para o construtor. Os alertas chegam
+depois do commit, entao uma falha na entrega fica no log e nao desfaz a
+movimentacao; os alertas nao entregues voltam a ficar pendentes.
+"""
+
+import json
+import logging
+import sys
+from abc import ABC, abstractmethod
+from dataclasses import asdict, dataclass
+
+from django.conf import settings
+from django.utils import timezone
+from django.utils.module_loading import import_string
+
+logger = logging.getLogger(__name__)
+
+
+@dataclass(frozen=True)
+class AlertaEstoque:
+    material_id: int
+    material: str
+    almoxarifado_id: int
+    almoxarifado: str
+    quantidade: int
+    minimo: int
+
+    @property
+    def mensagem(self) -> str:
+        return (
+            f'Estoque baixo: {self.material} com {self.quantidade} unidades em {self.almoxarifado} '
+            f'(minimo {self.minimo}).'
+        )
+
+
+class Notificador(ABC):
+    @abstractmethod
+    def enviar(self, alertas: list[AlertaEstoque]) -> None:
+        """Entrega ``alertas``; uma excecao deixa todos pendentes para o proximo envio."""
+
+
+class NotificadorLog(Notificador):
+    """Padrao: um aviso no logger ``core.alertas`` por alerta."""
+
+    def enviar(self, alertas):
+        for alerta in alertas:
+            logger.warning(alerta.mensagem)
+
+
+class NotificadorConsole(Notificador):
+    """Escreve as mensagens na saida padrao; util em desenvolvimento e testes."""
+
+    def __init__(self, saida=None):
+        self.saida = saida
+
+    def enviar(self, alertas):
+        saida = self.saida or sys.stdout
+        for alerta in alertas:
+            saida.write(alerta.mensagem + '\n')
+        saida.flush()
+
+
+class NotificadorArquivo(Notificador):
+    """Acrescenta uma linha JSON por alerta em ``caminho``."""
+
+    def __init__(self, caminho):
+        self.caminho = caminho
+
+    def enviar(self, alertas):
+        agora = timezone.now().isoformat()
+        with open(self.caminho, 'a', encoding='utf-8') as arquivo:
+            for alerta in alertas:
+                arquivo.write(json.dumps({'em': agora, **asdict(alerta)}, ensure_ascii=False) + '\n')
+
+
+def notificador() -> Notificador:
+    configuracao = getattr(settings, 'ALERTAS_ESTOQUE', None) or {'BACKEND': 'core.alertas.NotificadorLog'}
+    return import_string(configuracao['BACKEND'])(**configuracao.get('OPCOES', {}))
+
+
+def notificar(alertas: list[AlertaEstoque]) -> bool:
+    """Entrega ``alertas`` e retorna se deu certo; a falha fica no log."""
+    if not alertas:
+        return True
+    try:
+        notificador().enviar(alertas)
+    except Exception:
+        logger.exception('Falha ao entregar %s alertas de estoque baixo', len(alertas))
+        return False
+    return True
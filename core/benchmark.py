@@ -0,0 +1,319 @@
+"""Cenarios de benchmark das telas principais.
+
+Cada cenario monta uma requisicao (a preparacao nao entra no tempo), executa
+com o ``Client`` de teste e registra a latencia e o numero de consultas. Tudo
+roda dentro de uma transacao desfeita no final, entao o banco nao muda entre
+execucoes. A captura de consultas adiciona um pequeno custo fixo a cada SQL.
+
+``comparar_wsgi_asgi`` mede outra coisa: a vazao das telas de leitura sob
+requisicoes simultaneas, pelos handlers WSGI e ASGI.
+"""
+
+import asyncio
+import sys
+import time
+import uuid
+from concurrent.futures import ThreadPoolExecutor
+from dataclasses import dataclass
+from io import BytesIO
+from typing import Callable
+
+from django.conf import settings
+from django.contrib.auth import get_user_model
+from django.core.asgi import get_asgi_application
+from django.core.wsgi import get_wsgi_application
+from django.db import connection, transaction
+from django.test import Client, override_settings
+from django.test.utils import CaptureQueriesContext
+from django.urls import reverse
+from django.utils import timezone
+
+from .desempenho import percentil
+from .models import Acesso, Almoxarifado, Autorizador, Funcionario, Material, Movimentacao
+
+
+@dataclass
+class Cenario:
+    nome: str
+    orcamento_consultas: int
+    preparar: Callable[[dict], tuple]
+    """Recebe o contexto e devolve ``(metodo, url, dados)``."""
+
+
+def _novo_acesso(contexto, movimentacoes=0):
+    contexto['sequencia'] += 1
+    acesso = Acesso.objects.create(
+        funcionario=Funcionario.objects.create(nome=f"Benchmark {contexto['sequencia']}"),
+        autorizador_id=contexto['autorizador'],
+        almoxarifado_id=contexto['almoxarifado'],
+        tipo=Acesso.Tipo.ENTRADA,
+    )
+    for _ in range(movimentacoes):
+        Movimentacao.objects.create(
+            acesso=acesso, material_id=contexto['material'], quantidade=1, tipo=Movimentacao.Tipo.DEVOLUCAO
+        )
+    return acesso
+
+
+def _get(nome_url, **params):
+    return lambda contexto: ('get', reverse(nome_url), {chave: valor(contexto) for chave, valor in params.items()})
+
+
+def _registrar_movimentacao(contexto):
+    acesso = _novo_acesso(contexto)
+    dados = {'acesso': acesso.id, 'material': contexto['material'], 'quantidade': 1, 'tipo': 'retirada'}
+    return 'post', reverse('core:registrar_movimentacao_por_acesso', args=[acesso.id]), dados
+
+
+def _encerrar_acesso(contexto):
+    acesso = _novo_acesso(contexto, movimentacoes=3)
+    return 'post', reverse('core:encerrar_acesso', args=[acesso.id]), {}
+
+
+def _admin(modelo):
+    return lambda contexto: ('get', reverse(f'admin:core_{modelo}_changelist'), {})
+
+
+CENARIOS = [
+    Cenario('historico', 7, _get('core:historico')),
+    Cenario(
+        'historico_filtrado',
+        7,
+        _get('core:historico', status=lambda c: 'FECHADO', data_inicio=lambda c: c['mes_anterior']),
+    ),
+    Cenario('historico_busca', 7, _get('core:historico', q=lambda c: c['termo_busca'])),
+    Cenario('relatorio_mensal', 8, _get('core:relatorio_mensal', mes=lambda c: c['mes'], ano=lambda c: c['ano'])),
+    Cenario(
+        'relatorio_mensal_filtrado',
+        10,
+        _get(
+            'core:relatorio_mensal',
+            mes=lambda c: c['mes'],
+            ano=lambda c: c['ano'],
+            almoxarifado=lambda c: c['almoxarifado'],
+        ),
+    ),
+    Cenario('registrar_movimentacao', 16, _registrar_movimentacao),
+    Cenario('encerrar_acesso', 14, _encerrar_acesso),
+    # O date_hierarchy faz um MIN por ano com acessos (ver DatasPorSaltosQuerySet).
+    Cenario('admin_acessos', 12, _admin('acesso')),
+    Cenario('admin_movimentacoes', 7, _admin('movimentacao')),
+    Cenario('admin_materiais', 7, _admin('material')),
+    Cenario('admin_lancamentos', 7, _admin('lancamentoestoque')),
+]
+
+
+def _contexto():
+    material = Material.objects.order_by('id').first()
+    almoxarifado = Almoxarifado.objects.order_by('id').first()
+    autorizador = Autorizador.objects.order_by('id').first()
+    if not (material and almoxarifado and autorizador):
+        raise ValueError('O banco precisa de materiais, almoxarifados e autorizadores (use gerar_dados_sinteticos).')
+    ultimo = Acesso.objects.order_by('-data_hora').values_list('data_hora', flat=True).first() or timezone.now()
+    ultimo = timezone.localtime(ultimo)
+    return {
+        'material': material.id,
+        'termo_busca': material.nome.split()[0],
+        'almoxarifado': almoxarifado.id,
+        'autorizador': autorizador.id,
+        'mes': str(ultimo.month),
+        'ano': str(ultimo.year),
+        'mes_anterior': (ultimo - timezone.timedelta(days=30)).date().isoformat(),
+        'sequencia': 0,
+    }
+
+
+def tamanho_do_banco():
+    return {
+        'acessos': Acesso.objects.count(),
+        'movimentacoes': Movimentacao.objects.count(),
+        'materiais': Material.objects.count(),
+        'funcionarios': Funcionario.objects.count(),
+    }
+
+
+def executar_benchmark(cenarios=None, *, repeticoes=20, aquecimento=2):
+    """Roda os cenarios e devolve ``{nome: metricas}``; o banco nao e alterado."""
+    cenarios = cenarios or CENARIOS
+    resultados = {}
+    with override_settings(ALLOWED_HOSTS=['*'], INSTRUMENTACAO_AMOSTRAGEM=0), transaction.atomic():
+        contexto = _contexto()
+        usuario = get_user_model().objects.create_superuser('benchmark', password=None)
+        cliente = Client()
+        cliente.force_login(usuario)
+        for cenario in cenarios:
+            duracoes = []
+            consultas = []
+            for execucao in range(aquecimento + repeticoes):
+                metodo, url, dados = cenario.preparar(contexto)
+                with CaptureQueriesContext(connection) as capturadas:
+                    inicio = time.perf_counter()
+                    response = getattr(cliente, metodo)(url, dados)
+                    duracao = (time.perf_counter() - inicio) * 1000
+                if response.status_code >= 400:
+                    raise RuntimeError(f'{cenario.nome}: {metodo.upper()} {url} respondeu {response.status_code}')
+                if execucao >= aquecimento:
+                    duracoes.append(duracao)
+                    consultas.append(len(capturadas))
+            duracoes.sort()
+            resultados[cenario.nome] = {
+                'p50_ms': round(percentil(duracoes, 50), 2),
+                'p95_ms': round(percentil(duracoes, 95), 2),
+                'p99_ms': round(percentil(duracoes, 99), 2),
+                'media_ms': round(sum(duracoes) / len(duracoes), 2),
+                'consultas': max(consultas),
+                'orcamento_consultas': cenario.orcamento_consultas,
+                'dentro_orcamento': max(consultas) <= cenario.orcamento_consultas,
+            }
+        transaction.set_rollback(True)
+    return resultados
+
+
+def comparar(atual, base, *, tolerancia=0.2):
+    """Lista as regressoes de ``atual`` em relacao a ``base`` (p95 acima da tolerancia ou mais consultas)."""
+    regressoes = []
+    for nome, metricas in atual.items():
+        anterior = base.get(nome)
+        if not anterior:
+            continue
+        if metricas['p95_ms'] > anterior['p95_ms'] * (1 + tolerancia):
+            regressoes.append(f"{nome}: p95 {anterior['p95_ms']:.1f} -> {metricas['p95_ms']:.1f} ms")
+        if metricas['consultas'] > anterior['consultas']:
+            regressoes.append(f"{nome}: consultas {anterior['consultas']} -> {metricas['consultas']}")
+    return regressoes
+
+
+def _ambiente_wsgi(caminho, consulta, cookie):
+    return {
+        'REQUEST_METHOD': 'GET',
+        'SCRIPT_NAME': '',
+        'PATH_INFO': caminho,
+        'QUERY_STRING': consulta,
+        'SERVER_NAME': 'localhost',
+        'SERVER_PORT': '80',
+        'SERVER_PROTOCOL': 'HTTP/1.1',
+        'HTTP_HOST': 'localhost',
+        'HTTP_COOKIE': cookie,
+        'REMOTE_ADDR': '127.0.0.1',
+        'wsgi.version': (1, 0),
+        'wsgi.url_scheme': 'http',
+        'wsgi.input': BytesIO(),
+        'wsgi.errors': sys.stderr,
+        'wsgi.multithread': True,
+        'wsgi.multiprocess': False,
+        'wsgi.run_once': False,
+    }
+
+
+def _requisicao_wsgi(aplicacao, caminho, consulta, cookie):
+    status = []
+    inicio = time.perf_counter()
+    corpo = aplicacao(_ambiente_wsgi(caminho, consulta, cookie), lambda s, cabecalhos: status.append(s))
+    try:
+        b''.join(corpo)
+    finally:
+        if hasattr(corpo, 'close'):
+            corpo.close()
+    return int(status[0].split()[0]), (time.perf_counter() - inicio) * 1000
+
+
+async def _requisicao_asgi(aplicacao, caminho, consulta, cookie):
+    escopo = {
+        'type': 'http',
+        'asgi': {'version': '3.0'},
+        'http_version': '1.1',
+        'method': 'GET',
+        'scheme': 'http',
+        'path': caminho,
+        'raw_path': caminho.encode(),
+        'query_string': consulta.encode(),
+        'root_path': '',
+        'headers': [(b'host', b'localhost'), (b'cookie', cookie.encode())],
+        'client': ('127.0.0.1', 0),
+        'server': ('localhost', 80),
+    }
+    corpo_enviado = False
+
+    async def receber():
+        nonlocal corpo_enviado
+        if not corpo_enviado:
+            corpo_enviado = True
+            return {'type': 'http.request', 'body': b'', 'more_body': False}
+        # O cliente nunca desconecta; o handler cancela esta espera ao responder.
+        await asyncio.Event().wait()
+
+    status = []
+
+    async def enviar(mensagem):
+        if mensagem['type'] == 'http.response.start':
+            status.append(mensagem['status'])
+
+    inicio = time.perf_counter()
+    await aplicacao(escopo, receber, enviar)
+    return status[0], (time.perf_counter() - inicio) * 1000
+
+
+def _medir_wsgi(url, cookie, concorrencia, requisicoes):
+    aplicacao = get_wsgi_application()
+    caminho, _, consulta = url.partition('?')
+    with ThreadPoolExecutor(max_workers=concorrencia) as executor:
+        inicio = time.perf_counter()
+        resultados = list(
+            executor.map(lambda _: _requisicao_wsgi(aplicacao, caminho, consulta, cookie), range(requisicoes))
+        )
+        return resultados, time.perf_counter() - inicio
+
+
+def _medir_asgi(url, cookie, concorrencia, requisicoes):
+    aplicacao = get_asgi_application()
+    caminho, _, consulta = url.partition('?')
+
+    async def rodar():
+        limite = asyncio.Semaphore(concorrencia)
+
+        async def uma():
+            async with limite:
+                return await _requisicao_asgi(aplicacao, caminho, consulta, cookie)
+
+        inicio = time.perf_counter()
+        resultados = await asyncio.gather(*(uma() for _ in range(requisicoes)))
+        return resultados, time.perf_counter() - inicio
+
+    return asyncio.run(rodar())
+
+
+def comparar_wsgi_asgi(urls, *, concorrencia=16, requisicoes=200, aquecimento=10):
+    """Vazao e latencia de cada URL servida pelo handler WSGI e pelo ASGI do Django.
+
+    O WSGI atende ``concorrencia`` requisicoes simultaneas em threads (como o
+    gunicorn com ``--threads``); o ASGI atende o mesmo numero em um unico loop
+    de eventos (como um worker do uvicorn). As requisicoes vao direto aos
+    handlers, sem servidor HTTP, e usam um superusuario temporario, removido
+    no final. Devolve ``{url: {'wsgi': metricas, 'asgi': metricas}}``.
+    """
+    usuario = get_user_model().objects.create_superuser(f'benchmark-{uuid.uuid4().hex[:8]}', password=None)
+    cliente = Client()
+    cliente.force_login(usuario)
+    cookie = f'{settings.SESSION_COOKIE_NAME}={cliente.session.session_key}'
+    resultados = {}
+    try:
+        with override_settings(INSTRUMENTACAO_AMOSTRAGEM=0):
+            for url in urls:
+                resultados[url] = {}
+                for modo, medir in (('wsgi', _medir_wsgi), ('asgi', _medir_asgi)):
+                    medir(url, cookie, concorrencia, aquecimento)
+                    respostas, segundos = medir(url, cookie, concorrencia, requisicoes)
+                    erros = [status for status, _ in respostas if status != 200]
+                    if erros:
+                        raise RuntimeError(f'{modo.upper()} {url} respondeu {erros[0]}')
+                    duracoes = sorted(duracao for _, duracao in respostas)
+                    resultados[url][modo] = {
+                        'req_s': round(requisicoes / segundos, 1),
+                        'p50_ms': round(percentil(duracoes, 50), 2),
+                        'p95_ms': round(percentil(duracoes, 95), 2),
+                        'p99_ms': round(percentil(duracoes, 99), 2),
+                    }
+    finally:
+        cliente.logout()
+        usuario.delete()
+    return resultados
@@ -0,0 +1,93 @@
+"""Busca por prefixo de palavras nos cadastros e no historico de acessos.
+
+No SQLite com FTS5 a busca usa as tabelas ``<tabela>_busca`` criadas pelas
+migracoes 0010 e 0011 (mantidas por triggers); em outros bancos cai em
+``icontains`` por palavra.
+"""
+
+import re
+
+from django.db import connection
+from django.db.models import FloatField, Q, Value
+from django.db.models.expressions import RawSQL
+
+_PALAVRAS = re.compile(r'\w+')
+_tabelas_fts = {}
+
+# Pesos do bm25 por coluna de core_acesso_busca: funcionario, autorizador,
+# almoxarifado, materiais, observacao.
+PESOS_HISTORICO = (10.0, 5.0, 2.0, 3.0, 1.0)
+
+
+def fts_disponivel(tabela: str) -> bool:
+    if tabela not in _tabelas_fts:
+        _tabelas_fts[tabela] = (
+            connection.vendor == 'sqlite'
+            and f'{tabela}_busca' in connection.introspection.table_names()
+        )
+    return _tabelas_fts[tabela]
+
+
+def expressao_fts(texto: str) -> str:
+    """``cabo flex`` vira ``"cabo"* "flex"*``: todas as palavras, cada uma como prefixo."""
+    return ' '.join(f'"{palavra}"*' for palavra in _PALAVRAS.findall(texto or ''))
+
+
+def filtrar_busca(queryset, texto: str, *, modelo=None, caminho: str | None = None):
+    """Restringe ``queryset`` aos registros cujo cadastro casa com ``texto``.
+
+    ``modelo`` e o cadastro pesquisado (padrao: o modelo do queryset) e
+    ``caminho`` a FK que leva ate ele, por exemplo ``funcionario`` para filtrar
+    acessos pelo nome do funcionario.
+    """
+    modelo = modelo or queryset.model
+    expressao = expressao_fts(texto)
+    if not expressao:
+        return queryset
+    prefixo = f'{caminho}__' if caminho else ''
+    tabela = modelo._meta.db_table
+    if fts_disponivel(tabela):
+        busca = f'{tabela}_busca'
+        return queryset.filter(
+            **{f'{prefixo}pk__in': RawSQL(f'SELECT rowid FROM {busca} WHERE {busca} MATCH %s', [expressao])}
+        )
+    filtro = Q()
+    for palavra in _PALAVRAS.findall(texto):
+        filtro &= Q(**{f'{prefixo}nome__icontains': palavra})
+    return queryset.filter(filtro)
+
+
+def buscar_acessos(queryset, texto: str):
+    """Filtra acessos pelo indice do historico e anota ``relevancia``.
+
+    ``relevancia`` e o bm25 do FTS5 (quanto menor, mais relevante); sem FTS5
+    todas as linhas ficam com relevancia zero.
+    """
+    expressao = expressao_fts(texto)
+    if not expressao:
+        return queryset
+    if fts_disponivel('core_acesso'):
+        pesos = ', '.join(str(peso) for peso in PESOS_HISTORICO)
+        # O bm25 so existe numa consulta com MATCH: a relevancia de cada
+        # acesso vem de uma subconsulta pelo rowid, no mesmo indice do filtro.
+        return queryset.filter(
+            id__in=RawSQL('SELECT rowid FROM core_acesso_busca WHERE core_acesso_busca MATCH %s', [expressao])
+        ).annotate(
+            relevancia=RawSQL(
+                f'(SELECT bm25(core_acesso_busca, {pesos}) FROM core_acesso_busca'
+                ' WHERE core_acesso_busca MATCH %s AND core_acesso_busca.rowid = core_acesso.id)',
+                [expressao],
+                output_field=FloatField(),
+            )
+        )
+    filtro = Q()
+    for palavra in _PALAVRAS.findall(texto):
+        filtro &= (
+            Q(funcionario__nome__icontains=palavra)
+            | Q(autorizador__nome__icontains=palavra)
+            | Q(almoxarifado__nome__icontains=palavra)
+            | Q(movimentacao__material__nome__icontains=palavra)
+            | Q(observacao__icontains=palavra)
+        )
+    encontrados = queryset.model.objects.filter(filtro).values('pk')
+    return queryset.filter(pk__in=encontrados).annotate(relevancia=Value(0.0, output_field=FloatField()))
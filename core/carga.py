@@ -0,0 +1,135 @@
+"""Teste de carga de retiradas concorrentes.
+
+Varias threads, cada uma com a propria conexao e o proprio acesso aberto,
+registram retiradas do mesmo material ao mesmo tempo. O estoque inicial cobre
+exatamente todas as retiradas, entao qualquer falha e de concorrencia: com o
+perfil ``sqlite-wal`` nenhuma deve terminar em "database is locked". Os
+cadastros criados sao removidos no final.
+"""
+
+import threading
+import time
+import uuid
+from dataclasses import dataclass, field
+
+from django.core.exceptions import ValidationError
+from django.db import OperationalError, connection
+from django.db.models import Sum
+
+from .desempenho import percentil
+from .models import (
+    Acesso,
+    Almoxarifado,
+    Autorizador,
+    EstoqueAlmoxarifado,
+    Funcionario,
+    LancamentoEstoque,
+    Material,
+    Movimentacao,
+)
+
+
+@dataclass
+class ResultadoCarga:
+    retiradas: int = 0
+    bloqueios: int = 0
+    sem_estoque: int = 0
+    outros_erros: list = field(default_factory=list)
+    duracoes_ms: list = field(default_factory=list)
+    segundos: float = 0.0
+    estoque_esperado: int = 0
+    estoque_final: int = 0
+    saldo_livro: int = 0
+
+    @property
+    def consistente(self) -> bool:
+        return self.estoque_final == self.estoque_esperado == self.saldo_livro
+
+    @property
+    def ok(self) -> bool:
+        return not self.bloqueios and not self.sem_estoque and not self.outros_erros and self.consistente
+
+    def latencia(self, p: float) -> float:
+        return percentil(sorted(self.duracoes_ms), p)
+
+
+def _preparar(threads: int, estoque: int):
+    sufixo = uuid.uuid4().hex[:8]
+    autorizador = Autorizador.objects.create(nome=f'Carga {sufixo}')
+    almoxarifado = Almoxarifado.objects.create(nome=f'Carga {sufixo}')
+    material = Material.objects.create(nome=f'Carga {sufixo}')
+    EstoqueAlmoxarifado.objects.create(material=material, almoxarifado=almoxarifado, quantidade=estoque)
+    funcionarios = [Funcionario.objects.create(nome=f'Carga {sufixo} {i}') for i in range(threads)]
+    acessos = [
+        Acesso.objects.create(
+            funcionario=funcionario,
+            autorizador=autorizador,
+            almoxarifado=almoxarifado,
+            tipo=Acesso.Tipo.ENTRADA,
+        )
+        for funcionario in funcionarios
+    ]
+    return autorizador, almoxarifado, material, funcionarios, acessos
+
+
+def _limpar(autorizador, almoxarifado, material, funcionarios):
+    # Funcionarios levam os acessos e as movimentacoes; o material leva o livro.
+    Funcionario.objects.filter(pk__in=[f.pk for f in funcionarios]).delete()
+    material.delete()
+    almoxarifado.delete()
+    autorizador.delete()
+
+
+def executar_carga(*, threads: int = 8, retiradas_por_thread: int = 25, quantidade: int = 1, manter=False):
+    total = threads * retiradas_por_thread
+    estoque_inicial = total * quantidade
+    autorizador, almoxarifado, material, funcionarios, acessos = _preparar(threads, estoque_inicial)
+    resultado = ResultadoCarga()
+    trava = threading.Lock()
+    largada = threading.Barrier(threads)
+
+    def trabalhar(acesso):
+        try:
+            largada.wait()
+            for _ in range(retiradas_por_thread):
+                inicio = time.perf_counter()
+                try:
+                    Movimentacao.objects.create(
+                        acesso=acesso, material=material, quantidade=quantidade, tipo=Movimentacao.Tipo.RETIRADA
+                    )
+                except OperationalError as exc:
+                    with trava:
+                        if 'locked' in str(exc):
+                            resultado.bloqueios += 1
+                        else:
+                            resultado.outros_erros.append(repr(exc))
+                    continue
+                except ValidationError:
+                    with trava:
+                        resultado.sem_estoque += 1
+                    continue
+                with trava:
+                    resultado.retiradas += 1
+                    resultado.duracoes_ms.append((time.perf_counter() - inicio) * 1000)
+        finally:
+            connection.close()
+
+    inicio = time.perf_counter()
+    trabalhadores = [threading.Thread(target=trabalhar, args=(acesso,)) for acesso in acessos]
+    for trabalhador in trabalhadores:
+        trabalhador.start()
+    for trabalhador in trabalhadores:
+        trabalhador.join()
+    resultado.segundos = time.perf_counter() - inicio
+
+    resultado.estoque_esperado = estoque_inicial - resultado.retiradas * quantidade
+    resultado.estoque_final = EstoqueAlmoxarifado.objects.get(material=material, almoxarifado=almoxarifado).quantidade
+    resultado.saldo_livro = estoque_inicial + (
+        LancamentoEstoque.objects.filter(material=material, movimentacao__isnull=False).aggregate(
+            total=Sum('delta')
+        )['total']
+        or 0
+    )
+    if not manter:
+        _limpar(autorizador, almoxarifado, material, funcionarios)
+    return resultado
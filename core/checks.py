@@ -0,0 +1,35 @@
+"""Verificacoes de sistema do app ``core``."""
+
+from django.core.checks import Error, Tags, register
+from django.db.migrations.loader import MigrationLoader
+
+MIGRACAO_BUSCA = ('core', '0011_busca_acessos')
+
+
+@register(Tags.database)
+def migracoes_preservam_busca(app_configs, **kwargs):
+    """Migracoes depois dos triggers de busca devem envolver as tabelas deles com ``_busca``.
+
+    No SQLite, recriar uma dessas tabelas sem o par ``remover_buscas`` /
+    ``criar_buscas`` falha com "no such table" ou perde os triggers da tabela.
+    Roda com ``migrate`` e com os testes (verificacoes de banco).
+    """
+    from .migrations import _busca
+
+    loader = MigrationLoader(None, ignore_no_migrations=True)
+    if MIGRACAO_BUSCA not in loader.graph.nodes:
+        return []
+    erros = []
+    for chave, migracao in loader.graph.nodes.items():
+        if chave[0] != 'core' or MIGRACAO_BUSCA not in loader.graph.forwards_plan(chave):
+            continue
+        for operacao in _busca.desprotegidas(migracao.operations):
+            erros.append(
+                Error(
+                    f'{chave[1]}: "{operacao.describe()}" pode recriar uma tabela com triggers de busca.',
+                    hint='Envolva a operacao com RunPython(remover_buscas, criar_buscas) antes e '
+                    'RunPython(criar_buscas, remover_buscas) depois (core/migrations/_busca.py).',
+                    id='core.E001',
+                )
+            )
+    return erros
@@ -0,0 +1,211 @@
+"""Conciliacao do estoque com o historico de movimentacoes.
+
+``EstoqueAlmoxarifado`` e o livro ``LancamentoEstoque`` sao mantidos por
+``Movimentacao.save``; edicoes pelo admin, exclusoes de movimentacoes e SQL
+direto podem desalinhar os dois do historico. O saldo esperado de um material
+em um almoxarifado e a soma dos ajustes de saldo da unidade (estoque inicial,
+admin) com as movimentacoes atuais dos acessos dela.
+
+A conferencia e feita por faixas de ids de material, cada uma com quatro
+consultas agrupadas curtas, distribuidas num pool de processos. So os saldos
+divergentes sao conferidos de novo com a linha do saldo bloqueada, o que
+descarta falsos positivos de movimentacoes gravadas durante a leitura, e
+opcionalmente corrigidos.
+"""
+
+import multiprocessing
+import os
+import time
+from concurrent.futures import ProcessPoolExecutor
+from dataclasses import dataclass, field
+
+import django
+from django.db import connections, transaction
+from django.db.models import Case, F, Sum, When
+
+from .models import Almoxarifado, EstoqueAlmoxarifado, LancamentoEstoque, Material, Movimentacao
+
+# Materiais por faixa. Faixas pequenas equilibram o pool quando poucos
+# materiais concentram a maior parte das movimentacoes.
+TAMANHO_FAIXA = 100
+
+
+@dataclass
+class Divergencia:
+    material_id: int
+    almoxarifado_id: int
+    nome: str
+    almoxarifado: str
+    contador: int
+    livro: int
+    esperado: int
+
+    @property
+    def negativo(self) -> bool:
+        # O saldo nao aceita negativos; a unidade fica com zero e precisa ser conferida.
+        return self.esperado < 0
+
+
+@dataclass
+class ResultadoConciliacao:
+    materiais: int = 0
+    faixas: int = 0
+    processos: int = 1
+    divergencias: list[Divergencia] = field(default_factory=list)
+    corrigidas: int = 0
+    segundos: float = 0.0
+
+
+def faixas_de_materiais(tamanho: int = TAMANHO_FAIXA) -> list[tuple[int, int]]:
+    """Divide os ids de material em faixas ``(primeiro, ultimo)`` de ate ``tamanho`` materiais."""
+    ids = list(Material.objects.order_by('pk').values_list('pk', flat=True))
+    return [(ids[i], ids[min(i + tamanho, len(ids)) - 1]) for i in range(0, len(ids), tamanho)]
+
+
+def _somas(consulta, expressao, almoxarifado='almoxarifado') -> dict[tuple[int, int], int]:
+    return {
+        (material_id, almoxarifado_id): total
+        for material_id, almoxarifado_id, total in consulta.order_by()
+        .values('material', almoxarifado)
+        .annotate(total=Sum(expressao))
+        .values_list('material', almoxarifado, 'total')
+        if almoxarifado_id is not None
+    }
+
+
+def conferir_faixa(primeiro: int, ultimo: int, almoxarifado_id: int | None = None) -> tuple[int, list[Divergencia]]:
+    """Confere os saldos dos materiais com id entre ``primeiro`` e ``ultimo``.
+
+    Retorna quantos materiais foram conferidos e os saldos divergentes, por
+    almoxarifado: contador diferente do saldo esperado (zero, se negativo) ou
+    livro diferente dele. ``almoxarifado_id`` restringe a uma unidade.
+    """
+    faixa = {'material_id__gte': primeiro, 'material_id__lte': ultimo}
+    movimentacoes = Movimentacao.objects.filter(**faixa)
+    lancamentos = LancamentoEstoque.objects.filter(**faixa)
+    estoques = EstoqueAlmoxarifado.objects.filter(**faixa)
+    if almoxarifado_id is not None:
+        movimentacoes = movimentacoes.filter(acesso__almoxarifado_id=almoxarifado_id)
+        lancamentos = lancamentos.filter(almoxarifado_id=almoxarifado_id)
+        estoques = estoques.filter(almoxarifado_id=almoxarifado_id)
+    movimentacoes = _somas(
+        movimentacoes,
+        Case(When(tipo=Movimentacao.Tipo.DEVOLUCAO, then=F('quantidade')), default=-F('quantidade')),
+        almoxarifado='acesso__almoxarifado',
+    )
+    ajustes = _somas(lancamentos.filter(origem=LancamentoEstoque.Origem.AJUSTE), 'delta')
+    livro = _somas(lancamentos, 'delta')
+    contadores = {
+        (material_id, unidade): quantidade
+        for material_id, unidade, quantidade in estoques.values_list('material', 'almoxarifado', 'quantidade')
+    }
+
+    materiais = dict(Material.objects.filter(pk__gte=primeiro, pk__lte=ultimo).values_list('pk', 'nome'))
+    almoxarifados = dict(Almoxarifado.objects.values_list('pk', 'nome'))
+    divergencias = []
+    for chave in sorted(contadores.keys() | movimentacoes.keys() | ajustes.keys() | livro.keys()):
+        material_id, almoxarifado = chave
+        if material_id not in materiais:
+            continue
+        esperado = ajustes.get(chave, 0) + movimentacoes.get(chave, 0)
+        contador = contadores.get(chave, 0)
+        saldo_livro = livro.get(chave, 0)
+        if contador != max(esperado, 0) or saldo_livro != esperado:
+            divergencias.append(
+                Divergencia(
+                    material_id,
+                    almoxarifado,
+                    materiais[material_id],
+                    almoxarifados.get(almoxarifado, ''),
+                    contador,
+                    saldo_livro,
+                    esperado,
+                )
+            )
+    return len(materiais), divergencias
+
+
+def _confirmar(material_id: int, almoxarifado_id: int, corrigir: bool) -> Divergencia | None:
+    """Confere o saldo de novo com a linha bloqueada e, se pedido, corrige.
+
+    Movimentacoes concorrentes esperam o bloqueio para atualizar o saldo,
+    entao o valor gravado aqui so recebe os deltas confirmados depois.
+    """
+    with transaction.atomic():
+        estoque = EstoqueAlmoxarifado.objects.select_for_update().filter(
+            material_id=material_id, almoxarifado_id=almoxarifado_id
+        )
+        existe = estoque.exists()
+        _, divergencias = conferir_faixa(material_id, material_id, almoxarifado_id)
+        if not divergencias:
+            return None
+        divergencia = divergencias[0]
+        if corrigir:
+            if divergencia.livro != divergencia.esperado:
+                LancamentoEstoque.objects.create(
+                    material_id=material_id,
+                    almoxarifado_id=almoxarifado_id,
+                    origem=LancamentoEstoque.Origem.CONCILIACAO,
+                    delta=divergencia.esperado - divergencia.livro,
+                )
+            saldo = max(divergencia.esperado, 0)
+            if divergencia.contador != saldo:
+                # ``update``/``bulk_create`` nao passam pelo ``save``, que gravaria um ajuste no livro.
+                if existe:
+                    estoque.update(quantidade=saldo)
+                    EstoqueAlmoxarifado.reclassificar(estoque)
+                else:
+                    EstoqueAlmoxarifado.objects.bulk_create(
+                        [EstoqueAlmoxarifado.nova_linha(material_id, almoxarifado_id, saldo)]
+                    )
+                Material.invalidar_mapa_estoques()
+                EstoqueAlmoxarifado.agendar_alertas([material_id])
+    return divergencia
+
+
+def _juntar(conferencias, resultado: ResultadoConciliacao) -> list[Divergencia]:
+    candidatos = []
+    for conferidos, divergencias in conferencias:
+        resultado.materiais += conferidos
+        candidatos.extend(divergencias)
+    return candidatos
+
+
+def conciliar_estoque(
+    *, processos: int | None = None, tamanho_faixa: int = TAMANHO_FAIXA, corrigir: bool = False
+) -> ResultadoConciliacao:
+    """Confere os saldos de todos os materiais e, com ``corrigir``, alinha contador e livro ao esperado.
+
+    ``processos`` (padrao: numero de CPUs) define o tamanho do pool; com 1 ou
+    uma unica faixa tudo roda no processo atual. As correcoes do livro entram
+    como lancamentos ``CONCILIACAO``, sem editar os lancamentos existentes.
+    """
+    inicio = time.perf_counter()
+    processos = processos or os.cpu_count() or 1
+    faixas = faixas_de_materiais(tamanho_faixa)
+    resultado = ResultadoConciliacao(faixas=len(faixas), processos=min(processos, len(faixas)) or 1)
+
+    if resultado.processos == 1:
+        conferencias = (conferir_faixa(primeiro, ultimo) for primeiro, ultimo in faixas)
+        candidatos = _juntar(conferencias, resultado)
+    else:
+        # Os processos filhos nao podem herdar a conexao aberta do pai; com
+        # "spawn" eles comecam sem o Django configurado, dai o initializer.
+        connections.close_all()
+        with ProcessPoolExecutor(
+            max_workers=resultado.processos,
+            mp_context=multiprocessing.get_context(),
+            initializer=django.setup,
+        ) as pool:
+            conferencias = pool.map(conferir_faixa, *zip(*faixas))
+            candidatos = _juntar(conferencias, resultado)
+
+    for candidato in candidatos:
+        divergencia = _confirmar(candidato.material_id, candidato.almoxarifado_id, corrigir)
+        if divergencia is not None:
+            resultado.divergencias.append(divergencia)
+    if corrigir:
+        resultado.corrigidas = len(resultado.divergencias)
+    resultado.segundos = time.perf_counter() - inicio
+    return resultado
+
@@ -0,0 +1,135 @@
+"""Medicao de requisicoes por amostragem e resumo de desempenho por view.
+
+``Medicao`` conta as consultas e o tempo gasto no banco via
+``connection.execute_wrapper`` e soma o tempo de renderizacao de templates;
+so existe para as requisicoes sorteadas pelo middleware, entao o custo nas
+demais e um ``random()``.
+"""
+
+import time
+from collections import Counter
+from contextvars import ContextVar
+from datetime import timedelta
+
+from django.template.backends.django import Template as TemplateDjango
+from django.utils import timezone
+
+from .models import AmostraRequisicao
+
+_medicao_atual = ContextVar('medicao_atual', default=None)
+_render_original = None
+
+
+class Medicao:
+    def __init__(self):
+        self.inicio = time.perf_counter()
+        self.consultas = 0
+        self.tempo_db = 0.0
+        self.tempo_template = 0.0
+        self.sqls = Counter()
+
+    def __call__(self, execute, sql, params, many, context):
+        inicio = time.perf_counter()
+        try:
+            return execute(sql, params, many, context)
+        finally:
+            self.tempo_db += time.perf_counter() - inicio
+            self.consultas += 1
+            # O SQL chega com os parametros separados: consultas iguais com
+            # valores diferentes (o padrao N+1) caem na mesma chave.
+            self.sqls[sql] += 1
+
+    def ativar(self):
+        return _medicao_atual.set(self)
+
+    @staticmethod
+    def desativar(token):
+        _medicao_atual.reset(token)
+
+    def consulta_mais_repetida(self):
+        if not self.sqls:
+            return '', 0
+        return self.sqls.most_common(1)[0]
+
+    def registrar(self, view, metodo, status, *, limite_repeticoes):
+        sql, repeticoes = self.consulta_mais_repetida()
+        suspeita = repeticoes >= limite_repeticoes
+        return AmostraRequisicao.objects.create(
+            view=view,
+            metodo=metodo,
+            status=status,
+            duracao_ms=(time.perf_counter() - self.inicio) * 1000,
+            consultas=self.consultas,
+            tempo_db_ms=self.tempo_db * 1000,
+            tempo_template_ms=self.tempo_template * 1000,
+            suspeita_n_mais_1=suspeita,
+            consulta_repetida=sql if suspeita else '',
+            repeticoes=repeticoes,
+        )
+
+
+def _render_medido(self, context=None, request=None):
+    medicao = _medicao_atual.get()
+    if medicao is None:
+        return _render_original(self, context, request)
+    inicio = time.perf_counter()
+    try:
+        return _render_original(self, context, request)
+    finally:
+        medicao.tempo_template += time.perf_counter() - inicio
+
+
+def instalar_medicao_templates():
+    """Envolve ``Template.render`` do backend Django para medir a renderizacao (uma vez por processo)."""
+    global _render_original
+    if _render_original is None:
+        _render_original = TemplateDjango.render
+        TemplateDjango.render = _render_medido
+
+
+def percentil(valores_ordenados, p):
+    """Percentil por posicao mais proxima; ``valores_ordenados`` em ordem crescente."""
+    if not valores_ordenados:
+        return None
+    posicao = max(0, min(len(valores_ordenados) - 1, round(p / 100 * len(valores_ordenados)) - 1))
+    return valores_ordenados[posicao]
+
+
+def resumo_desempenho(*, dias=7, limite_por_view=1000, limite_lento_ms=500):
+    """Resume as amostras recentes por view, ordenado pelo p95 de latencia.
+
+    Os percentis usam as ``limite_por_view`` amostras mais recentes de cada
+    view dentro da janela de ``dias``.
+    """
+    amostras = AmostraRequisicao.objects.filter(criado_em__gte=timezone.now() - timedelta(days=dias))
+    linhas = []
+    for view in amostras.order_by().values_list('view', flat=True).distinct():
+        registros = list(
+            amostras.filter(view=view)
+            .order_by('-criado_em')
+            .values_list('duracao_ms', 'consultas', 'tempo_db_ms', 'tempo_template_ms', 'suspeita_n_mais_1')[
+                :limite_por_view
+            ]
+        )
+        duracoes = sorted(registro[0] for registro in registros)
+        consultas = [registro[1] for registro in registros]
+        tempos_db = sorted(registro[2] for registro in registros)
+        tempos_template = sorted(registro[3] for registro in registros)
+        p95 = percentil(duracoes, 95)
+        linhas.append(
+            {
+                'view': view,
+                'amostras': len(registros),
+                'p50_ms': percentil(duracoes, 50),
+                'p95_ms': p95,
+                'p99_ms': percentil(duracoes, 99),
+                'consultas_media': sum(consultas) / len(consultas),
+                'consultas_max': max(consultas),
+                'db_p95_ms': percentil(tempos_db, 95),
+                'template_p95_ms': percentil(tempos_template, 95),
+                'suspeitas_n_mais_1': sum(1 for registro in registros if registro[4]),
+                'lenta': p95 >= limite_lento_ms,
+            }
+        )
+    linhas.sort(key=lambda linha: linha['p95_ms'], reverse=True)
+    return linhas
@@ -0,0 +1,202 @@
+"""Operacoes de estoque sobre o livro de lancamentos.
+
+O saldo de um material (total ou em uma unidade) e o ultimo ``SnapshotEstoque``
+correspondente mais a soma dos lancamentos posteriores a ele. Gerar snapshots
+periodicamente mantem essa soma curta, independente do tamanho do historico.
+"""
+
+from django.core.exceptions import ValidationError
+from django.db import transaction
+from django.db.models import F, IntegerField, Max, OuterRef, Subquery, Sum, Value
+from django.db.models.functions import Coalesce
+
+from . import versoes
+from .models import Acesso, EstoqueAlmoxarifado, LancamentoEstoque, Material, Movimentacao, SnapshotEstoque
+
+
+def _soma_lancamentos(lancamentos):
+    return Subquery(
+        lancamentos.order_by()
+        .values('material')
+        .annotate(total=Sum('delta'))
+        .values('total')
+    )
+
+
+def _anotar_saldo(consulta, *, material, almoxarifado, ate_lancamento, em):
+    """Anota ``snapshot_saldo``, ``snapshot_ate`` e ``saldo_livro`` em ``consulta``.
+
+    ``material`` e ``almoxarifado`` (``None`` para o total do material) sao
+    valores ou ``OuterRef`` para as colunas da consulta externa.
+    """
+    snapshots = SnapshotEstoque.objects.filter(material=material, almoxarifado=almoxarifado)
+    lancamentos = LancamentoEstoque.objects.filter(material=material, id__gt=OuterRef('snapshot_ate'))
+    if almoxarifado is not None:
+        lancamentos = lancamentos.filter(almoxarifado=almoxarifado)
+    if ate_lancamento is not None:
+        snapshots = snapshots.filter(ate_lancamento__lte=ate_lancamento)
+        lancamentos = lancamentos.filter(id__lte=ate_lancamento)
+    if em is not None:
+        snapshots = snapshots.filter(data_referencia__lte=em)
+        lancamentos = lancamentos.filter(criado_em__lte=em)
+    snapshots = snapshots.order_by('-ate_lancamento')
+    return (
+        consulta.annotate(
+            snapshot_saldo=Coalesce(Subquery(snapshots.values('saldo')[:1]), 0),
+            snapshot_ate=Coalesce(Subquery(snapshots.values('ate_lancamento')[:1]), 0),
+        )
+        .annotate(delta_posterior=Coalesce(_soma_lancamentos(lancamentos), 0))
+        .annotate(saldo_livro=F('snapshot_saldo') + F('delta_posterior'))
+    )
+
+
+def anotar_saldo_livro(materiais, *, ate_lancamento: int | None = None, em=None, almoxarifado=None):
+    """Anota ``saldo_livro`` (e o snapshot usado) em um queryset de ``Material``.
+
+    ``ate_lancamento`` limita o calculo aos lancamentos com id ate o informado;
+    ``em`` calcula o saldo no instante dado, partindo do ultimo snapshot cuja
+    ``data_referencia`` nao passa dele. Com ``almoxarifado`` o saldo e o da
+    unidade, a partir dos snapshots e do livro dela.
+    """
+    return _anotar_saldo(
+        materiais, material=OuterRef('pk'), almoxarifado=almoxarifado, ate_lancamento=ate_lancamento, em=em
+    )
+
+
+def anotar_estoque_atual(materiais, *, almoxarifado=None):
+    """Anota ``estoque_atual``: o saldo no ``almoxarifado`` ou a soma de todas as unidades."""
+    estoques = EstoqueAlmoxarifado.objects.filter(material=OuterRef('pk'))
+    if almoxarifado is not None:
+        estoques = estoques.filter(almoxarifado=almoxarifado)
+    total = estoques.order_by().values('material').annotate(total=Sum('quantidade')).values('total')
+    return materiais.annotate(estoque_atual=Coalesce(Subquery(total), 0))
+
+
+def saldos_em(instante, materiais=None) -> dict[int, int]:
+    """Saldo de cada material no ``instante`` informado, por id de material.
+
+    Cada material custa a leitura de um snapshot e a soma dos lancamentos entre
+    ele e o instante, sem reprocessar todo o historico de movimentacoes.
+    """
+    if materiais is None:
+        materiais = Material.objects.all()
+    return dict(anotar_saldo_livro(materiais, em=instante).values_list('pk', 'saldo_livro'))
+
+
+def saldo_material(material_id: int) -> int:
+    """Saldo atual do material calculado pelo livro (nao pelo contador)."""
+    return (
+        anotar_saldo_livro(Material.objects.filter(pk=material_id))
+        .values_list('saldo_livro', flat=True)
+        .get()
+    )
+
+
+def _pendentes_snapshot(consulta, limite, *, material, almoxarifado):
+    """``(saldo_livro, ultimo_lancamento, data_referencia)`` de quem teve lancamentos desde o ultimo snapshot."""
+    lancamentos = LancamentoEstoque.objects.filter(material=material, id__lte=limite)
+    if almoxarifado is not None:
+        lancamentos = lancamentos.filter(almoxarifado=almoxarifado)
+    ultima_data = Subquery(
+        lancamentos.order_by().values('material').annotate(maximo=Max('criado_em')).values('maximo')
+    )
+    ultimo_id = Subquery(lancamentos.order_by('-id').values('id')[:1])
+    return (
+        _anotar_saldo(consulta, material=material, almoxarifado=almoxarifado, ate_lancamento=limite, em=None)
+        .annotate(ultimo_lancamento=ultimo_id, data_referencia=ultima_data)
+        .filter(ultimo_lancamento__gt=F('snapshot_ate'))
+    )
+
+
+def gerar_snapshots(materiais=None) -> int:
+    """Grava um snapshot do total de cada material e um de cada unidade com lancamentos desde o ultimo.
+
+    Retorna o numero de snapshots criados.
+    """
+    if materiais is None:
+        materiais = Material.objects.all()
+    limite = LancamentoEstoque.objects.aggregate(ultimo=Max('id'))['ultimo']
+    if limite is None:
+        return 0
+    totais = _pendentes_snapshot(materiais, limite, material=OuterRef('pk'), almoxarifado=None).values_list(
+        'pk', Value(None, output_field=IntegerField()), 'saldo_livro', 'ultimo_lancamento', 'data_referencia'
+    )
+    unidades = _pendentes_snapshot(
+        EstoqueAlmoxarifado.objects.filter(material__in=materiais.values('pk')),
+        limite,
+        material=OuterRef('material'),
+        almoxarifado=OuterRef('almoxarifado'),
+    ).values_list('material', 'almoxarifado', 'saldo_livro', 'ultimo_lancamento', 'data_referencia')
+    with transaction.atomic():
+        snapshots = [
+            SnapshotEstoque(
+                material_id=material_id,
+                almoxarifado_id=almoxarifado_id,
+                saldo=saldo,
+                ate_lancamento=ultimo_lancamento,
+                data_referencia=data_referencia,
+            )
+            for pendentes in (totais, unidades)
+            for material_id, almoxarifado_id, saldo, ultimo_lancamento, data_referencia in pendentes.iterator(
+                chunk_size=1000
+            )
+        ]
+        SnapshotEstoque.objects.bulk_create(snapshots, batch_size=1000)
+    return len(snapshots)
+
+
+def registrar_movimentacoes_em_lote(acesso, itens) -> list:
+    """Registra varias movimentacoes de um acesso em uma unica transacao.
+
+    ``itens`` e uma sequencia de ``(material_id, quantidade, tipo)``. Os
+    saldos dos materiais no almoxarifado do acesso sao bloqueados em ordem de
+    material (evitando deadlocks entre lotes concorrentes) e todas as linhas
+    sao validadas contra eles antes de gravar; se alguma nao tiver saldo, nada
+    e gravado.
+    """
+    if not itens:
+        raise ValidationError('Informe ao menos um material.')
+    with transaction.atomic():
+        acesso = Acesso.objects.select_for_update().get(pk=acesso.pk)
+        if acesso.status != Acesso.Status.ABERTO:
+            raise ValidationError('Nao e possivel registrar movimentacoes em um acesso encerrado.')
+
+        ids = {material_id for material_id, _, _ in itens}
+        materiais = Material.objects.in_bulk(ids)
+        saldos = dict.fromkeys(materiais, 0)
+        saldos.update(
+            EstoqueAlmoxarifado.objects.select_for_update()
+            .filter(almoxarifado_id=acesso.almoxarifado_id, material_id__in=ids)
+            .order_by('material_id')
+            .values_list('material_id', 'quantidade')
+        )
+        movimentacoes = []
+        erros = []
+        for linha, (material_id, quantidade, tipo) in enumerate(itens, start=1):
+            material = materiais.get(material_id)
+            if material is None:
+                erros.append(f'Linha {linha}: material inexistente.')
+                continue
+            movimentacao = Movimentacao(acesso=acesso, material=material, quantidade=quantidade, tipo=tipo)
+            saldos[material_id] += movimentacao.delta_estoque
+            if saldos[material_id] < 0:
+                erros.append(f'Linha {linha}: estoque insuficiente de {material.nome} em {acesso.almoxarifado.nome}.')
+            movimentacoes.append(movimentacao)
+        if erros:
+            raise ValidationError(erros)
+
+        Movimentacao.objects.bulk_create(movimentacoes)
+        lancamentos = [
+            LancamentoEstoque(
+                material_id=movimentacao.material_id,
+                almoxarifado_id=acesso.almoxarifado_id,
+                movimentacao=movimentacao,
+                origem=LancamentoEstoque.Origem.MOVIMENTACAO,
+                delta=movimentacao.delta_estoque,
+            )
+            for movimentacao in movimentacoes
+        ]
+        LancamentoEstoque.objects.bulk_create(lancamentos)
+        LancamentoEstoque.aplicar_no_contador(lancamentos)
+        versoes.marcar_acesso(acesso.data_hora)
+    return movimentacoes
@@ -0,0 +1,367 @@
+"""Fluxo de eventos do almoxarifado para paineis ao vivo (server-sent events).
+
+Os eventos saem do proprio banco, lidos por cursor: acessos e movimentacoes
+por id e encerramentos por ``(data_saida, id)``. Ids e ``data_saida`` nao
+chegam em ordem de commit (no PostgreSQL uma transacao que pegou um id menor
+pode confirmar depois de outra), entao cada conexao consulta a partir de um
+horizonte que fica ``JANELA_ATRASO`` segundos atras da maior posicao ja vista
+e descarta o que ja enviou. Uma linha confirmada ate ``JANELA_ATRASO``
+segundos depois de uma posterior ainda sai; transacoes mais longas que isso
+podem ter eventos perdidos.
+
+O horizonte vai no ``id:`` de cada lote, e o navegador o devolve em
+``Last-Event-ID`` ao reconectar: os eventos da ultima janela podem chegar de
+novo, e o painel ignora os ids repetidos.
+
+Cada conexao confere os marcadores de ``versoes`` (e a versao do mapa de
+estoques) a cada ``INTERVALO_FLUXO`` segundos e so consulta o banco quando
+algum mudou, ou a cada ``CONSULTA_MAXIMA`` segundos para o caso de um
+marcador se perder. Com varios processos o cache precisa ser compartilhado
+para os eventos chegarem logo (ver ``DJANGO_CACHE``).
+
+Sob ASGI o fluxo e o gerador async ``fluxo_eventos``; sob WSGI o Django leria
+um iterador async inteiro antes de enviar, entao a view usa
+``fluxo_eventos_sincrono``, que ocupa uma thread por conexao.
+"""
+
+import asyncio
+import json
+import time
+from collections import deque
+from dataclasses import dataclass
+from datetime import datetime, timezone as dt_timezone
+
+from asgiref.sync import sync_to_async
+from django.core.serializers.json import DjangoJSONEncoder
+from django.db.models import Max, Q
+
+from . import versoes
+from .models import Acesso, EstoqueAlmoxarifado, Material, Movimentacao
+
+# Segundos entre duas conferencias dos marcadores.
+INTERVALO_FLUXO = 1.0
+# Segundos maximos sem consultar o banco, mesmo sem marcador alterado.
+CONSULTA_MAXIMA = 30.0
+# Segundos sem enviar nada antes de um comentario de keep-alive.
+INTERVALO_PING = 15.0
+# Duracao de uma conexao; o navegador reconecta sozinho com o ultimo cursor,
+# o que devolve a thread (WSGI) ou a tarefa (ASGI) periodicamente.
+DURACAO_FLUXO = 300.0
+# Espera sugerida ao navegador antes de reconectar, em milissegundos.
+RECONEXAO_MS = 2000
+# Linhas de cada tipo por consulta; com mais pendentes o laco consulta de novo sem esperar.
+LOTE_EVENTOS = 200
+# Linhas de cada lista do painel.
+LIMITE_PAINEL = 200
+# Segundos que o horizonte do cursor fica atras da maior posicao vista; cobre
+# transacoes que confirmam depois de outras com id (ou data de saida) maior.
+JANELA_ATRASO = 60.0
+
+
+def _chave_saida(posicao) -> tuple:
+    """Ordem de ``(data_saida, id)``; um cursor sem saida fica antes de todas."""
+    saida, acesso_id = posicao
+    return (saida is not None, saida or datetime.min.replace(tzinfo=dt_timezone.utc), acesso_id)
+
+
+@dataclass(frozen=True)
+class CursorEventos:
+    acesso: int = 0
+    movimentacao: int = 0
+    saida: datetime | None = None
+    saida_id: int = 0
+
+    def codificar(self) -> str:
+        saida = int(self.saida.timestamp() * 1_000_000) if self.saida else 0
+        return f'{self.acesso}-{self.movimentacao}-{saida}-{self.saida_id}'
+
+    def juntar(self, outro: 'CursorEventos') -> 'CursorEventos':
+        """A posicao mais avancada de cada tipo entre os dois cursores."""
+        saida, saida_id = max(
+            (self.saida, self.saida_id), (outro.saida, outro.saida_id), key=_chave_saida
+        )
+        return CursorEventos(
+            max(self.acesso, outro.acesso), max(self.movimentacao, outro.movimentacao), saida, saida_id
+        )
+
+    def passou_saida(self, saida: datetime, acesso_id: int) -> bool:
+        """Se o encerramento ``(saida, acesso_id)`` esta no cursor ou antes dele."""
+        return _chave_saida((saida, acesso_id)) <= _chave_saida((self.saida, self.saida_id))
+
+    @classmethod
+    def decodificar(cls, texto: str | None) -> 'CursorEventos | None':
+        """Le um cursor de ``codificar``; ``None`` quando ausente ou invalido."""
+        try:
+            acesso, movimentacao, saida, saida_id = (int(parte) for parte in (texto or '').split('-'))
+        except ValueError:
+            return None
+        instante = datetime.fromtimestamp(saida / 1_000_000, tz=dt_timezone.utc) if saida else None
+        return cls(acesso, movimentacao, instante, saida_id)
+
+
+def cursor_atual() -> CursorEventos:
+    """Cursor do estado atual: um fluxo novo so recebe o que acontecer daqui em diante."""
+    ids = Acesso.objects.aggregate(acesso=Max('id'), saida=Max('data_saida'))
+    saida_id = 0
+    if ids['saida'] is not None:
+        saida_id = (
+            Acesso.objects.filter(data_saida=ids['saida']).aggregate(maior=Max('id'))['maior'] or 0
+        )
+    movimentacao = Movimentacao.objects.aggregate(maior=Max('id'))['maior']
+    return CursorEventos(ids['acesso'] or 0, movimentacao or 0, ids['saida'], saida_id)
+
+
+def _dados_acesso(acesso) -> dict:
+    return {
+        'id': acesso.id,
+        'funcionario': acesso.funcionario.nome,
+        'almoxarifado': acesso.almoxarifado.nome,
+        'tipo': acesso.tipo,
+        'status': acesso.status,
+        'data_hora': acesso.data_hora,
+        'data_saida': acesso.data_saida,
+    }
+
+
+def ler_eventos(
+    cursor: CursorEventos, lote: int = LOTE_EVENTOS, enviados: dict | None = None
+) -> tuple[list[tuple[str, dict]], CursorEventos, bool]:
+    """Eventos posteriores a ``cursor``: ``(eventos, novo_cursor, ha_mais)``.
+
+    A ordem e acessos novos, movimentacoes e encerramentos, para que o painel
+    sempre conheca o acesso antes das movimentacoes e do encerramento dele.
+    ``enviados`` (ids por tipo de evento) ficam de fora; cada consulta busca
+    a mais o numero deles, para que o lote de novos continue completo.
+    """
+    enviados = enviados or {}
+
+    def novos(consulta, tipo):
+        ja_enviados = enviados.get(tipo, ())
+        linhas = list(consulta[: lote + len(ja_enviados)])
+        return [linha for linha in linhas if linha.id not in ja_enviados][:lote], len(linhas) == lote + len(ja_enviados)
+
+    acessos, mais_acessos = novos(
+        Acesso.objects.filter(id__gt=cursor.acesso).select_related('funcionario', 'almoxarifado').order_by('id'),
+        'acesso',
+    )
+    movimentacoes, mais_movimentacoes = novos(
+        Movimentacao.objects.filter(id__gt=cursor.movimentacao)
+        .select_related('material', 'acesso__funcionario', 'acesso__almoxarifado')
+        .order_by('id'),
+        'movimentacao',
+    )
+    encerrados = Acesso.objects.filter(data_saida__isnull=False)
+    if cursor.saida is not None:
+        encerrados = encerrados.filter(
+            Q(data_saida__gt=cursor.saida) | Q(data_saida=cursor.saida, id__gt=cursor.saida_id)
+        )
+    encerrados, mais_encerrados = novos(
+        encerrados.select_related('funcionario', 'almoxarifado').order_by('data_saida', 'id'), 'encerramento'
+    )
+
+    eventos = [('acesso', _dados_acesso(acesso)) for acesso in acessos]
+    eventos += [
+        (
+            'movimentacao',
+            {
+                'id': movimentacao.id,
+                'acesso': movimentacao.acesso_id,
+                'funcionario': movimentacao.acesso.funcionario.nome,
+                'almoxarifado': movimentacao.acesso.almoxarifado.nome,
+                'material': movimentacao.material.nome,
+                'tipo': movimentacao.tipo,
+                'quantidade': movimentacao.quantidade,
+            },
+        )
+        for movimentacao in movimentacoes
+    ]
+    eventos += [('encerramento', _dados_acesso(acesso)) for acesso in encerrados]
+
+    novo = cursor.juntar(
+        CursorEventos(
+            acessos[-1].id if acessos else 0,
+            movimentacoes[-1].id if movimentacoes else 0,
+            encerrados[-1].data_saida if encerrados else None,
+            encerrados[-1].id if encerrados else 0,
+        )
+    )
+    return eventos, novo, mais_acessos or mais_movimentacoes or mais_encerrados
+
+
+def painel(limite: int = LIMITE_PAINEL) -> dict:
+    """Quem esta dentro de cada almoxarifado e os saldos abaixo do minimo (pelo indice ``estoque_baixo_idx``)."""
+    abertos = (
+        Acesso.objects.filter(status=Acesso.Status.ABERTO)
+        .select_related('funcionario', 'almoxarifado')
+        .order_by('data_hora', 'id')[:limite]
+    )
+    baixos = (
+        EstoqueAlmoxarifado.objects.filter(abaixo_do_minimo=True)
+        .order_by('quantidade', 'material__nome')
+        .values_list('material_id', 'material__nome', 'almoxarifado__nome', 'quantidade', 'minimo_efetivo')[:limite]
+    )
+    return {
+        'dentro': [
+            {
+                'id': acesso.id,
+                'funcionario': acesso.funcionario.nome,
+                'almoxarifado': acesso.almoxarifado.nome,
+                'desde': acesso.data_hora,
+            }
+            for acesso in abertos
+        ],
+        'estoque_baixo': [
+            {
+                'material_id': material_id,
+                'material': nome,
+                'almoxarifado': almoxarifado,
+                'quantidade': quantidade,
+                'minimo': minimo,
+            }
+            for material_id, nome, almoxarifado, quantidade, minimo in baixos
+        ],
+    }
+
+
+def formatar_evento(tipo: str, dados, id_evento: str | None = None) -> str:
+    linhas = []
+    if id_evento:
+        linhas.append(f'id: {id_evento}')
+    linhas.append(f'event: {tipo}')
+    linhas.append(f'data: {json.dumps(dados, cls=DjangoJSONEncoder)}')
+    return '\n'.join(linhas) + '\n\n'
+
+
+# Marcadores que indicam alteracao de acessos, movimentacoes, cadastros ou saldos.
+CHAVES_MARCADORES = (versoes.CHAVE_BASE, versoes.CHAVE_ACESSOS, Material.CHAVE_VERSAO_MAPA)
+
+
+class _Fluxo:
+    """Estado de uma conexao; ``fluxo_eventos`` e ``fluxo_eventos_sincrono`` so decidem como esperar.
+
+    ``abrir`` e ``consultar`` acessam o banco; ``esperar`` so compara os
+    marcadores e os relogios.
+    """
+
+    def __init__(self, cursor: CursorEventos | None, duracao: float | None):
+        self.duracao = DURACAO_FLUXO if duracao is None else duracao
+        self.inicio = time.monotonic()
+        # ``cursor`` e o horizonte das consultas (e o que vai para o navegador);
+        # ``maximo`` a maior posicao ja enviada. ``observados`` guarda
+        # ``(instante, maximo)``: o horizonte so alcanca uma posicao depois de
+        # ``JANELA_ATRASO`` segundos, e ate la os ids enviados acima dele ficam
+        # em ``enviados`` para nao sairem de novo.
+        self.cursor = self.maximo = cursor
+        self.observados = deque()
+        self.enviados = {'acesso': set(), 'movimentacao': set(), 'encerramento': {}}
+        # Retomando de um cursor, a primeira volta consulta o banco sem esperar
+        # algum marcador mudar: o que aconteceu durante a reconexao sai logo.
+        self.marcadores = None
+        self.dados_painel = None
+        self.ultima_consulta = self.ultimo_envio = self.inicio
+
+    def ativo(self) -> bool:
+        return time.monotonic() - self.inicio < self.duracao
+
+    def abrir(self, marcadores: tuple) -> list[str]:
+        if self.cursor is None:
+            self.marcadores = marcadores
+            self.cursor = self.maximo = cursor_atual()
+        self.dados_painel = painel()
+        self.ultima_consulta = self.ultimo_envio = time.monotonic()
+        return [f'retry: {RECONEXAO_MS}\n\n', formatar_evento('painel', self.dados_painel, self.cursor.codificar())]
+
+    def esperar(self, marcadores: tuple) -> str | None:
+        """``None`` quando e hora de consultar; senao o que enviar (um ping ou nada)."""
+        agora = time.monotonic()
+        if marcadores != self.marcadores or agora - self.ultima_consulta >= CONSULTA_MAXIMA:
+            return None
+        if agora - self.ultimo_envio >= INTERVALO_PING:
+            self.ultimo_envio = agora
+            return ': ping\n\n'
+        return ''
+
+    def consultar(self, marcadores: tuple) -> tuple[list[str], bool]:
+        """Um lote de eventos; com ``ha_mais`` a volta consulta de novo em seguida.
+
+        ``marcadores`` sao lidos antes da consulta: uma alteracao durante ela
+        fica para a proxima volta.
+        """
+        self.marcadores = marcadores
+        eventos, novo, ha_mais = ler_eventos(self.cursor, enviados=self.enviados)
+        self._registrar_envio(eventos, novo)
+        partes = [formatar_evento(tipo, dados) for tipo, dados in eventos[:-1]]
+        if eventos:
+            tipo, dados = eventos[-1]
+            partes.append(formatar_evento(tipo, dados, self.cursor.codificar()))
+        if not ha_mais:
+            self.ultima_consulta = self.ultimo_envio = time.monotonic()
+            novo_painel = painel()
+            if novo_painel != self.dados_painel:
+                self.dados_painel = novo_painel
+                partes.append(formatar_evento('painel', novo_painel, self.cursor.codificar()))
+        return partes, ha_mais
+
+    def _registrar_envio(self, eventos, novo: CursorEventos) -> None:
+        for tipo, dados in eventos:
+            if tipo == 'encerramento':
+                self.enviados[tipo][dados['id']] = dados['data_saida']
+            else:
+                self.enviados[tipo].add(dados['id'])
+        agora = time.monotonic()
+        self.maximo = self.maximo.juntar(novo)
+        self.observados.append((agora, self.maximo))
+        while self.observados and self.observados[0][0] <= agora - JANELA_ATRASO:
+            _, self.cursor = self.observados.popleft()
+        # Abaixo do horizonte as consultas nao chegam; os ids dali nao precisam ser lembrados.
+        self.enviados['acesso'] = {i for i in self.enviados['acesso'] if i > self.cursor.acesso}
+        self.enviados['movimentacao'] = {i for i in self.enviados['movimentacao'] if i > self.cursor.movimentacao}
+        self.enviados['encerramento'] = {
+            acesso_id: saida
+            for acesso_id, saida in self.enviados['encerramento'].items()
+            if not self.cursor.passou_saida(saida, acesso_id)
+        }
+
+
+async def fluxo_eventos(cursor: CursorEventos | None, *, duracao: float | None = None):
+    """Gera o texto SSE (ASGI): o painel inicial e, depois, lotes de eventos e o painel atualizado.
+
+    Sem ``cursor`` comeca do estado atual. Termina depois de ``duracao``
+    segundos (padrao ``DURACAO_FLUXO``). Os marcadores sao lidos pelos
+    metodos async do cache; so as consultas ao banco vao para uma thread.
+    """
+    fluxo = _Fluxo(cursor, duracao)
+    for parte in await sync_to_async(fluxo.abrir)(await versoes.aversoes(*CHAVES_MARCADORES)):
+        yield parte
+    while fluxo.ativo():
+        await asyncio.sleep(INTERVALO_FLUXO)
+        ping = fluxo.esperar(await versoes.aversoes(*CHAVES_MARCADORES))
+        if ping is not None:
+            if ping:
+                yield ping
+            continue
+        ha_mais = True
+        while ha_mais:
+            partes, ha_mais = await sync_to_async(fluxo.consultar)(await versoes.aversoes(*CHAVES_MARCADORES))
+            for parte in partes:
+                yield parte
+
+
+def fluxo_eventos_sincrono(cursor: CursorEventos | None, *, duracao: float | None = None):
+    """``fluxo_eventos`` para WSGI, onde um iterador async seria lido inteiro antes do envio.
+
+    Ocupa a thread do servidor durante toda a conexao.
+    """
+    fluxo = _Fluxo(cursor, duracao)
+    yield from fluxo.abrir(versoes.versoes(*CHAVES_MARCADORES))
+    while fluxo.ativo():
+        time.sleep(INTERVALO_FLUXO)
+        ping = fluxo.esperar(versoes.versoes(*CHAVES_MARCADORES))
+        if ping is not None:
+            if ping:
+                yield ping
+            continue
+        ha_mais = True
+        while ha_mais:
+            partes, ha_mais = fluxo.consultar(versoes.versoes(*CHAVES_MARCADORES))
+            yield from partes
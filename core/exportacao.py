@@ -0,0 +1,185 @@
+"""Exportacao em streaming (CSV e XLSX) de relatorios.
+
+As linhas chegam de um iterador e sao escritas aos poucos na resposta, de modo
+que a memoria usada nao depende do tamanho da exportacao. Sob ASGI o gerador
+e lido em lotes numa thread (``_em_lotes``); o Django leria um iterador
+sincrono inteiro antes de enviar o primeiro byte.
+"""
+
+import csv
+import io
+import itertools
+import re
+import zipfile
+from datetime import datetime
+from xml.sax.saxutils import escape
+
+from asgiref.sync import sync_to_async
+from django.http import Http404, StreamingHttpResponse
+from django.utils import timezone
+
+FORMATOS = {
+    'csv': 'text/csv; charset=utf-8',
+    'xlsx': 'application/vnd.openxmlformats-officedocument.spreadsheetml.sheet',
+}
+
+# Partes lidas por ida a thread quando a resposta e servida por ASGI.
+PARTES_POR_LOTE = 256
+
+_CARACTERES_INVALIDOS_XML = re.compile('[\x00-\x08\x0b\x0c\x0e-\x1f]')
+
+
+class _Eco:
+    """Arquivo falso: ``write`` apenas devolve o texto para o gerador."""
+
+    def write(self, valor):
+        return valor
+
+
+class _BufferStreaming(io.RawIOBase):
+    """Destino sem ``seek`` para o ``zipfile``; os bytes sao drenados a cada linha."""
+
+    def __init__(self):
+        super().__init__()
+        self._partes = []
+
+    def writable(self):
+        return True
+
+    def write(self, dados):
+        self._partes.append(bytes(dados))
+        return len(dados)
+
+    def drenar(self) -> bytes:
+        dados = b''.join(self._partes)
+        self._partes.clear()
+        return dados
+
+
+def formatar_valor(valor):
+    if valor is None:
+        return ''
+    if isinstance(valor, datetime):
+        return timezone.localtime(valor).strftime('%d/%m/%Y %H:%M')
+    return valor
+
+
+def gerar_csv(cabecalho, linhas):
+    escritor = csv.writer(_Eco(), delimiter=';')
+    # BOM para o Excel reconhecer UTF-8 ao abrir o arquivo.
+    yield '\ufeff' + escritor.writerow(cabecalho)
+    for linha in linhas:
+        yield escritor.writerow([formatar_valor(valor) for valor in linha])
+
+
+def _celula(valor) -> str:
+    valor = formatar_valor(valor)
+    if isinstance(valor, bool):
+        valor = int(valor)
+    if isinstance(valor, (int, float)):
+        return f'<c><v>{valor}</v></c>'
+    texto = escape(_CARACTERES_INVALIDOS_XML.sub('', str(valor)))
+    return f'<c t="inlineStr"><is><t xml:space="preserve">{texto}</t></is></c>'
+
+
+def _linha_xml(valores) -> bytes:
+    return ('<row>' + ''.join(_celula(valor) for valor in valores) + '</row>').encode()
+
+
+_XLSX_ESTATICOS = {
+    '[Content_Types].xml': (
+        '<?xml version="1.0" encoding="UTF-8" standalone="yes"?>'
+        '<Types xmlns="http://schemas.openxmlformats.org/package/2006/content-types">'
+        '<Default Extension="rels" ContentType="application/vnd.openxmlformats-package.relationships+xml"/>'
+        '<Default Extension="xml" ContentType="application/xml"/>'
+        '<Override PartName="/xl/workbook.xml" '
+        'ContentType="application/vnd.openxmlformats-officedocument.spreadsheetml.sheet.main+xml"/>'
+        '<Override PartName="/xl/worksheets/sheet1.xml" '
+        'ContentType="application/vnd.openxmlformats-officedocument.spreadsheetml.worksheet+xml"/>'
+        '</Types>'
+    ),
+    '_rels/.rels': (
+        '<?xml version="1.0" encoding="UTF-8" standalone="yes"?>'
+        '<Relationships xmlns="http://schemas.openxmlformats.org/package/2006/relationships">'
+        '<Relationship Id="rId1" '
+        'Type="http://schemas.openxmlformats.org/officeDocument/2006/relationships/officeDocument" '
+        'Target="xl/workbook.xml"/>'
+        '</Relationships>'
+    ),
+    'xl/_rels/workbook.xml.rels': (
+        '<?xml version="1.0" encoding="UTF-8" standalone="yes"?>'
+        '<Relationships xmlns="http://schemas.openxmlformats.org/package/2006/relationships">'
+        '<Relationship Id="rId1" '
+        'Type="http://schemas.openxmlformats.org/officeDocument/2006/relationships/worksheet" '
+        'Target="worksheets/sheet1.xml"/>'
+        '</Relationships>'
+    ),
+}
+
+
+def gerar_xlsx(cabecalho, linhas, *, nome_planilha='Dados'):
+    buffer = _BufferStreaming()
+    with zipfile.ZipFile(buffer, 'w', compression=zipfile.ZIP_DEFLATED) as arquivo:
+        for nome, conteudo in _XLSX_ESTATICOS.items():
+            arquivo.writestr(nome, conteudo)
+        arquivo.writestr(
+            'xl/workbook.xml',
+            '<?xml version="1.0" encoding="UTF-8" standalone="yes"?>'
+            '<workbook xmlns="http://schemas.openxmlformats.org/spreadsheetml/2006/main" '
+            'xmlns:r="http://schemas.openxmlformats.org/officeDocument/2006/relationships">'
+            f'<sheets><sheet name="{escape(nome_planilha[:31])}" sheetId="1" r:id="rId1"/></sheets>'
+            '</workbook>',
+        )
+        yield buffer.drenar()
+
+        with arquivo.open('xl/worksheets/sheet1.xml', 'w', force_zip64=True) as planilha:
+            planilha.write(
+                b'<?xml version="1.0" encoding="UTF-8" standalone="yes"?>'
+                b'<worksheet xmlns="http://schemas.openxmlformats.org/spreadsheetml/2006/main"><sheetData>'
+            )
+            planilha.write(_linha_xml(cabecalho))
+            for linha in linhas:
+                planilha.write(_linha_xml(linha))
+                dados = buffer.drenar()
+                if dados:
+                    yield dados
+            planilha.write(b'</sheetData></worksheet>')
+    yield buffer.drenar()
+
+
+async def _em_lotes(partes):
+    """Iterador async sobre o gerador sincrono ``partes``, lido ``PARTES_POR_LOTE`` partes por vez.
+
+    As leituras sao ``thread_sensitive``: o cursor do ``iterator()`` aberto
+    pela view continua na thread (e na conexao) que o criou.
+    """
+
+    def lote():
+        return list(itertools.islice(partes, PARTES_POR_LOTE))
+
+    try:
+        while bloco := await sync_to_async(lote)():
+            for parte in bloco:
+                yield parte
+    finally:
+        # Cliente desconectado no meio: fecha o cursor na mesma thread.
+        await sync_to_async(partes.close)()
+
+
+def resposta_exportacao(formato, nome_arquivo, cabecalho, linhas, *, assincrona=False):
+    """Monta a ``StreamingHttpResponse`` para ``formato`` (``csv`` ou ``xlsx``).
+
+    ``assincrona`` (requisicao servida por ASGI) entrega o conteudo por um
+    iterador async, sem juntar o arquivo em memoria.
+    """
+    if formato not in FORMATOS:
+        raise Http404('Formato de exportacao invalido.')
+    if formato == 'csv':
+        conteudo = gerar_csv(cabecalho, linhas)
+    else:
+        conteudo = gerar_xlsx(cabecalho, linhas, nome_planilha=nome_arquivo)
+    if assincrona:
+        conteudo = _em_lotes(conteudo)
+    resposta = StreamingHttpResponse(conteudo, content_type=FORMATOS[formato])
+    resposta['Content-Disposition'] = f'attachment; filename="{nome_arquivo}.{formato}"'
+    return resposta
@@ -0,0 +1,51 @@
+"""Filtros de data como intervalos semi-abertos ``[inicio, fim)``.
+
+Comparar a coluna ``data_hora`` diretamente com limites ja convertidos para o
+fuso do projeto permite usar os indices de data, ao contrario de lookups como
+``__date``, ``__year`` e ``__month``, que aplicam uma funcao a cada linha.
+"""
+
+from datetime import date, datetime, time, timedelta
+
+from django.utils import timezone
+
+
+def ler_data(valor) -> date | None:
+    """Converte ``AAAA-MM-DD`` (ou datetime ISO) em ``date``; valores invalidos viram ``None``."""
+    if not valor:
+        return None
+    try:
+        return datetime.fromisoformat(valor).date()
+    except (TypeError, ValueError):
+        return None
+
+
+def inicio_do_dia(dia: date) -> datetime:
+    return timezone.make_aware(datetime.combine(dia, time.min))
+
+
+def intervalo_dias(data_inicio: date | None = None, data_fim: date | None = None):
+    """Intervalo que cobre de ``data_inicio`` ate o fim de ``data_fim`` (inclusive).
+
+    ``date.max`` como fim nao tem dia seguinte: vira um intervalo aberto.
+    """
+    inicio = inicio_do_dia(data_inicio) if data_inicio else None
+    fim = inicio_do_dia(data_fim + timedelta(days=1)) if data_fim and data_fim < date.max else None
+    return inicio, fim
+
+
+def intervalo_mes(ano: int, mes: int):
+    proximo = date(ano + 1, 1, 1) if mes == 12 else date(ano, mes + 1, 1)
+    return inicio_do_dia(date(ano, mes, 1)), inicio_do_dia(proximo)
+
+
+def intervalo_ano(ano: int):
+    return inicio_do_dia(date(ano, 1, 1)), inicio_do_dia(date(ano + 1, 1, 1))
+
+
+def filtrar_intervalo(queryset, campo: str, inicio=None, fim=None):
+    if inicio is not None:
+        queryset = queryset.filter(**{f'{campo}__gte': inicio})
+    if fim is not None:
+        queryset = queryset.filter(**{f'{campo}__lt': fim})
+    return queryset
@@ -1,6 +1,40 @@
 from django import forms
+from django.urls import reverse_lazy
 
-from .models import Acesso, Almoxarifado, Funcionario, Movimentacao
+from .models import Acesso, Almoxarifado, Funcionario, Material, Movimentacao
+
+
+class SelectAutocomplete(forms.Select):
+    """Select que renderiza apenas a opcao escolhida.
+
+    As demais opcoes vem de ``/api/autocomplete/<entidade>/`` conforme o
+    usuario digita, entao o HTML nao cresce com o tamanho do cadastro.
+    """
+
+    def __init__(self, entidade, attrs=None):
+        super().__init__(attrs)
+        self.entidade = entidade
+
+    def get_context(self, name, value, attrs):
+        context = super().get_context(name, value, attrs)
+        context['widget']['attrs']['data-autocomplete-url'] = reverse_lazy(
+            'core:api_autocomplete', args=[self.entidade]
+        )
+        return context
+
+    def optgroups(self, name, value, attrs=None):
+        iterador = self.choices
+        opcoes = []
+        if iterador.field.empty_label is not None:
+            opcoes.append(('', iterador.field.empty_label))
+        selecionados = [valor for valor in value if str(valor).isdigit()]
+        if selecionados:
+            opcoes.extend(iterador.choice(obj) for obj in iterador.queryset.filter(pk__in=selecionados))
+        self.choices = opcoes
+        try:
+            return super().optgroups(name, value, attrs)
+        finally:
+            self.choices = iterador
 
 
 class AcessoForm(forms.ModelForm):
@@ -15,6 +49,9 @@ class AcessoForm(forms.ModelForm):
             'observacao',
         ]
         widgets = {
+            'funcionario': SelectAutocomplete('funcionarios'),
+            'autorizador': SelectAutocomplete('autorizadores'),
+            'almoxarifado': SelectAutocomplete('almoxarifados'),
             'tipo': forms.RadioSelect(attrs={'class': 'flex gap-3 text-sm text-gray-700'}),
             'observacao': forms.Textarea(
                 attrs={
@@ -55,6 +92,8 @@ class MovimentacaoForm(forms.ModelForm):
         model = Movimentacao
         fields = ['acesso', 'material', 'quantidade', 'tipo']
         widgets = {
+            'acesso': SelectAutocomplete('acessos'),
+            'material': SelectAutocomplete('materiais'),
             'tipo': forms.RadioSelect(attrs={'class': 'flex gap-3 text-sm text-gray-700'}),
         }
 
@@ -70,6 +109,36 @@ class MovimentacaoForm(forms.ModelForm):
         tipo_field.initial = Movimentacao.Tipo.RETIRADA
 
 
+class ItemMovimentacaoForm(forms.Form):
+    material = forms.ModelChoiceField(
+        queryset=Material.objects.all(),
+        label='Material',
+        widget=SelectAutocomplete('materiais'),
+    )
+    quantidade = forms.IntegerField(min_value=1, label='Quantidade')
+    tipo = forms.ChoiceField(
+        choices=Movimentacao.Tipo.choices,
+        initial=Movimentacao.Tipo.RETIRADA,
+        label='Tipo',
+    )
+
+    def __init__(self, *args, **kwargs):
+        super().__init__(*args, **kwargs)
+        base_class = 'border border-gray-300 rounded-lg p-2 w-full focus:outline-none focus:ring-2 focus:ring-blue-600 bg-white text-base'
+        for field in self.fields.values():
+            field.widget.attrs.update({'class': base_class})
+
+
+ItemMovimentacaoFormSet = forms.formset_factory(
+    ItemMovimentacaoForm,
+    extra=5,
+    min_num=1,
+    validate_min=True,
+    max_num=200,
+    validate_max=True,
+)
+
+
 class RelatorioMensalForm(forms.Form):
     MES_CHOICES = [(str(i), f"{i:02d}") for i in range(1, 13)]
 
@@ -80,12 +149,14 @@ class RelatorioMensalForm(forms.Form):
         required=False,
         empty_label='Todos',
         label='Almoxarifado',
+        widget=SelectAutocomplete('almoxarifados'),
     )
     funcionario = forms.ModelChoiceField(
         queryset=Funcionario.objects.all(),
         required=False,
         empty_label='Todos',
         label='Funcionario',
+        widget=SelectAutocomplete('funcionarios'),
     )
 
     def __init__(self, *args, **kwargs):
@@ -93,3 +164,31 @@ class RelatorioMensalForm(forms.Form):
         select_class = 'border border-gray-300 rounded-lg p-2 w-full bg-white focus:outline-none focus:ring-2 focus:ring-blue-600'
         for field in self.fields.values():
             field.widget.attrs.update({'class': select_class})
+
+
+class EstoqueEmDataForm(forms.Form):
+    data = forms.DateTimeField(
+        label='Data e hora',
+        required=False,
+        widget=forms.DateTimeInput(attrs={'type': 'datetime-local'}, format='%Y-%m-%dT%H:%M'),
+    )
+    busca = forms.CharField(label='Material', required=False, max_length=120)
+    almoxarifado = forms.ModelChoiceField(
+        queryset=Almoxarifado.objects.all(),
+        required=False,
+        empty_label='Todos',
+        label='Almoxarifado',
+        widget=SelectAutocomplete('almoxarifados'),
+    )
+    material = forms.ModelMultipleChoiceField(
+        queryset=Material.objects.all(),
+        required=False,
+        widget=forms.MultipleHiddenInput,
+    )
+
+    def __init__(self, *args, **kwargs):
+        super().__init__(*args, **kwargs)
+        input_class = 'border border-gray-300 rounded-lg p-2 w-full bg-white focus:outline-none focus:ring-2 focus:ring-blue-600'
+        self.fields['data'].widget.attrs.update({'class': input_class})
+        self.fields['busca'].widget.attrs.update({'class': input_class, 'placeholder': 'Nome do material'})
+        self.fields['almoxarifado'].widget.attrs.update({'class': input_class})
@@ -0,0 +1,370 @@
+"""Carga em massa de cadastros e historico de movimentacoes.
+
+Os registros sao lidos em streaming (CSV ou JSON Lines) e gravados em lotes com
+``bulk_create``; nenhuma linha passa pelo ``save()`` dos modelos. Depois da
+carga, ``recalcular_estoque`` ajusta os saldos por almoxarifado de uma vez a
+partir do livro de lancamentos.
+"""
+
+import csv
+import json
+from datetime import datetime
+from itertools import islice
+
+from django.db import IntegrityError, transaction
+from django.db.models import Sum
+from django.utils import timezone
+
+from . import versoes
+from .models import (
+    Acesso,
+    Almoxarifado,
+    Autorizador,
+    EstoqueAlmoxarifado,
+    Funcionario,
+    LancamentoEstoque,
+    Material,
+    Movimentacao,
+)
+
+CADASTROS = {
+    'funcionarios': (Funcionario, []),
+    'autorizadores': (Autorizador, []),
+    'almoxarifados': (Almoxarifado, ['localizacao']),
+    'materiais': (Material, []),
+}
+
+
+def ler_registros(arquivo, formato: str):
+    """Itera sobre os registros de ``arquivo`` (texto) como dicionarios.
+
+    ``formato`` e ``csv`` (cabecalho na primeira linha, separador ``,`` ou
+    ``;``) ou ``json`` (JSON Lines: um objeto por linha).
+    """
+    if formato == 'csv':
+        amostra = arquivo.readline()
+        delimitador = ';' if amostra.count(';') > amostra.count(',') else ','
+        cabecalho = next(csv.reader([amostra], delimiter=delimitador))
+        cabecalho = [coluna.strip().lstrip('\ufeff') for coluna in cabecalho]
+        for linha in csv.DictReader(arquivo, fieldnames=cabecalho, delimiter=delimitador):
+            yield {chave: (valor.strip() if isinstance(valor, str) else valor) for chave, valor in linha.items()}
+    elif formato == 'json':
+        for linha in arquivo:
+            linha = linha.strip()
+            if linha:
+                yield json.loads(linha)
+    else:
+        raise ValueError(f'Formato desconhecido: {formato}')
+
+
+def em_lotes(registros, tamanho: int):
+    iterador = iter(registros)
+    while lote := list(islice(iterador, tamanho)):
+        yield lote
+
+
+def converter_data(valor):
+    if not valor:
+        return None
+    if isinstance(valor, datetime):
+        data = valor
+    else:
+        data = datetime.fromisoformat(str(valor))
+    if timezone.is_naive(data):
+        data = timezone.make_aware(data)
+    return data
+
+
+class ResolvedorNomes:
+    """Converte nomes de cadastro em ids, criando os que ainda nao existem."""
+
+    def __init__(self, modelo):
+        self.modelo = modelo
+        self.ids = {}
+
+    def resolver(self, nomes) -> dict[str, int]:
+        faltando = {nome for nome in nomes if nome and nome not in self.ids}
+        if faltando:
+            # Entre homonimos (funcionarios e autorizadores) fica o cadastro mais antigo.
+            self.ids.update(
+                self.modelo.objects.filter(nome__in=faltando).order_by('-id').values_list('nome', 'id')
+            )
+            novos = faltando - self.ids.keys()
+            if novos:
+                self.modelo.objects.bulk_create(
+                    [self.modelo(nome=nome) for nome in novos], ignore_conflicts=True
+                )
+                self.ids.update(self.modelo.objects.filter(nome__in=novos).values_list('nome', 'id'))
+                if self.modelo is Material:
+                    Material.invalidar_mapa_estoques()
+        return self.ids
+
+
+def _importar_pessoas(modelo, lote) -> int:
+    """Funcionarios e autorizadores: homonimos sao validos, quem identifica e a ``matricula``.
+
+    Com matricula o registro e inserido ou tem o nome atualizado; sem ela, o
+    nome so e criado se ainda nao houver ninguem com ele.
+    """
+    por_matricula = {}
+    sem_matricula = set()
+    for registro in lote:
+        nome = (registro.get('nome') or '').strip()
+        if not nome:
+            continue
+        matricula = str(registro.get('matricula') or '').strip()
+        if matricula:
+            por_matricula[matricula] = nome
+        else:
+            sem_matricula.add(nome)
+    with transaction.atomic():
+        modelo.objects.bulk_create(
+            [modelo(nome=nome, matricula=matricula) for matricula, nome in por_matricula.items()],
+            update_conflicts=True,
+            unique_fields=['matricula'],
+            update_fields=['nome'],
+        )
+        existentes = set(modelo.objects.filter(nome__in=sem_matricula).values_list('nome', flat=True))
+        modelo.objects.bulk_create([modelo(nome=nome) for nome in sem_matricula - existentes])
+        versoes.marcar_tudo()
+    return len(por_matricula) + len(sem_matricula)
+
+
+def importar_cadastros(tipo: str, lote, *, data_estoque_inicial=None) -> int:
+    """Insere ou atualiza um lote de cadastros.
+
+    Almoxarifados e materiais sao identificados pelo ``nome``; funcionarios e
+    autorizadores pela ``matricula`` (ver ``_importar_pessoas``). Para
+    materiais, a coluna opcional ``estoque_inicial`` vira um lancamento de
+    ajuste no livro de estoque do ``almoxarifado`` da mesma linha; um material
+    pode aparecer em uma linha por almoxarifado.
+    """
+    modelo, campos = CADASTROS[tipo]
+    if modelo in (Funcionario, Autorizador):
+        return _importar_pessoas(modelo, lote)
+    registros = {}
+    estoques = []
+    for registro in lote:
+        nome = (registro.get('nome') or '').strip()
+        if not nome:
+            continue
+        registros[nome] = registro
+        if modelo is Material and registro.get('estoque_inicial') not in (None, '', 0, '0'):
+            almoxarifado = (registro.get('almoxarifado') or '').strip()
+            if not almoxarifado:
+                raise ValueError(f'Material {nome}: informe o almoxarifado do estoque_inicial.')
+            estoques.append((nome, almoxarifado, int(registro['estoque_inicial'])))
+    objetos = [
+        modelo(nome=nome, **{campo: registro.get(campo) or '' for campo in campos})
+        for nome, registro in registros.items()
+    ]
+    with transaction.atomic():
+        if campos:
+            modelo.objects.bulk_create(
+                objetos, update_conflicts=True, unique_fields=['nome'], update_fields=campos
+            )
+        else:
+            modelo.objects.bulk_create(objetos, ignore_conflicts=True)
+
+        if modelo is Material:
+            Material.invalidar_mapa_estoques()
+            ids = dict(Material.objects.filter(nome__in=registros).values_list('nome', 'id'))
+            almoxarifados = ResolvedorNomes(Almoxarifado).resolver({almoxarifado for _, almoxarifado, _ in estoques})
+            criado_em = data_estoque_inicial or timezone.now()
+            LancamentoEstoque.objects.bulk_create(
+                [
+                    LancamentoEstoque(
+                        material_id=ids[nome],
+                        almoxarifado_id=almoxarifados[almoxarifado],
+                        origem=LancamentoEstoque.Origem.AJUSTE,
+                        delta=quantidade,
+                        criado_em=criado_em,
+                    )
+                    for nome, almoxarifado, quantidade in estoques
+                ]
+            )
+        # ``bulk_create`` nao passa pelo ``save`` do ``CadastroMixin``.
+        versoes.marcar_tudo()
+    return len(objetos)
+
+
+def localizar_registro_invalido(importar, lote):
+    """Repete ``lote`` registro a registro para achar o que ``importar`` recusa com ``IntegrityError``.
+
+    Tudo roda numa transacao desfeita no final. Retorna ``(posicao, registro,
+    erro)``, com a posicao a partir de 0 dentro do lote, ou ``None``.
+    """
+    encontrado = None
+    with transaction.atomic():
+        for posicao, registro in enumerate(lote):
+            try:
+                with transaction.atomic():
+                    importar([registro])
+            except IntegrityError as exc:
+                encontrado = (posicao, registro, exc)
+                break
+        transaction.set_rollback(True)
+    return encontrado
+
+
+class RegistroInvalido(ValueError):
+    """Registro com um valor que o modelo nao aceita; ``posicao`` conta a partir de 0 no lote."""
+
+    def __init__(self, posicao: int, registro, mensagem: str):
+        super().__init__(mensagem)
+        self.posicao = posicao
+        self.registro = registro
+
+
+# Colunas do historico gravadas em campos com ``choices``: (coluna, opcoes, obrigatoria).
+COLUNAS_COM_OPCOES = (
+    ('tipo', Movimentacao.Tipo, True),
+    ('tipo_acesso', Acesso.Tipo, False),
+    ('status', Acesso.Status, False),
+    ('justificativa', Acesso.Justificativa, False),
+)
+
+
+class ImportadorMovimentacoes:
+    """Carrega acessos e movimentacoes historicas.
+
+    Cada registro e uma movimentacao com os dados do acesso ao qual pertence;
+    registros do mesmo acesso compartilham a coluna ``acesso`` (referencia
+    externa) e devem vir em sequencia no arquivo.
+    """
+
+    def __init__(self):
+        self.funcionarios = ResolvedorNomes(Funcionario)
+        self.autorizadores = ResolvedorNomes(Autorizador)
+        self.almoxarifados = ResolvedorNomes(Almoxarifado)
+        self.materiais = ResolvedorNomes(Material)
+        self._ultimo_acesso = {}
+
+    @staticmethod
+    def _referencia(registro):
+        return registro.get('acesso') or registro.get('data_hora')
+
+    @staticmethod
+    def validar(lote) -> None:
+        """Recusa o lote com ``RegistroInvalido`` se alguma coluna com opcoes tiver valor fora delas.
+
+        ``bulk_create`` nao valida ``choices``: um tipo ``Retirada`` seria
+        gravado, entraria no livro como saida e ficaria fora dos relatorios.
+        """
+        for posicao, registro in enumerate(lote):
+            for coluna, opcoes, obrigatoria in COLUNAS_COM_OPCOES:
+                valor = registro.get(coluna)
+                if not valor and not obrigatoria:
+                    continue
+                if valor not in opcoes.values:
+                    raise RegistroInvalido(
+                        posicao,
+                        registro,
+                        f'{coluna} {valor!r} invalido; use {", ".join(opcoes.values)}.',
+                    )
+
+    def importar(self, lote) -> int:
+        self.validar(lote)
+        funcionarios = self.funcionarios.resolver({r.get('funcionario') for r in lote})
+        autorizadores = self.autorizadores.resolver({r.get('autorizador') for r in lote})
+        almoxarifados = self.almoxarifados.resolver({r.get('almoxarifado') for r in lote})
+        materiais = self.materiais.resolver({r.get('material') for r in lote})
+
+        with transaction.atomic():
+            # O ultimo acesso do lote anterior pode continuar neste lote.
+            acessos = dict(self._ultimo_acesso)
+            novos = []
+            datas = []
+            for registro in lote:
+                referencia = self._referencia(registro)
+                if referencia in acessos:
+                    continue
+                data_hora = converter_data(registro['data_hora'])
+                data_saida = converter_data(registro.get('data_saida'))
+                status = registro.get('status') or Acesso.Status.FECHADO
+                acesso = Acesso(
+                    funcionario_id=funcionarios[registro['funcionario']],
+                    autorizador_id=autorizadores[registro['autorizador']],
+                    almoxarifado_id=almoxarifados[registro['almoxarifado']],
+                    tipo=registro.get('tipo_acesso') or Acesso.Tipo.ENTRADA,
+                    justificativa_padrao=registro.get('justificativa') or Acesso.Justificativa.RETIRADA_CAMPO,
+                    observacao=registro.get('observacao') or None,
+                    status=status,
+                    ativo=status == Acesso.Status.ABERTO,
+                    data_saida=data_saida if status == Acesso.Status.ABERTO else (data_saida or data_hora),
+                )
+                acessos[referencia] = acesso
+                novos.append(acesso)
+                datas.append(data_hora)
+            Acesso.objects.bulk_create(novos)
+            # ``auto_now_add`` sobrescreve data_hora no insert; gravamos a data real em seguida.
+            for acesso, data_hora in zip(novos, datas):
+                acesso.data_hora = data_hora
+            Acesso.objects.bulk_update(novos, ['data_hora'], batch_size=1000)
+
+            movimentacoes = [
+                Movimentacao(
+                    acesso=acessos[self._referencia(registro)],
+                    material_id=materiais[registro['material']],
+                    quantidade=int(registro['quantidade']),
+                    tipo=registro['tipo'],
+                )
+                for registro in lote
+            ]
+            Movimentacao.objects.bulk_create(movimentacoes)
+            LancamentoEstoque.objects.bulk_create(
+                [
+                    LancamentoEstoque(
+                        material_id=movimentacao.material_id,
+                        almoxarifado_id=movimentacao.acesso.almoxarifado_id,
+                        movimentacao=movimentacao,
+                        origem=LancamentoEstoque.Origem.MOVIMENTACAO,
+                        delta=movimentacao.delta_estoque,
+                        criado_em=movimentacao.acesso.data_hora,
+                    )
+                    for movimentacao in movimentacoes
+                ]
+            )
+
+        if novos:
+            Acesso.limpar_cache_anos()
+        referencia = self._referencia(lote[-1])
+        self._ultimo_acesso = {referencia: acessos[referencia]}
+        return len(movimentacoes)
+
+
+def recalcular_estoque() -> int:
+    """Grava em ``EstoqueAlmoxarifado`` o saldo do livro de cada material e unidade.
+
+    Retorna quantos saldos eram negativos no livro; esses ficam com estoque
+    zero e devem ser conferidos. Le o livro sem bloqueio e sobrescreve todos
+    os saldos: serve para cargas com o sistema parado. Com o sistema em uso,
+    use ``conciliacao.conciliar_estoque(corrigir=True)``.
+    """
+    saldos = (
+        LancamentoEstoque.objects.filter(almoxarifado__isnull=False)
+        .order_by()
+        .values('material', 'almoxarifado')
+        .annotate(saldo=Sum('delta'))
+        .values_list('material', 'almoxarifado', 'saldo')
+    )
+    minimos = Material.minimos()
+    estoques = [
+        EstoqueAlmoxarifado.nova_linha(material_id, almoxarifado_id, max(saldo, 0), minimos[material_id])
+        for material_id, almoxarifado_id, saldo in saldos
+    ]
+    negativos = sum(1 for _, _, saldo in saldos if saldo < 0)
+    with transaction.atomic():
+        # Unidades sem lancamentos ficam zeradas; as demais recebem o saldo do livro.
+        EstoqueAlmoxarifado.objects.update(quantidade=0)
+        EstoqueAlmoxarifado.objects.bulk_create(
+            estoques,
+            batch_size=1000,
+            update_conflicts=True,
+            unique_fields=['material', 'almoxarifado'],
+            update_fields=['quantidade'],
+        )
+        EstoqueAlmoxarifado.reclassificar()
+        Material.invalidar_mapa_estoques()
+        EstoqueAlmoxarifado.agendar_alertas()
+    return negativos
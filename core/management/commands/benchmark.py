@@ -0,0 +1,62 @@
+import json
+from pathlib import Path
+
+from django.core.management.base import BaseCommand, CommandError
+from django.utils import timezone
+
+from core.benchmark import CENARIOS, comparar, executar_benchmark, tamanho_do_banco
+
+
+class Command(BaseCommand):
+    help = (
+        'Mede latencia (p50/p95/p99) e consultas SQL das telas principais sobre o banco atual '
+        '(gere dados antes com gerar_dados_sinteticos). Nada e gravado: tudo e desfeito no final.'
+    )
+
+    def add_arguments(self, parser):
+        parser.add_argument('--cenario', action='append', choices=[c.nome for c in CENARIOS], help='Repetivel; padrao: todos.')
+        parser.add_argument('--repeticoes', type=int, default=20)
+        parser.add_argument('--aquecimento', type=int, default=2)
+        parser.add_argument('--saida', help='Grava o resultado em JSON neste arquivo.')
+        parser.add_argument('--comparar', help='JSON de uma execucao anterior para detectar regressoes.')
+        parser.add_argument('--tolerancia', type=float, default=0.2, help='Aumento aceito no p95 (padrao: 0.2 = 20%%).')
+
+    def handle(self, *args, **options):
+        if options['repeticoes'] < 1:
+            raise CommandError('--repeticoes deve ser positivo.')
+        cenarios = [c for c in CENARIOS if not options['cenario'] or c.nome in options['cenario']]
+        try:
+            resultados = executar_benchmark(
+                cenarios, repeticoes=options['repeticoes'], aquecimento=options['aquecimento']
+            )
+        except (ValueError, RuntimeError) as exc:
+            raise CommandError(str(exc)) from exc
+
+        relatorio = {
+            'gerado_em': timezone.now().isoformat(),
+            'repeticoes': options['repeticoes'],
+            'banco': tamanho_do_banco(),
+            'cenarios': resultados,
+        }
+        if options['saida']:
+            Path(options['saida']).write_text(json.dumps(relatorio, indent=2), encoding='utf-8')
+
+        self.stdout.write(f"{'cenario':<28} {'p50':>8} {'p95':>8} {'p99':>8} {'sql':>5} {'orc':>5}")
+        for nome, metricas in resultados.items():
+            texto = (
+                f"{nome:<28} {metricas['p50_ms']:>8.1f} {metricas['p95_ms']:>8.1f} {metricas['p99_ms']:>8.1f} "
+                f"{metricas['consultas']:>5} {metricas['orcamento_consultas']:>5}"
+            )
+            self.stdout.write(texto if metricas['dentro_orcamento'] else self.style.ERROR(texto))
+
+        problemas = [
+            f"{nome}: {m['consultas']} consultas (orcamento {m['orcamento_consultas']})"
+            for nome, m in resultados.items()
+            if not m['dentro_orcamento']
+        ]
+        if options['comparar']:
+            base = json.loads(Path(options['comparar']).read_text(encoding='utf-8'))
+            problemas += comparar(resultados, base['cenarios'], tolerancia=options['tolerancia'])
+        if problemas:
+            raise CommandError('Regressoes encontradas:\n' + '\n'.join(problemas))
+        self.stdout.write(self.style.SUCCESS('Benchmark dentro dos orcamentos.'))
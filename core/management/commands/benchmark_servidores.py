@@ -0,0 +1,39 @@
+from django.core.management.base import BaseCommand, CommandError
+from django.urls import reverse
+
+from core.benchmark import comparar_wsgi_asgi
+
+
+class Command(BaseCommand):
+    help = (
+        'Compara vazao (req/s) e latencia das telas de leitura servidas pelo handler WSGI (threads) '
+        'e pelo ASGI (loop de eventos) com requisicoes simultaneas. Cria e remove um superusuario temporario.'
+    )
+
+    def add_arguments(self, parser):
+        parser.add_argument('--url', action='append', help='Repetivel; padrao: historico, relatorio e autocomplete.')
+        parser.add_argument('--concorrencia', type=int, default=16)
+        parser.add_argument('--requisicoes', type=int, default=200)
+
+    def handle(self, *args, **options):
+        if min(options['concorrencia'], options['requisicoes']) < 1:
+            raise CommandError('--concorrencia e --requisicoes devem ser positivos.')
+        urls = options['url'] or [
+            reverse('core:historico'),
+            reverse('core:relatorio_mensal'),
+            reverse('core:api_autocomplete', args=['materiais']) + '?q=a',
+        ]
+        try:
+            resultados = comparar_wsgi_asgi(
+                urls, concorrencia=options['concorrencia'], requisicoes=options['requisicoes']
+            )
+        except RuntimeError as exc:
+            raise CommandError(str(exc)) from exc
+
+        self.stdout.write(f"{'url':<40} {'modo':<5} {'req/s':>8} {'p50':>8} {'p95':>8} {'p99':>8}")
+        for url, modos in resultados.items():
+            for modo, metricas in modos.items():
+                self.stdout.write(
+                    f"{url:<40} {modo:<5} {metricas['req_s']:>8.1f} {metricas['p50_ms']:>8.1f} "
+                    f"{metricas['p95_ms']:>8.1f} {metricas['p99_ms']:>8.1f}"
+                )
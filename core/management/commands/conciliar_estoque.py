@@ -0,0 +1,52 @@
+from django.core.management.base import BaseCommand, CommandError
+
+from core.conciliacao import TAMANHO_FAIXA, conciliar_estoque
+
+
+class Command(BaseCommand):
+    help = (
+        'Confere o estoque de cada material em cada almoxarifado (contador e livro de lancamentos) contra o '
+        'saldo esperado pelas movimentacoes, por faixas de materiais em paralelo. Sem --corrigir, falha se '
+        'houver divergencias.'
+    )
+
+    def add_arguments(self, parser):
+        parser.add_argument('--processos', type=int, help='Processos do pool (padrao: numero de CPUs).')
+        parser.add_argument(
+            '--faixa', type=int, default=TAMANHO_FAIXA, help=f'Materiais por faixa (padrao: {TAMANHO_FAIXA}).'
+        )
+        parser.add_argument('--corrigir', action='store_true', help='Alinha contador e livro ao saldo esperado.')
+        parser.add_argument('--limite', type=int, default=50, help='Divergencias listadas na saida (padrao: 50).')
+
+    def handle(self, *args, **options):
+        if options['processos'] is not None and options['processos'] < 1:
+            raise CommandError('--processos deve ser positivo.')
+        if options['faixa'] < 1:
+            raise CommandError('--faixa deve ser positivo.')
+
+        resultado = conciliar_estoque(
+            processos=options['processos'], tamanho_faixa=options['faixa'], corrigir=options['corrigir']
+        )
+        self.stdout.write(
+            f'{resultado.materiais} materiais conferidos em {resultado.faixas} faixas '
+            f'({resultado.processos} processos) em {resultado.segundos:.2f}s.'
+        )
+        for divergencia in resultado.divergencias[: options['limite']]:
+            aviso = ' (saldo negativo, conferir)' if divergencia.negativo else ''
+            self.stdout.write(
+                f'  #{divergencia.material_id} {divergencia.nome} em {divergencia.almoxarifado}: '
+                f'contador {divergencia.contador}, '
+                f'livro {divergencia.livro}, esperado {divergencia.esperado}{aviso}'
+            )
+        restantes = len(resultado.divergencias) - options['limite']
+        if restantes > 0:
+            self.stdout.write(f'  ... e mais {restantes}.')
+
+        if not resultado.divergencias:
+            self.stdout.write(self.style.SUCCESS('Estoque conciliado: nenhuma divergencia.'))
+        elif options['corrigir']:
+            self.stdout.write(self.style.SUCCESS(f'{resultado.corrigidas} saldos corrigidos.'))
+        else:
+            raise CommandError(
+                f'{len(resultado.divergencias)} saldos divergentes. Rode com --corrigir para ajusta-los.'
+            )
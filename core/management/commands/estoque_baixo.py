@@ -0,0 +1,30 @@
+from django.core.management.base import BaseCommand
+
+from core.models import EstoqueAlmoxarifado
+
+
+class Command(BaseCommand):
+    help = (
+        'Lista os saldos abaixo do estoque minimo (pelo indice parcial, sem percorrer todos os saldos). '
+        'Com --notificar, envia pelo notificador configurado as faltas ainda nao alertadas.'
+    )
+
+    def add_arguments(self, parser):
+        parser.add_argument('--almoxarifado', type=int, help='Id do almoxarifado (padrao: todos).')
+        parser.add_argument('--notificar', action='store_true', help='Envia os alertas pendentes.')
+
+    def handle(self, *args, **options):
+        em_falta = EstoqueAlmoxarifado.objects.filter(abaixo_do_minimo=True)
+        if options['almoxarifado']:
+            em_falta = em_falta.filter(almoxarifado_id=options['almoxarifado'])
+        total = 0
+        for material, almoxarifado, quantidade, minimo, alertado in em_falta.order_by(
+            'almoxarifado__nome', 'material__nome'
+        ).values_list('material__nome', 'almoxarifado__nome', 'quantidade', 'minimo_efetivo', 'alertado'):
+            total += 1
+            pendente = '' if alertado else ' (alerta pendente)'
+            self.stdout.write(f'  {material} em {almoxarifado}: {quantidade} de minimo {minimo}{pendente}')
+        self.stdout.write(f'{total} saldos abaixo do minimo.')
+        if options['notificar']:
+            enviados = EstoqueAlmoxarifado.enviar_alertas()
+            self.stdout.write(self.style.SUCCESS(f'{len(enviados)} alertas enviados.'))
@@ -0,0 +1,56 @@
+import time
+
+from django.core.management.base import BaseCommand, CommandError
+
+from core.estoque import gerar_snapshots
+from core.importacao import CADASTROS, ImportadorMovimentacoes, em_lotes, importar_cadastros, recalcular_estoque
+from core.resumos import reconstruir_resumo_mensal
+from core.sintetico import GeradorSintetico
+
+
+class Command(BaseCommand):
+    help = (
+        'Gera cadastros e historico sinteticos (com concentracao realista em poucos materiais e '
+        'funcionarios) para benchmarks. Use em um banco de teste, nunca no de producao.'
+    )
+
+    def add_arguments(self, parser):
+        parser.add_argument('--funcionarios', type=int, default=50)
+        parser.add_argument('--autorizadores', type=int, default=5)
+        parser.add_argument('--almoxarifados', type=int, default=3)
+        parser.add_argument('--materiais', type=int, default=500)
+        parser.add_argument('--anos', type=int, default=1)
+        parser.add_argument('--acessos-por-dia', type=int, default=20)
+        parser.add_argument('--semente', type=int, default=42)
+        parser.add_argument('--lote', type=int, default=5000)
+
+    def handle(self, *args, **options):
+        if min(options['funcionarios'], options['autorizadores'], options['almoxarifados'], options['materiais']) < 1:
+            raise CommandError('Cada cadastro precisa de pelo menos um registro.')
+        gerador = GeradorSintetico(
+            funcionarios=options['funcionarios'],
+            autorizadores=options['autorizadores'],
+            almoxarifados=options['almoxarifados'],
+            materiais=options['materiais'],
+            semente=options['semente'],
+        )
+        inicio = time.monotonic()
+        for tipo in CADASTROS:
+            total = sum(
+                importar_cadastros(tipo, lote) for lote in em_lotes(gerador.cadastros(tipo), options['lote'])
+            )
+            self.stdout.write(f'{total} {tipo}')
+
+        importador = ImportadorMovimentacoes()
+        total = 0
+        historico = gerador.historico(anos=options['anos'], acessos_por_dia=options['acessos_por_dia'])
+        for lote in em_lotes(historico, options['lote']):
+            total += importador.importar(lote)
+            decorrido = time.monotonic() - inicio
+            self.stdout.write(f'{total} movimentacoes em {decorrido:.1f}s')
+
+        self.stdout.write('Recalculando estoque, resumo mensal e snapshots...')
+        recalcular_estoque()
+        reconstruir_resumo_mensal()
+        gerar_snapshots()
+        self.stdout.write(self.style.SUCCESS(f'Dados sinteticos gerados em {time.monotonic() - inicio:.1f}s.'))
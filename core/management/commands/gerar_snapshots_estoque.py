@@ -0,0 +1,11 @@
+from django.core.management.base import BaseCommand
+
+from core.estoque import gerar_snapshots
+
+
+class Command(BaseCommand):
+    help = 'Grava snapshots de saldo para os materiais com lancamentos novos no livro de estoque.'
+
+    def handle(self, *args, **options):
+        criados = gerar_snapshots()
+        self.stdout.write(self.style.SUCCESS(f'{criados} snapshots de estoque gravados.'))
@@ -0,0 +1,112 @@
+import copy
+import sys
+import time
+from functools import partial
+from pathlib import Path
+
+from django.core.management.base import BaseCommand, CommandError
+from django.db import IntegrityError
+
+from core.estoque import gerar_snapshots
+from core.importacao import (
+    CADASTROS,
+    ImportadorMovimentacoes,
+    RegistroInvalido,
+    converter_data,
+    em_lotes,
+    importar_cadastros,
+    ler_registros,
+    localizar_registro_invalido,
+    recalcular_estoque,
+)
+from core.resumos import reconstruir_resumo_mensal
+
+TIPOS = [*CADASTROS, 'movimentacoes']
+
+
+class Command(BaseCommand):
+    help = (
+        'Importa cadastros (funcionarios, autorizadores, almoxarifados, materiais) ou o historico '
+        'de movimentacoes a partir de CSV ou JSON Lines, em lotes.'
+    )
+
+    def add_arguments(self, parser):
+        parser.add_argument('tipo', choices=TIPOS)
+        parser.add_argument('arquivo', help='Caminho do arquivo (.csv ou .jsonl) ou "-" para a entrada padrao.')
+        parser.add_argument('--formato', choices=['csv', 'json'], help='Padrao: deduzido pela extensao.')
+        parser.add_argument('--lote', type=int, default=5000, help='Registros por transacao (padrao: 5000).')
+        parser.add_argument(
+            '--data-estoque-inicial',
+            help='Data (ISO) dos lancamentos de estoque inicial dos materiais. Padrao: agora.',
+        )
+        parser.add_argument(
+            '--sem-recalculo',
+            action='store_true',
+            help='Nao recalcula estoque, resumo mensal e snapshots ao final (util entre varios arquivos).',
+        )
+
+    def handle(self, *args, **options):
+        tipo = options['tipo']
+        caminho = options['arquivo']
+        formato = options['formato'] or ('csv' if caminho.lower().endswith('.csv') else 'json')
+        if options['lote'] < 1:
+            raise CommandError('--lote deve ser positivo.')
+        try:
+            data_estoque_inicial = converter_data(options['data_estoque_inicial'])
+        except ValueError as exc:
+            raise CommandError(f'Data invalida: {exc}') from exc
+
+        if caminho == '-':
+            arquivo = sys.stdin
+        else:
+            if not Path(caminho).exists():
+                raise CommandError(f'Arquivo nao encontrado: {caminho}')
+            arquivo = open(caminho, encoding='utf-8-sig', newline='')
+
+        importador = ImportadorMovimentacoes() if tipo == 'movimentacoes' else None
+        total = lidos = 0
+        inicio = time.monotonic()
+        try:
+            for lote in em_lotes(ler_registros(arquivo, formato), options['lote']):
+                if importador:
+                    importar = importador.importar
+                    # Copia rasa: um lote recusado e repetido a partir do mesmo acesso em andamento.
+                    repetir = copy.copy(importador).importar
+                else:
+                    importar = repetir = partial(importar_cadastros, tipo, data_estoque_inicial=data_estoque_inicial)
+                try:
+                    total += importar(lote)
+                except IntegrityError as exc:
+                    raise CommandError(self._descrever_conflito(repetir, lote, lidos, exc)) from exc
+                except RegistroInvalido as exc:
+                    raise CommandError(f'Registro {lidos + exc.posicao + 1} invalido ({exc.registro}): {exc}') from exc
+                lidos += len(lote)
+                decorrido = time.monotonic() - inicio
+                self.stdout.write(f'{total} registros em {decorrido:.1f}s ({total / max(decorrido, 1e-6):.0f}/s)')
+        except (KeyError, ValueError) as exc:
+            raise CommandError(f'Registro invalido apos {total} importados: {exc!r}') from exc
+        finally:
+            if caminho != '-':
+                arquivo.close()
+
+        if tipo in ('materiais', 'movimentacoes') and not options['sem_recalculo']:
+            self.stdout.write('Recalculando estoque, resumo mensal e snapshots...')
+            negativos = recalcular_estoque()
+            reconstruir_resumo_mensal()
+            gerar_snapshots()
+            if negativos:
+                self.stdout.write(
+                    self.style.WARNING(
+                        f'{negativos} saldos de material por almoxarifado ficaram negativos no livro e foram zerados.'
+                    )
+                )
+        decorrido = time.monotonic() - inicio
+        self.stdout.write(self.style.SUCCESS(f'Importacao concluida: {total} registros em {decorrido:.1f}s.'))
+
+    def _descrever_conflito(self, importar, lote, lidos, erro):
+        """Mensagem do ``IntegrityError`` de um lote, com o primeiro registro que o provoca."""
+        encontrado = localizar_registro_invalido(importar, lote)
+        if encontrado is None:
+            return f'Conflito no lote dos registros {lidos + 1} a {lidos + len(lote)}: {erro}'
+        posicao, registro, erro = encontrado
+        return f'Conflito no registro {lidos + posicao + 1} ({registro}): {erro}'
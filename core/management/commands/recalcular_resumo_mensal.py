@@ -0,0 +1,15 @@
+from django.core.management.base import BaseCommand
+
+from core.resumos import reconstruir_resumo_mensal
+
+
+class Command(BaseCommand):
+    help = 'Reconstroi o resumo mensal de movimentacoes usado pelo relatorio.'
+
+    def add_arguments(self, parser):
+        parser.add_argument('--ano', type=int, help='Reconstroi apenas o ano informado.')
+        parser.add_argument('--mes', type=int, choices=range(1, 13), help='Reconstroi apenas o mes informado.')
+
+    def handle(self, *args, **options):
+        gravadas = reconstruir_resumo_mensal(ano=options['ano'], mes=options['mes'])
+        self.stdout.write(self.style.SUCCESS(f'Resumo mensal reconstruido: {gravadas} linhas.'))
@@ -0,0 +1,58 @@
+import json
+from datetime import timedelta
+
+from django.core.management.base import BaseCommand
+from django.db.models import Count
+from django.utils import timezone
+
+from core.desempenho import resumo_desempenho
+from core.models import AmostraRequisicao
+
+
+class Command(BaseCommand):
+    help = 'Mostra latencia, consultas e suspeitas de N+1 por view a partir das amostras do middleware.'
+
+    def add_arguments(self, parser):
+        parser.add_argument('--dias', type=int, default=7, help='Janela de amostras (padrao: 7 dias).')
+        parser.add_argument('--lento-ms', type=float, default=500, help='p95 a partir do qual a view e marcada lenta.')
+        parser.add_argument('--json', action='store_true', help='Saida em JSON.')
+        parser.add_argument('--limpar', type=int, metavar='DIAS', help='Apaga amostras mais antigas que DIAS.')
+
+    def handle(self, *args, **options):
+        if options['limpar'] is not None:
+            apagadas, _ = AmostraRequisicao.objects.filter(
+                criado_em__lt=timezone.now() - timedelta(days=options['limpar'])
+            ).delete()
+            self.stdout.write(f'{apagadas} amostras antigas apagadas.')
+
+        linhas = resumo_desempenho(dias=options['dias'], limite_lento_ms=options['lento_ms'])
+        if options['json']:
+            self.stdout.write(json.dumps(linhas, indent=2))
+            return
+        if not linhas:
+            self.stdout.write('Nenhuma amostra no periodo.')
+            return
+
+        self.stdout.write(
+            f"{'view':<40} {'n':>6} {'p50':>8} {'p95':>8} {'p99':>8} {'sql':>7} {'db95':>8} {'tpl95':>8} {'n+1':>5}"
+        )
+        for linha in linhas:
+            texto = (
+                f"{linha['view']:<40} {linha['amostras']:>6} {linha['p50_ms']:>8.1f} {linha['p95_ms']:>8.1f} "
+                f"{linha['p99_ms']:>8.1f} {linha['consultas_media']:>7.1f} {linha['db_p95_ms']:>8.1f} "
+                f"{linha['template_p95_ms']:>8.1f} {linha['suspeitas_n_mais_1']:>5}"
+            )
+            self.stdout.write(self.style.WARNING(texto) if linha['lenta'] else texto)
+
+        repetidas = (
+            AmostraRequisicao.objects.filter(
+                suspeita_n_mais_1=True, criado_em__gte=timezone.now() - timedelta(days=options['dias'])
+            )
+            .values('view', 'consulta_repetida')
+            .annotate(vezes=Count('id'))
+            .order_by('-vezes')[:10]
+        )
+        for item in repetidas:
+            self.stdout.write(
+                self.style.WARNING(f"\nN+1 em {item['view']} ({item['vezes']} amostras):\n  {item['consulta_repetida']}")
+            )
@@ -0,0 +1,52 @@
+from django.conf import settings
+from django.core.management.base import BaseCommand, CommandError
+
+from core.carga import executar_carga
+
+
+class Command(BaseCommand):
+    help = (
+        'Registra retiradas concorrentes do mesmo material em varias threads e falha se alguma '
+        'terminar em "database is locked" ou se o estoque final divergir do livro.'
+    )
+
+    def add_arguments(self, parser):
+        parser.add_argument('--threads', type=int, default=8)
+        parser.add_argument('--retiradas', type=int, default=25, help='Retiradas por thread (padrao: 25).')
+        parser.add_argument('--quantidade', type=int, default=1)
+        parser.add_argument('--manter', action='store_true', help='Nao remove os cadastros criados no final.')
+
+    def handle(self, *args, **options):
+        if min(options['threads'], options['retiradas'], options['quantidade']) < 1:
+            raise CommandError('--threads, --retiradas e --quantidade devem ser positivos.')
+        banco = settings.DATABASES['default']
+        self.stdout.write(f"Perfil {settings.BANCO} ({banco['ENGINE'].rsplit('.', 1)[-1]}): {banco['NAME']}")
+
+        resultado = executar_carga(
+            threads=options['threads'],
+            retiradas_por_thread=options['retiradas'],
+            quantidade=options['quantidade'],
+            manter=options['manter'],
+        )
+        self.stdout.write(
+            f'{resultado.retiradas} retiradas em {resultado.segundos:.2f}s '
+            f'({resultado.retiradas / max(resultado.segundos, 1e-6):.0f}/s); '
+            f'p50 {resultado.latencia(50):.1f} ms, p95 {resultado.latencia(95):.1f} ms, '
+            f'p99 {resultado.latencia(99):.1f} ms'
+        )
+        self.stdout.write(
+            f'Estoque final {resultado.estoque_final} (esperado {resultado.estoque_esperado}, '
+            f'livro {resultado.saldo_livro})'
+        )
+        if not resultado.ok:
+            problemas = []
+            if resultado.bloqueios:
+                problemas.append(f'{resultado.bloqueios} "database is locked"')
+            if resultado.sem_estoque:
+                problemas.append(f'{resultado.sem_estoque} recusadas por falta de estoque')
+            if resultado.outros_erros:
+                problemas.append(f'{len(resultado.outros_erros)} outros erros ({resultado.outros_erros[0]})')
+            if not resultado.consistente:
+                problemas.append('estoque divergente')
+            raise CommandError('Teste de carga falhou: ' + '; '.join(problemas) + '.')
+        self.stdout.write(self.style.SUCCESS('Nenhuma retirada falhou por bloqueio do banco.'))
@@ -0,0 +1,94 @@
+import multiprocessing
+import signal
+import threading
+from datetime import timedelta
+
+from django.core.management.base import BaseCommand, CommandError
+from django.db import connections
+
+
+def _ignorar_interrupcao():
+    # Ctrl+C chega a todos os processos; quem para o pool e o processo principal.
+    signal.signal(signal.SIGINT, signal.SIG_IGN)
+
+
+def _processo(indice, intervalo, uma_vez, parar):
+    # Com o metodo "spawn" (Windows) o processo filho comeca sem o Django
+    # configurado; por isso os modulos do app so sao importados aqui.
+    import django
+
+    django.setup()
+    from core.tarefas import nome_worker, processar_fila
+
+    _ignorar_interrupcao()
+    processar_fila(worker=nome_worker(indice), intervalo=intervalo, uma_vez=uma_vez, parar=parar)
+
+
+class Command(BaseCommand):
+    help = (
+        'Executa as tarefas em segundo plano (exportacoes e recalculos) da fila no banco. '
+        'Com --processos N, roda N workers em paralelo. SIGINT/SIGTERM terminam apos a tarefa atual.'
+    )
+
+    def add_arguments(self, parser):
+        parser.add_argument('--processos', type=int, default=1)
+        parser.add_argument('--intervalo', type=float, default=2.0, help='Segundos entre consultas com a fila vazia.')
+        parser.add_argument('--uma-vez', action='store_true', help='Termina quando a fila esvaziar.')
+        parser.add_argument(
+            '--presas-minutos',
+            type=int,
+            default=30,
+            help='Tarefas em execucao sem progresso ha mais tempo que isso voltam para a fila (padrao: 30).',
+        )
+
+    def handle(self, *args, **options):
+        from core.models import Tarefa
+        from core.tarefas import processar_fila
+
+        if options['processos'] < 1:
+            raise CommandError('--processos deve ser positivo.')
+        recuperadas = Tarefa.recuperar_presas(timedelta(minutes=options['presas_minutos']))
+        if recuperadas:
+            self.stdout.write(self.style.WARNING(f'{recuperadas} tarefas presas voltaram para a fila ou falharam.'))
+
+        if options['processos'] == 1:
+            parar = threading.Event()
+            anteriores = self._parar_com_sinais(parar)
+            try:
+                executadas = processar_fila(intervalo=options['intervalo'], uma_vez=options['uma_vez'], parar=parar)
+            finally:
+                self._restaurar_sinais(anteriores)
+            self.stdout.write(self.style.SUCCESS(f'{executadas} tarefas executadas.'))
+            return
+
+        # Os processos filhos nao podem herdar a conexao aberta do pai.
+        connections.close_all()
+        contexto = multiprocessing.get_context()
+        parar = contexto.Event()
+        processos = [
+            contexto.Process(
+                target=_processo,
+                args=(indice, options['intervalo'], options['uma_vez'], parar),
+                name=f'worker-{indice}',
+            )
+            for indice in range(options['processos'])
+        ]
+        for processo in processos:
+            processo.start()
+        anteriores = self._parar_com_sinais(parar)
+        self.stdout.write(f'{len(processos)} workers iniciados.')
+        try:
+            for processo in processos:
+                processo.join()
+        finally:
+            self._restaurar_sinais(anteriores)
+        self.stdout.write(self.style.SUCCESS('Workers encerrados.'))
+
+    @staticmethod
+    def _parar_com_sinais(parar):
+        return {sinal: signal.signal(sinal, lambda *_: parar.set()) for sinal in (signal.SIGINT, signal.SIGTERM)}
+
+    @staticmethod
+    def _restaurar_sinais(anteriores):
+        for sinal, tratador in anteriores.items():
+            signal.signal(sinal, tratador)
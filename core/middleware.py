@@ -0,0 +1,113 @@
+import logging
+import random
+from contextlib import ExitStack, contextmanager
+
+from asgiref.sync import iscoroutinefunction, markcoroutinefunction, sync_to_async
+from django.conf import settings
+from django.db import DatabaseError, connections
+
+from .desempenho import Medicao, instalar_medicao_templates
+
+logger = logging.getLogger(__name__)
+
+
+class InstrumentacaoMiddleware:
+    """Mede uma fracao das requisicoes e grava uma ``AmostraRequisicao``.
+
+    ``INSTRUMENTACAO_AMOSTRAGEM`` (0 a 1) define a fracao medida;
+    ``INSTRUMENTACAO_LIMITE_REPETICOES`` quantas execucoes do mesmo SQL numa
+    requisicao marcam suspeita de N+1. Requisicoes medidas de usuarios da
+    equipe (ou com ``DEBUG``) recebem o cabecalho ``Server-Timing``; os
+    demais clientes nao veem numero de consultas nem tempo de banco.
+    """
+
+    sync_capable = True
+    async_capable = True
+
+    def __init__(self, get_response):
+        self.get_response = get_response
+        self.assincrono = iscoroutinefunction(get_response)
+        if self.assincrono:
+            # Sob ASGI a cadeia continua async e as views async nao vao para thread.
+            markcoroutinefunction(self)
+        instalar_medicao_templates()
+
+    def __call__(self, request):
+        if self.assincrono:
+            return self._acall(request)
+        if not self._amostrar():
+            return self.get_response(request)
+
+        medicao = Medicao()
+        with self._medindo(medicao):
+            response = self.get_response(request)
+        self._registrar(request, response, medicao)
+        return response
+
+    async def _acall(self, request):
+        if not self._amostrar():
+            return await self.get_response(request)
+
+        # As conexoes sao por thread e o ORM async executa o SQL na thread
+        # sincrona da requisicao; os wrappers precisam ser instalados nela.
+        medicao = Medicao()
+        token = medicao.ativar()
+        try:
+            wrappers = await sync_to_async(self._nas_conexoes)(medicao)
+            try:
+                response = await self.get_response(request)
+            finally:
+                await sync_to_async(wrappers.close)()
+        finally:
+            Medicao.desativar(token)
+        await sync_to_async(self._registrar)(request, response, medicao)
+        return response
+
+    @staticmethod
+    def _amostrar() -> bool:
+        taxa = getattr(settings, 'INSTRUMENTACAO_AMOSTRAGEM', 0)
+        return bool(taxa) and random.random() < taxa
+
+    @staticmethod
+    def _nas_conexoes(medicao) -> ExitStack:
+        pilha = ExitStack()
+        for conexao in connections.all():
+            pilha.enter_context(conexao.execute_wrapper(medicao))
+        return pilha
+
+    @classmethod
+    @contextmanager
+    def _medindo(cls, medicao):
+        token = medicao.ativar()
+        try:
+            with cls._nas_conexoes(medicao):
+                yield
+        finally:
+            Medicao.desativar(token)
+
+    @staticmethod
+    def _expor_tempos(request) -> bool:
+        if settings.DEBUG:
+            return True
+        user = getattr(request, 'user', None)
+        return bool(user is not None and user.is_staff)
+
+    @classmethod
+    def _registrar(cls, request, response, medicao) -> None:
+        if cls._expor_tempos(request):
+            response['Server-Timing'] = (
+                f'db;dur={medicao.tempo_db * 1000:.1f}, '
+                f'tpl;dur={medicao.tempo_template * 1000:.1f}, '
+                f'sql;desc="{medicao.consultas} consultas"'
+            )
+        match = request.resolver_match
+        if match is not None:
+            try:
+                medicao.registrar(
+                    match.view_name,
+                    request.method,
+                    response.status_code,
+                    limite_repeticoes=getattr(settings, 'INSTRUMENTACAO_LIMITE_REPETICOES', 5),
+                )
+            except DatabaseError:
+                logger.exception('Falha ao gravar amostra de desempenho de %s', match.view_name)
@@ -0,0 +1,64 @@
+# Generated by Django 5.2.18 on 2026-10-17 02:48
+
+import django.db.models.deletion
+from django.db import migrations, models
+from django.db.models import Count, Sum
+from django.db.models.functions import ExtractMonth, ExtractYear
+
+
+def popular_resumo(apps, schema_editor):
+    Movimentacao = apps.get_model('core', 'Movimentacao')
+    ResumoMensal = apps.get_model('core', 'ResumoMensal')
+    agrupado = (
+        Movimentacao.objects.filter(acesso__status='FECHADO')
+        .annotate(ano=ExtractYear('acesso__data_hora'), mes=ExtractMonth('acesso__data_hora'))
+        .order_by()
+        .values('ano', 'mes', 'acesso__almoxarifado_id', 'acesso__funcionario_id', 'material_id', 'acesso__tipo', 'tipo')
+        .annotate(quantidade_total=Sum('quantidade'), total=Count('id'))
+    )
+    ResumoMensal.objects.bulk_create(
+        [
+            ResumoMensal(
+                ano=linha['ano'],
+                mes=linha['mes'],
+                almoxarifado_id=linha['acesso__almoxarifado_id'],
+                funcionario_id=linha['acesso__funcionario_id'],
+                material_id=linha['material_id'],
+                tipo_acesso=linha['acesso__tipo'],
+                tipo=linha['tipo'],
+                quantidade=linha['quantidade_total'],
+                total_movimentacoes=linha['total'],
+            )
+            for linha in agrupado
+        ],
+        batch_size=1000,
+    )
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('core', '0005_acesso_encerrado_por'),
+    ]
+
+    operations = [
+        migrations.CreateModel(
+            name='ResumoMensal',
+            fields=[
+                ('id', models.BigAutoField(auto_created=True, primary_key=True, serialize=False, verbose_name='ID')),
+                ('ano', models.PositiveSmallIntegerField()),
+                ('mes', models.PositiveSmallIntegerField()),
+                ('tipo_acesso', models.CharField(choices=[('entrada', 'Entrada'), ('saida', 'Saida')], max_length=10)),
+                ('tipo', models.CharField(choices=[('retirada', 'Retirada'), ('devolucao', 'Devolucao')], max_length=10)),
+                ('total_movimentacoes', models.IntegerField(default=0)),
+                ('quantidade', models.IntegerField(default=0)),
+                ('almoxarifado', models.ForeignKey(on_delete=django.db.models.deletion.CASCADE, to='core.almoxarifado')),
+                ('funcionario', models.ForeignKey(on_delete=django.db.models.deletion.CASCADE, to='core.funcionario')),
+                ('material', models.ForeignKey(on_delete=django.db.models.deletion.CASCADE, to='core.material')),
+            ],
+            options={
+                'constraints': [models.UniqueConstraint(fields=('ano', 'mes', 'almoxarifado', 'funcionario', 'material', 'tipo_acesso', 'tipo'), name='resumo_mensal_unico')],
+            },
+        ),
+        migrations.RunPython(popular_resumo, migrations.RunPython.noop),
+    ]
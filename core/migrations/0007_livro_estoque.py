@@ -0,0 +1,101 @@
+# Generated by Django 5.2.18 on 2026-10-17 02:51
+
+import django.db.models.deletion
+import django.utils.timezone
+from django.db import migrations, models
+from django.db.models import Min
+from django.utils import timezone
+
+
+def popular_livro(apps, schema_editor):
+    Material = apps.get_model('core', 'Material')
+    Movimentacao = apps.get_model('core', 'Movimentacao')
+    LancamentoEstoque = apps.get_model('core', 'LancamentoEstoque')
+    SnapshotEstoque = apps.get_model('core', 'SnapshotEstoque')
+
+    inicio = Movimentacao.objects.aggregate(inicio=Min('acesso__data_hora'))['inicio'] or timezone.now()
+    liquido = {}
+    movimentos = []
+    for mov in Movimentacao.objects.select_related('acesso').order_by('acesso__data_hora', 'id').iterator():
+        delta = mov.quantidade if mov.tipo == 'devolucao' else -mov.quantidade
+        liquido[mov.material_id] = liquido.get(mov.material_id, 0) + delta
+        movimentos.append(
+            LancamentoEstoque(
+                material_id=mov.material_id,
+                almoxarifado_id=mov.acesso.almoxarifado_id,
+                movimentacao_id=mov.id,
+                origem='MOVIMENTACAO',
+                delta=delta,
+                criado_em=mov.acesso.data_hora,
+            )
+        )
+
+    # O saldo anterior as movimentacoes registradas vira um ajuste de abertura.
+    aberturas = [
+        LancamentoEstoque(
+            material_id=material.id,
+            origem='AJUSTE',
+            delta=material.quantidade_estoque - liquido.get(material.id, 0),
+            criado_em=inicio,
+        )
+        for material in Material.objects.all()
+    ]
+    LancamentoEstoque.objects.bulk_create(aberturas, batch_size=1000)
+    LancamentoEstoque.objects.bulk_create(movimentos, batch_size=1000)
+
+    ultimo_por_material = {}
+    lancamentos = LancamentoEstoque.objects.order_by('id').values_list('id', 'material_id', 'criado_em')
+    for lancamento_id, material_id, criado_em in lancamentos.iterator():
+        ultimo_por_material[material_id] = (lancamento_id, criado_em)
+    SnapshotEstoque.objects.bulk_create(
+        [
+            SnapshotEstoque(
+                material_id=material.id,
+                saldo=material.quantidade_estoque,
+                ate_lancamento=ultimo_por_material[material.id][0],
+                data_referencia=ultimo_por_material[material.id][1],
+            )
+            for material in Material.objects.all()
+        ],
+        batch_size=1000,
+    )
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('core', '0006_resumomensal'),
+    ]
+
+    operations = [
+        migrations.CreateModel(
+            name='LancamentoEstoque',
+            fields=[
+                ('id', models.BigAutoField(auto_created=True, primary_key=True, serialize=False, verbose_name='ID')),
+                ('origem', models.CharField(choices=[('MOVIMENTACAO', 'Movimentacao'), ('ESTORNO', 'Estorno de movimentacao'), ('AJUSTE', 'Ajuste de saldo')], max_length=20)),
+                ('delta', models.IntegerField()),
+                ('criado_em', models.DateTimeField(default=django.utils.timezone.now)),
+                ('almoxarifado', models.ForeignKey(blank=True, null=True, on_delete=django.db.models.deletion.SET_NULL, to='core.almoxarifado')),
+                ('material', models.ForeignKey(on_delete=django.db.models.deletion.CASCADE, related_name='lancamentos', to='core.material')),
+                ('movimentacao', models.ForeignKey(blank=True, null=True, on_delete=django.db.models.deletion.SET_NULL, to='core.movimentacao')),
+            ],
+            options={
+                'indexes': [models.Index(fields=['material', 'id'], name='lancamento_material_id_idx')],
+            },
+        ),
+        migrations.CreateModel(
+            name='SnapshotEstoque',
+            fields=[
+                ('id', models.BigAutoField(auto_created=True, primary_key=True, serialize=False, verbose_name='ID')),
+                ('saldo', models.IntegerField()),
+                ('ate_lancamento', models.BigIntegerField()),
+                ('data_referencia', models.DateTimeField()),
+                ('criado_em', models.DateTimeField(auto_now_add=True)),
+                ('material', models.ForeignKey(on_delete=django.db.models.deletion.CASCADE, related_name='snapshots', to='core.material')),
+            ],
+            options={
+                'indexes': [models.Index(fields=['material', '-ate_lancamento'], name='snapshot_material_idx')],
+            },
+        ),
+        migrations.RunPython(popular_livro, migrations.RunPython.noop),
+    ]
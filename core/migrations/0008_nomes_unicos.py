@@ -0,0 +1,44 @@
+# Generated by Django 5.2.18 on 2026-10-17 02:55
+
+from django.db import migrations, models
+from django.db.models import Count
+
+
+def renomear_duplicados(apps, schema_editor):
+    """Acrescenta o id aos nomes repetidos de almoxarifados e materiais.
+
+    O registro mais antigo de cada nome fica como esta; os demais viram
+    ``"<nome> (<id>)"`` e podem ser renomeados ou juntados pelo admin depois.
+    """
+    for nome_modelo in ('Almoxarifado', 'Material'):
+        modelo = apps.get_model('core', nome_modelo)
+        tamanho = modelo._meta.get_field('nome').max_length
+        repetidos = (
+            modelo.objects.values('nome').annotate(total=Count('id')).filter(total__gt=1).values_list('nome', flat=True)
+        )
+        for nome in list(repetidos):
+            for registro in modelo.objects.filter(nome=nome).order_by('id')[1:]:
+                sufixo = f' ({registro.id})'
+                registro.nome = nome[: tamanho - len(sufixo)] + sufixo
+                registro.save(update_fields=['nome'])
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('core', '0007_livro_estoque'),
+    ]
+
+    operations = [
+        migrations.RunPython(renomear_duplicados, migrations.RunPython.noop),
+        migrations.AlterField(
+            model_name='almoxarifado',
+            name='nome',
+            field=models.CharField(max_length=100, unique=True),
+        ),
+        migrations.AlterField(
+            model_name='material',
+            name='nome',
+            field=models.CharField(max_length=120, unique=True),
+        ),
+    ]
@@ -0,0 +1,88 @@
+# Generated by Django 5.2.18 on 2026-10-17 02:57
+
+from django.conf import settings
+from django.db import migrations, models
+from django.db.models import Count, F, Max, Sum
+from django.db.models.functions import ExtractMonth, ExtractYear
+from django.utils import timezone
+
+
+def encerrar_abertos_duplicados(apps, schema_editor):
+    """Deixa no maximo um acesso em aberto por funcionario antes da restricao.
+
+    O acesso aberto mais recente de cada funcionario continua aberto; os
+    anteriores sao encerrados agora e suas movimentacoes entram no resumo
+    mensal, como faria ``Acesso.encerrar``.
+    """
+    Acesso = apps.get_model('core', 'Acesso')
+    Movimentacao = apps.get_model('core', 'Movimentacao')
+    ResumoMensal = apps.get_model('core', 'ResumoMensal')
+    repetidos = (
+        Acesso.objects.filter(status='ABERTO')
+        .values('funcionario_id')
+        .annotate(total=Count('id'), ultimo=Max('id'))
+        .filter(total__gt=1)
+    )
+    encerrar = []
+    for linha in repetidos:
+        encerrar.extend(
+            Acesso.objects.filter(status='ABERTO', funcionario_id=linha['funcionario_id'])
+            .exclude(id=linha['ultimo'])
+            .values_list('id', flat=True)
+        )
+    if not encerrar:
+        return
+    Acesso.objects.filter(id__in=encerrar).update(status='FECHADO', ativo=False, data_saida=timezone.now())
+    agrupado = (
+        Movimentacao.objects.filter(acesso_id__in=encerrar)
+        .annotate(ano=ExtractYear('acesso__data_hora'), mes=ExtractMonth('acesso__data_hora'))
+        .order_by()
+        .values('ano', 'mes', 'acesso__almoxarifado_id', 'acesso__funcionario_id', 'material_id', 'acesso__tipo', 'tipo')
+        .annotate(quantidade_total=Sum('quantidade'), total=Count('id'))
+    )
+    for linha in agrupado:
+        resumo, _ = ResumoMensal.objects.get_or_create(
+            ano=linha['ano'],
+            mes=linha['mes'],
+            almoxarifado_id=linha['acesso__almoxarifado_id'],
+            funcionario_id=linha['acesso__funcionario_id'],
+            material_id=linha['material_id'],
+            tipo_acesso=linha['acesso__tipo'],
+            tipo=linha['tipo'],
+        )
+        ResumoMensal.objects.filter(pk=resumo.pk).update(
+            quantidade=F('quantidade') + linha['quantidade_total'],
+            total_movimentacoes=F('total_movimentacoes') + linha['total'],
+        )
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('core', '0008_nomes_unicos'),
+        migrations.swappable_dependency(settings.AUTH_USER_MODEL),
+    ]
+
+    operations = [
+        migrations.AddIndex(
+            model_name='acesso',
+            index=models.Index(fields=['data_hora', 'id'], name='acesso_data_hora_idx'),
+        ),
+        migrations.AddIndex(
+            model_name='acesso',
+            index=models.Index(fields=['status', 'data_hora'], name='acesso_status_data_idx'),
+        ),
+        migrations.AddIndex(
+            model_name='movimentacao',
+            index=models.Index(fields=['acesso', 'tipo'], name='movimentacao_acesso_tipo_idx'),
+        ),
+        migrations.AddIndex(
+            model_name='movimentacao',
+            index=models.Index(fields=['material', 'tipo'], name='movimentacao_material_tipo_idx'),
+        ),
+        migrations.RunPython(encerrar_abertos_duplicados, migrations.RunPython.noop),
+        migrations.AddConstraint(
+            model_name='acesso',
+            constraint=models.UniqueConstraint(condition=models.Q(('status', 'ABERTO')), fields=('funcionario',), name='acesso_aberto_unico_por_funcionario', violation_error_message='Este funcionário já tem um acesso em aberto.'),
+        ),
+    ]
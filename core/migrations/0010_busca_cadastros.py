@@ -0,0 +1,71 @@
+# Generated by Django 5.2.18 on 2026-10-17 12:10
+
+from django.db import migrations
+
+# Tabelas FTS5 (uma por cadastro) com rowid igual ao id do registro,
+# mantidas por triggers. Em bancos sem FTS5 a busca cai no filtro por prefixo.
+CADASTROS = {
+    'core_funcionario': ['nome'],
+    'core_autorizador': ['nome'],
+    'core_almoxarifado': ['nome', 'localizacao'],
+    'core_material': ['nome'],
+}
+
+
+def _fts5_disponivel(connection):
+    if connection.vendor != 'sqlite':
+        return False
+    with connection.cursor() as cursor:
+        cursor.execute("SELECT sqlite_compileoption_used('ENABLE_FTS5')")
+        if cursor.fetchone()[0]:
+            return True
+        cursor.execute("SELECT 1 FROM pragma_module_list WHERE name = 'fts5'")
+        return cursor.fetchone() is not None
+
+
+def criar_busca(apps, schema_editor):
+    if not _fts5_disponivel(schema_editor.connection):
+        return
+    for tabela, colunas in CADASTROS.items():
+        busca = f'{tabela}_busca'
+        lista = ', '.join(colunas)
+        novos = ', '.join(f'new.{coluna}' for coluna in colunas)
+        schema_editor.execute(
+            f"CREATE VIRTUAL TABLE {busca} USING fts5({lista}, "
+            f"tokenize = 'unicode61 remove_diacritics 2', prefix = '2 3')"
+        )
+        schema_editor.execute(f'INSERT INTO {busca} (rowid, {lista}) SELECT id, {lista} FROM {tabela}')
+        schema_editor.execute(
+            f'CREATE TRIGGER {busca}_ai AFTER INSERT ON {tabela} BEGIN '
+            f'INSERT INTO {busca} (rowid, {lista}) VALUES (new.id, {novos}); END'
+        )
+        schema_editor.execute(
+            f'CREATE TRIGGER {busca}_au AFTER UPDATE OF {lista} ON {tabela} BEGIN '
+            f'DELETE FROM {busca} WHERE rowid = old.id; '
+            f'INSERT INTO {busca} (rowid, {lista}) VALUES (new.id, {novos}); END'
+        )
+        schema_editor.execute(
+            f'CREATE TRIGGER {busca}_ad AFTER DELETE ON {tabela} BEGIN '
+            f'DELETE FROM {busca} WHERE rowid = old.id; END'
+        )
+
+
+def remover_busca(apps, schema_editor):
+    if schema_editor.connection.vendor != 'sqlite':
+        return
+    for tabela in CADASTROS:
+        busca = f'{tabela}_busca'
+        for sufixo in ('ai', 'au', 'ad'):
+            schema_editor.execute(f'DROP TRIGGER IF EXISTS {busca}_{sufixo}')
+        schema_editor.execute(f'DROP TABLE IF EXISTS {busca}')
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('core', '0009_indices_consultas'),
+    ]
+
+    operations = [
+        migrations.RunPython(criar_busca, remover_busca),
+    ]
@@ -0,0 +1,85 @@
+# Generated by Django 5.2.18 on 2026-10-17 13:02
+
+from django.db import migrations
+
+# Indice FTS5 do historico: uma linha por acesso (rowid = id do acesso) com os
+# nomes do funcionario, autorizador, almoxarifado, materiais movimentados e a
+# observacao. Triggers reindexam o acesso quando qualquer uma dessas fontes muda.
+INDEXAR = (
+    'INSERT INTO core_acesso_busca (rowid, funcionario, autorizador, almoxarifado, materiais, observacao) '
+    'SELECT a.id, f.nome, au.nome, al.nome || \' \' || al.localizacao, '
+    '(SELECT group_concat(DISTINCT m.nome) FROM core_movimentacao mv '
+    'JOIN core_material m ON m.id = mv.material_id WHERE mv.acesso_id = a.id), '
+    'coalesce(a.observacao, \'\') '
+    'FROM core_acesso a '
+    'JOIN core_funcionario f ON f.id = a.funcionario_id '
+    'JOIN core_autorizador au ON au.id = a.autorizador_id '
+    'JOIN core_almoxarifado al ON al.id = a.almoxarifado_id '
+    'WHERE {condicao}'
+)
+REINDEXAR = (
+    'DELETE FROM core_acesso_busca WHERE rowid IN (SELECT a.id FROM core_acesso a WHERE {condicao}); '
+    + INDEXAR
+    + ';'
+)
+
+TRIGGERS = {
+    'core_acesso_busca_ai': ('AFTER INSERT ON core_acesso', 'a.id = new.id'),
+    'core_acesso_busca_au': (
+        'AFTER UPDATE OF funcionario_id, autorizador_id, almoxarifado_id, observacao ON core_acesso',
+        'a.id = new.id',
+    ),
+    'core_acesso_busca_mov_ai': ('AFTER INSERT ON core_movimentacao', 'a.id = new.acesso_id'),
+    'core_acesso_busca_mov_au': (
+        'AFTER UPDATE OF material_id, acesso_id ON core_movimentacao',
+        'a.id IN (old.acesso_id, new.acesso_id)',
+    ),
+    'core_acesso_busca_mov_ad': ('AFTER DELETE ON core_movimentacao', 'a.id = old.acesso_id'),
+    'core_acesso_busca_funcionario_au': ('AFTER UPDATE OF nome ON core_funcionario', 'a.funcionario_id = new.id'),
+    'core_acesso_busca_autorizador_au': ('AFTER UPDATE OF nome ON core_autorizador', 'a.autorizador_id = new.id'),
+    'core_acesso_busca_almoxarifado_au': (
+        'AFTER UPDATE OF nome, localizacao ON core_almoxarifado',
+        'a.almoxarifado_id = new.id',
+    ),
+    'core_acesso_busca_material_au': (
+        'AFTER UPDATE OF nome ON core_material',
+        'a.id IN (SELECT acesso_id FROM core_movimentacao WHERE material_id = new.id)',
+    ),
+}
+
+
+def criar_busca(apps, schema_editor):
+    connection = schema_editor.connection
+    if connection.vendor != 'sqlite' or 'core_material_busca' not in connection.introspection.table_names():
+        return
+    schema_editor.execute(
+        'CREATE VIRTUAL TABLE core_acesso_busca USING fts5('
+        'funcionario, autorizador, almoxarifado, materiais, observacao, '
+        "tokenize = 'unicode61 remove_diacritics 2', prefix = '2 3')"
+    )
+    schema_editor.execute(INDEXAR.format(condicao='1 = 1'))
+    for nome, (evento, condicao) in TRIGGERS.items():
+        schema_editor.execute(f'CREATE TRIGGER {nome} {evento} BEGIN {REINDEXAR.format(condicao=condicao)} END')
+    schema_editor.execute(
+        'CREATE TRIGGER core_acesso_busca_ad AFTER DELETE ON core_acesso BEGIN '
+        'DELETE FROM core_acesso_busca WHERE rowid = old.id; END'
+    )
+
+
+def remover_busca(apps, schema_editor):
+    if schema_editor.connection.vendor != 'sqlite':
+        return
+    for nome in [*TRIGGERS, 'core_acesso_busca_ad']:
+        schema_editor.execute(f'DROP TRIGGER IF EXISTS {nome}')
+    schema_editor.execute('DROP TABLE IF EXISTS core_acesso_busca')
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('core', '0010_busca_cadastros'),
+    ]
+
+    operations = [
+        migrations.RunPython(criar_busca, remover_busca),
+    ]
@@ -0,0 +1,34 @@
+# Generated by Django 5.2.18 on 2026-10-17 03:09
+
+import django.utils.timezone
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('core', '0011_busca_acessos'),
+    ]
+
+    operations = [
+        migrations.CreateModel(
+            name='AmostraRequisicao',
+            fields=[
+                ('id', models.BigAutoField(auto_created=True, primary_key=True, serialize=False, verbose_name='ID')),
+                ('view', models.CharField(max_length=150)),
+                ('metodo', models.CharField(max_length=10)),
+                ('status', models.PositiveSmallIntegerField()),
+                ('duracao_ms', models.FloatField()),
+                ('consultas', models.PositiveIntegerField()),
+                ('tempo_db_ms', models.FloatField()),
+                ('tempo_template_ms', models.FloatField()),
+                ('suspeita_n_mais_1', models.BooleanField(default=False)),
+                ('consulta_repetida', models.TextField(blank=True)),
+                ('repeticoes', models.PositiveIntegerField(default=0)),
+                ('criado_em', models.DateTimeField(default=django.utils.timezone.now)),
+            ],
+            options={
+                'indexes': [models.Index(fields=['view', 'criado_em'], name='amostra_view_data_idx'), models.Index(fields=['criado_em'], name='amostra_data_idx')],
+            },
+        ),
+    ]
@@ -0,0 +1,40 @@
+# Generated by Django 5.2.18 on 2026-10-17 03:28
+
+import django.db.models.deletion
+import django.utils.timezone
+from django.conf import settings
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('core', '0012_amostrarequisicao'),
+        migrations.swappable_dependency(settings.AUTH_USER_MODEL),
+    ]
+
+    operations = [
+        migrations.CreateModel(
+            name='Tarefa',
+            fields=[
+                ('id', models.BigAutoField(auto_created=True, primary_key=True, serialize=False, verbose_name='ID')),
+                ('tipo', models.CharField(choices=[('exportar_relatorio', 'Exportar relatorio'), ('exportar_historico', 'Exportar historico'), ('recalcular_estoque', 'Recalcular estoque')], max_length=30)),
+                ('parametros', models.JSONField(blank=True, default=dict)),
+                ('status', models.CharField(choices=[('PENDENTE', 'Pendente'), ('EXECUTANDO', 'Executando'), ('CONCLUIDA', 'Concluida'), ('FALHOU', 'Falhou')], default='PENDENTE', max_length=10)),
+                ('progresso', models.PositiveSmallIntegerField(default=0)),
+                ('mensagem', models.TextField(blank=True)),
+                ('arquivo', models.FileField(blank=True, upload_to='tarefas/%Y/%m/')),
+                ('worker', models.CharField(blank=True, max_length=100)),
+                ('tentativas', models.PositiveSmallIntegerField(default=0)),
+                ('criado_em', models.DateTimeField(default=django.utils.timezone.now)),
+                ('iniciado_em', models.DateTimeField(blank=True, null=True)),
+                ('atualizado_em', models.DateTimeField(blank=True, null=True)),
+                ('concluido_em', models.DateTimeField(blank=True, null=True)),
+                ('criado_por', models.ForeignKey(blank=True, null=True, on_delete=django.db.models.deletion.SET_NULL, related_name='tarefas', to=settings.AUTH_USER_MODEL)),
+            ],
+            options={
+                'ordering': ['-criado_em', '-id'],
+                'indexes': [models.Index(fields=['status', 'id'], name='tarefa_fila_idx'), models.Index(fields=['criado_por', 'criado_em'], name='tarefa_usuario_idx')],
+            },
+        ),
+    ]
@@ -0,0 +1,18 @@
+# Generated by Django 5.2.18 on 2026-10-17 03:33
+
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('core', '0013_tarefa'),
+    ]
+
+    operations = [
+        migrations.AlterField(
+            model_name='lancamentoestoque',
+            name='origem',
+            field=models.CharField(choices=[('MOVIMENTACAO', 'Movimentacao'), ('ESTORNO', 'Estorno de movimentacao'), ('AJUSTE', 'Ajuste de saldo'), ('CONCILIACAO', 'Correcao da conciliacao')], max_length=20),
+        ),
+    ]
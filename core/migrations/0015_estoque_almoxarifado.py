@@ -0,0 +1,104 @@
+# Generated by Django 5.2.18 on 2026-10-17 03:54
+
+import django.db.models.deletion
+from django.db import migrations, models
+from django.db.models import Count, Sum
+
+from ._busca import criar_buscas, remover_buscas
+
+
+def distribuir_estoque(apps, schema_editor):
+    Almoxarifado = apps.get_model('core', 'Almoxarifado')
+    EstoqueAlmoxarifado = apps.get_model('core', 'EstoqueAlmoxarifado')
+    LancamentoEstoque = apps.get_model('core', 'LancamentoEstoque')
+    Movimentacao = apps.get_model('core', 'Movimentacao')
+
+    # Lancamentos sem unidade (estoque inicial, ajustes pelo cadastro) ficam
+    # na unidade com mais movimentacoes do material, ou na primeira cadastrada.
+    principal = {}
+    maximo = {}
+    contagens = (
+        Movimentacao.objects.order_by()
+        .values('material', 'acesso__almoxarifado')
+        .annotate(total=Count('id'))
+        .values_list('material', 'acesso__almoxarifado', 'total')
+    )
+    for material_id, almoxarifado_id, total in contagens:
+        if total > maximo.get(material_id, 0):
+            maximo[material_id] = total
+            principal[material_id] = almoxarifado_id
+    primeiro = Almoxarifado.objects.order_by('pk').values_list('pk', flat=True).first()
+
+    sem_unidade = LancamentoEstoque.objects.filter(almoxarifado__isnull=True)
+    por_unidade = {}
+    for material_id in list(sem_unidade.order_by().values_list('material', flat=True).distinct()):
+        unidade = principal.get(material_id, primeiro)
+        if unidade is not None:
+            por_unidade.setdefault(unidade, []).append(material_id)
+    for unidade, materiais in por_unidade.items():
+        for inicio in range(0, len(materiais), 500):
+            sem_unidade.filter(material_id__in=materiais[inicio : inicio + 500]).update(almoxarifado_id=unidade)
+
+    # O saldo de cada unidade e o do livro; saldos negativos ficam em zero,
+    # como o contador antigo, e aparecem na conciliacao.
+    saldos = (
+        LancamentoEstoque.objects.filter(almoxarifado__isnull=False)
+        .order_by()
+        .values('material', 'almoxarifado')
+        .annotate(saldo=Sum('delta'))
+        .values_list('material', 'almoxarifado', 'saldo')
+    )
+    EstoqueAlmoxarifado.objects.bulk_create(
+        [
+            EstoqueAlmoxarifado(material_id=material_id, almoxarifado_id=almoxarifado_id, quantidade=max(saldo, 0))
+            for material_id, almoxarifado_id, saldo in saldos
+        ],
+        batch_size=1000,
+    )
+
+
+def juntar_estoque(apps, schema_editor):
+    EstoqueAlmoxarifado = apps.get_model('core', 'EstoqueAlmoxarifado')
+    Material = apps.get_model('core', 'Material')
+    totais = (
+        EstoqueAlmoxarifado.objects.order_by()
+        .values('material')
+        .annotate(total=Sum('quantidade'))
+        .values_list('material', 'total')
+    )
+    for material_id, total in totais:
+        Material.objects.filter(pk=material_id).update(quantidade_estoque=total)
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('core', '0014_lancamento_conciliacao'),
+    ]
+
+    operations = [
+        migrations.CreateModel(
+            name='EstoqueAlmoxarifado',
+            fields=[
+                ('id', models.BigAutoField(auto_created=True, primary_key=True, serialize=False, verbose_name='ID')),
+                ('quantidade', models.PositiveIntegerField(default=0)),
+                ('almoxarifado', models.ForeignKey(on_delete=django.db.models.deletion.CASCADE, related_name='estoques', to='core.almoxarifado')),
+                ('material', models.ForeignKey(on_delete=django.db.models.deletion.CASCADE, related_name='estoques', to='core.material')),
+            ],
+            options={
+                'constraints': [models.UniqueConstraint(fields=('material', 'almoxarifado'), name='estoque_almoxarifado_unico')],
+            },
+        ),
+        migrations.RunPython(distribuir_estoque, juntar_estoque),
+        migrations.AddIndex(
+            model_name='lancamentoestoque',
+            index=models.Index(fields=['material', 'almoxarifado', 'criado_em'], name='lancamento_material_almox_idx'),
+        ),
+        # Desfazer o RemoveField abaixo recria core_material no SQLite.
+        migrations.RunPython(migrations.RunPython.noop, criar_buscas),
+        migrations.RemoveField(
+            model_name='material',
+            name='quantidade_estoque',
+        ),
+        migrations.RunPython(migrations.RunPython.noop, remover_buscas),
+    ]
@@ -0,0 +1,19 @@
+# Generated by Django 5.2.18 on 2026-10-17 04:14
+
+from django.conf import settings
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('core', '0015_estoque_almoxarifado'),
+        migrations.swappable_dependency(settings.AUTH_USER_MODEL),
+    ]
+
+    operations = [
+        migrations.AddIndex(
+            model_name='acesso',
+            index=models.Index(fields=['data_saida', 'id'], name='acesso_saida_idx'),
+        ),
+    ]
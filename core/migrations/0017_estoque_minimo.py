@@ -0,0 +1,56 @@
+# Generated by Django 5.2.18 on 2026-10-17 04:18
+
+from django.db import migrations, models
+from django.db.models import Case, F, Value, When
+
+from ._busca import criar_buscas, remover_buscas
+
+
+def classificar_estoques(apps, schema_editor):
+    # Faltas que ja existiam nao geram alerta na primeira retirada depois da migracao.
+    EstoqueAlmoxarifado = apps.get_model('core', 'EstoqueAlmoxarifado')
+    abaixo = Case(When(quantidade__lt=F('minimo_efetivo'), then=Value(True)), default=Value(False))
+    EstoqueAlmoxarifado.objects.update(abaixo_do_minimo=abaixo, alertado=abaixo)
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('core', '0016_acesso_saida_idx'),
+    ]
+
+    operations = [
+        migrations.AddField(
+            model_name='estoquealmoxarifado',
+            name='abaixo_do_minimo',
+            field=models.BooleanField(default=False, editable=False),
+        ),
+        migrations.AddField(
+            model_name='estoquealmoxarifado',
+            name='alertado',
+            field=models.BooleanField(default=False, editable=False),
+        ),
+        migrations.AddField(
+            model_name='estoquealmoxarifado',
+            name='estoque_minimo',
+            field=models.PositiveIntegerField(blank=True, help_text='Minimo proprio desta unidade; vazio usa o do material.', null=True),
+        ),
+        migrations.AddField(
+            model_name='estoquealmoxarifado',
+            name='minimo_efetivo',
+            field=models.PositiveIntegerField(default=5, editable=False),
+        ),
+        # Desfazer o AddField abaixo recria core_material no SQLite.
+        migrations.RunPython(migrations.RunPython.noop, criar_buscas),
+        migrations.AddField(
+            model_name='material',
+            name='estoque_minimo',
+            field=models.PositiveIntegerField(blank=True, help_text='Abaixo disso o saldo de uma unidade gera alerta; vazio usa 5.', null=True),
+        ),
+        migrations.RunPython(migrations.RunPython.noop, remover_buscas),
+        migrations.RunPython(classificar_estoques, migrations.RunPython.noop),
+        migrations.AddIndex(
+            model_name='estoquealmoxarifado',
+            index=models.Index(condition=models.Q(('abaixo_do_minimo', True)), fields=['almoxarifado', 'material'], name='estoque_baixo_idx'),
+        ),
+    ]
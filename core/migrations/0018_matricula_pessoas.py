@@ -0,0 +1,29 @@
+# Generated by Django 5.2.18 on 2026-10-17 04:39
+
+from django.db import migrations, models
+
+from ._busca import criar_buscas, remover_buscas
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('core', '0017_estoque_minimo'),
+    ]
+
+    # No SQLite as duas colunas unicas recriam core_funcionario e core_autorizador; as buscas
+    # saem antes e voltam depois (ver ``_busca``).
+    operations = [
+        migrations.RunPython(remover_buscas, criar_buscas),
+        migrations.AddField(
+            model_name='autorizador',
+            name='matricula',
+            field=models.CharField(blank=True, max_length=20, null=True, unique=True),
+        ),
+        migrations.AddField(
+            model_name='funcionario',
+            name='matricula',
+            field=models.CharField(blank=True, max_length=20, null=True, unique=True),
+        ),
+        migrations.RunPython(criar_buscas, remover_buscas),
+    ]
@@ -0,0 +1,35 @@
+# Generated by Django 5.2.18 on 2026-10-17 05:08
+
+import django.db.models.deletion
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('core', '0018_matricula_pessoas'),
+    ]
+
+    operations = [
+        migrations.RemoveIndex(
+            model_name='lancamentoestoque',
+            name='lancamento_material_almox_idx',
+        ),
+        migrations.RemoveIndex(
+            model_name='snapshotestoque',
+            name='snapshot_material_idx',
+        ),
+        migrations.AddField(
+            model_name='snapshotestoque',
+            name='almoxarifado',
+            field=models.ForeignKey(blank=True, null=True, on_delete=django.db.models.deletion.CASCADE, to='core.almoxarifado'),
+        ),
+        migrations.AddIndex(
+            model_name='lancamentoestoque',
+            index=models.Index(fields=['material', 'almoxarifado', 'id'], name='lancamento_almox_id_idx'),
+        ),
+        migrations.AddIndex(
+            model_name='snapshotestoque',
+            index=models.Index(fields=['material', 'almoxarifado', '-ate_lancamento'], name='snapshot_material_almox_idx'),
+        ),
+    ]
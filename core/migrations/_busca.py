@@ -0,0 +1,69 @@
+"""Indices de busca (0010 e 0011) para migracoes que recriam tabelas no SQLite.
+
+Alterar certas colunas no SQLite recria a tabela (``_remake_table``). Os
+triggers de ``core_acesso_busca`` citam cadastros e movimentacoes no corpo, e
+a troca de nome da tabela nova falha com "no such table". Os triggers da
+propria tabela somem junto com ela. A migracao remove as buscas antes e as
+recria depois, com ``RunPython(remover_buscas, criar_buscas)`` antes da
+operacao e ``RunPython(criar_buscas, remover_buscas)`` depois. Recriar
+reindexa tudo a partir das tabelas.
+
+``desprotegidas`` aponta operacoes nessas tabelas fora do par; a verificacao
+``core.E001`` (``core/checks.py``) roda com ``migrate`` e com os testes e
+barra migracoes novas que esquecam o par.
+
+O nome com ``_`` deixa este modulo fora da lista de migracoes.
+"""
+
+from importlib import import_module
+
+from django.db.migrations import operations
+
+_cadastros = import_module('core.migrations.0010_busca_cadastros')
+_acessos = import_module('core.migrations.0011_busca_acessos')
+
+
+def remover_buscas(apps, schema_editor):
+    _acessos.remover_busca(apps, schema_editor)
+    _cadastros.remover_busca(apps, schema_editor)
+
+
+def criar_buscas(apps, schema_editor):
+    _cadastros.criar_busca(apps, schema_editor)
+    _acessos.criar_busca(apps, schema_editor)
+
+
+# Tabelas dos triggers de busca: os cadastros (0010) e todas as citadas nos
+# triggers do historico (0011).
+TABELAS = {*_cadastros.CADASTROS, *(evento.rsplit(' ON ', 1)[1] for evento, _ in _acessos.TRIGGERS.values())}
+# Operacoes que nunca recriam a tabela no SQLite.
+SEM_RECRIACAO = (
+    operations.CreateModel,
+    operations.AddIndex,
+    operations.RemoveIndex,
+    operations.RenameIndex,
+    operations.AlterModelOptions,
+    operations.AlterModelManagers,
+)
+
+
+def desprotegidas(lista, app_label='core'):
+    """Operacoes de ``lista`` que podem recriar uma tabela de ``TABELAS`` fora do par.
+
+    O par abre com o ``RunPython`` cujo reverso e ``criar_buscas`` e fecha com
+    o que tem reverso ``remover_buscas``; assim vale tanto
+    ``RunPython(remover_buscas, criar_buscas)`` quanto a forma so de volta
+    ``RunPython(noop, criar_buscas)``.
+    """
+    resultado, abertas, protegido = [], [], False
+    for operacao in lista:
+        if isinstance(operacao, operations.RunPython) and operacao.reverse_code in (criar_buscas, remover_buscas):
+            protegido = operacao.reverse_code is criar_buscas
+            abertas = []
+            continue
+        modelo = getattr(operacao, 'model_name_lower', None) or getattr(operacao, 'name_lower', None)
+        if not modelo or isinstance(operacao, SEM_RECRIACAO) or f'{app_label}_{modelo}' not in TABELAS:
+            continue
+        (abertas if protegido else resultado).append(operacao)
+    # Um par aberto e nunca fechado nao recria as buscas.
+    return resultado + abertas
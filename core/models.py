@@ -1,37 +1,329 @@
+import time
+
 from django.conf import settings
+from django.core.cache import cache
 from django.core.exceptions import ValidationError
-from django.db import models, transaction
+from django.db import IntegrityError, models, transaction
+from django.db.models import Case, Count, F, Max, Min, Q, Sum, Value, When
 from django.utils import timezone
 
+from . import alertas, versoes
+
+# Estoque minimo de um material novo em cada almoxarifado.
+ESTOQUE_MINIMO_PADRAO = 5
+
 
-class Funcionario(models.Model):
+class CadastroMixin:
+    """Cadastros aparecem em todas as telas: alterar um invalida os marcadores de ``versoes``."""
+
+    def save(self, *args, **kwargs):
+        super().save(*args, **kwargs)
+        versoes.marcar_tudo()
+
+    def delete(self, *args, **kwargs):
+        versoes.marcar_tudo()
+        return super().delete(*args, **kwargs)
+
+
+class Funcionario(CadastroMixin, models.Model):
+    # Homonimos sao comuns; o que identifica a pessoa e a matricula.
     nome = models.CharField(max_length=100)
+    matricula = models.CharField(max_length=20, unique=True, null=True, blank=True)
 
     def __str__(self) -> str:
-        return self.nome
+        return f'{self.nome} ({self.matricula})' if self.matricula else self.nome
 
 
-class Autorizador(models.Model):
+class Autorizador(CadastroMixin, models.Model):
     nome = models.CharField(max_length=100)
+    matricula = models.CharField(max_length=20, unique=True, null=True, blank=True)
 
     def __str__(self) -> str:
-        return self.nome
+        return f'{self.nome} ({self.matricula})' if self.matricula else self.nome
 
 
-class Almoxarifado(models.Model):
-    nome = models.CharField(max_length=100)
+class Almoxarifado(CadastroMixin, models.Model):
+    nome = models.CharField(max_length=100, unique=True)
     localizacao = models.CharField(max_length=150)
 
     def __str__(self) -> str:
         return f"{self.nome} - {self.localizacao}"
 
 
-class Material(models.Model):
-    nome = models.CharField(max_length=120)
-    quantidade_estoque = models.PositiveIntegerField(default=0)
+class Material(CadastroMixin, models.Model):
+    nome = models.CharField(max_length=120, unique=True)
+    # Nulo usa ESTOQUE_MINIMO_PADRAO.
+    estoque_minimo = models.PositiveIntegerField(
+        null=True,
+        blank=True,
+        help_text=f'Abaixo disso o saldo de uma unidade gera alerta; vazio usa {ESTOQUE_MINIMO_PADRAO}.',
+    )
+
+    CHAVE_VERSAO_MAPA = 'core:materiais:versao'
+
+    def __str__(self) -> str:
+        return self.nome
+
+    @property
+    def minimo_efetivo(self) -> int:
+        return ESTOQUE_MINIMO_PADRAO if self.estoque_minimo is None else self.estoque_minimo
+
+    @classmethod
+    def minimos(cls, ids=None) -> dict[int, int]:
+        """Estoque minimo efetivo de cada material (de ``ids``, ou de todos)."""
+        materiais = cls.objects.all() if ids is None else cls.objects.filter(pk__in=ids)
+        return {
+            pk: ESTOQUE_MINIMO_PADRAO if minimo is None else minimo
+            for pk, minimo in materiais.values_list('pk', 'estoque_minimo')
+        }
+
+    @classmethod
+    def versao_mapa_estoques(cls) -> int:
+        versao = cache.get(cls.CHAVE_VERSAO_MAPA)
+        if versao is None:
+            cache.add(cls.CHAVE_VERSAO_MAPA, time.time_ns(), None)
+            versao = cache.get(cls.CHAVE_VERSAO_MAPA)
+        return versao
+
+    @classmethod
+    async def aversao_mapa_estoques(cls) -> int:
+        """``versao_mapa_estoques`` para views async, pelos metodos ``a*`` do cache."""
+        versao = await cache.aget(cls.CHAVE_VERSAO_MAPA)
+        if versao is None:
+            await cache.aadd(cls.CHAVE_VERSAO_MAPA, time.time_ns(), None)
+            versao = await cache.aget(cls.CHAVE_VERSAO_MAPA)
+        return versao
+
+    @classmethod
+    def mapa_estoques(cls) -> tuple[int, dict]:
+        """Retorna ``(versao, {id: {'nome', 'estoque', 'estoques'}})`` de todos os materiais.
+
+        ``estoques`` e o saldo por id de almoxarifado e ``estoque`` a soma
+        deles. O mapa fica em cache sob uma chave que inclui a versao;
+        qualquer alteracao de estoque ou cadastro troca a versao (ver
+        ``invalidar_mapa_estoques``) e o mapa antigo simplesmente expira.
+        """
+        versao = cls.versao_mapa_estoques()
+        chave = f'core:materiais:mapa:{versao}'
+        mapa = cache.get(chave)
+        if mapa is None:
+            mapa = {
+                id: {'nome': nome, 'estoque': 0, 'estoques': {}}
+                for id, nome in cls.objects.order_by('nome').values_list('id', 'nome')
+            }
+            saldos = EstoqueAlmoxarifado.objects.values_list('material_id', 'almoxarifado_id', 'quantidade')
+            for material_id, almoxarifado_id, quantidade in saldos:
+                item = mapa.get(material_id)
+                if item is not None:
+                    item['estoques'][almoxarifado_id] = quantidade
+                    item['estoque'] += quantidade
+            cache.set(chave, mapa, 60 * 60)
+        return versao, mapa
+
+    @classmethod
+    def invalidar_mapa_estoques(cls):
+        """Troca a versao do mapa quando a transacao atual for confirmada."""
+        transaction.on_commit(cls._nova_versao_mapa)
+
+    @classmethod
+    def _nova_versao_mapa(cls):
+        try:
+            cache.incr(cls.CHAVE_VERSAO_MAPA)
+        except ValueError:
+            cache.set(cls.CHAVE_VERSAO_MAPA, time.time_ns(), None)
+
+    def save(self, *args, **kwargs):
+        criando = self._state.adding
+        super().save(*args, **kwargs)
+        Material.invalidar_mapa_estoques()
+        if not criando:
+            # Unidades sem minimo proprio seguem o do material.
+            unidades = self.estoques.filter(estoque_minimo__isnull=True).exclude(minimo_efetivo=self.minimo_efetivo)
+            if EstoqueAlmoxarifado.reclassificar(unidades, minimo=self.minimo_efetivo):
+                EstoqueAlmoxarifado.agendar_alertas([self.pk])
+
+    def delete(self, *args, **kwargs):
+        Material.invalidar_mapa_estoques()
+        return super().delete(*args, **kwargs)
+
+
+class EstoqueAlmoxarifado(models.Model):
+    """Saldo de um material em um almoxarifado.
+
+    Cada unidade tem a propria linha: retiradas em almoxarifados diferentes
+    nao disputam o mesmo registro; as do mesmo material na mesma unidade
+    continuam serializadas por ela.
+
+    ``abaixo_do_minimo`` e recalculado em cada alteracao do saldo (no mesmo
+    UPDATE de ``somar``), e o indice parcial ``estoque_baixo_idx`` cobre so as
+    linhas marcadas: listar o estoque baixo nao percorre a tabela. ``alertado``
+    registra que o alerta da falta atual ja foi enviado; volta a ``False``
+    quando o saldo chega ao minimo de novo.
+    """
+
+    material = models.ForeignKey(Material, on_delete=models.CASCADE, related_name='estoques')
+    almoxarifado = models.ForeignKey(Almoxarifado, on_delete=models.CASCADE, related_name='estoques')
+    quantidade = models.PositiveIntegerField(default=0)
+    estoque_minimo = models.PositiveIntegerField(
+        null=True, blank=True, help_text='Minimo proprio desta unidade; vazio usa o do material.'
+    )
+    minimo_efetivo = models.PositiveIntegerField(default=ESTOQUE_MINIMO_PADRAO, editable=False)
+    abaixo_do_minimo = models.BooleanField(default=False, editable=False)
+    alertado = models.BooleanField(default=False, editable=False)
+
+    class Meta:
+        constraints = [
+            models.UniqueConstraint(fields=['material', 'almoxarifado'], name='estoque_almoxarifado_unico'),
+        ]
+        indexes = [
+            models.Index(
+                fields=['almoxarifado', 'material'],
+                name='estoque_baixo_idx',
+                condition=Q(abaixo_do_minimo=True),
+            ),
+        ]
 
     def __str__(self) -> str:
-        return f"{self.nome} ({self.quantidade_estoque})"
+        return f"{self.material.nome} em {self.almoxarifado.nome} ({self.quantidade})"
+
+    @staticmethod
+    def _classificacao(novo_saldo_abaixo: Q) -> dict:
+        """Campos de um UPDATE que marcam a falta e liberam novo alerta quando ela acaba."""
+        return {
+            'abaixo_do_minimo': Case(When(novo_saldo_abaixo, then=Value(True)), default=Value(False)),
+            'alertado': Case(When(novo_saldo_abaixo, then=F('alertado')), default=Value(False)),
+        }
+
+    @classmethod
+    def nova_linha(cls, material_id: int, almoxarifado_id: int, quantidade: int, minimo: int | None = None):
+        """Linha ja classificada para ``bulk_create``, que nao passa pelo ``save``.
+
+        ``minimo`` padrao e o estoque minimo do material.
+        """
+        if minimo is None:
+            minimo = Material.minimos([material_id]).get(material_id, ESTOQUE_MINIMO_PADRAO)
+        return cls(
+            material_id=material_id,
+            almoxarifado_id=almoxarifado_id,
+            quantidade=quantidade,
+            minimo_efetivo=minimo,
+            abaixo_do_minimo=quantidade < minimo,
+        )
+
+    @classmethod
+    def reclassificar(cls, linhas=None, *, minimo: int | None = None) -> int:
+        """Recalcula ``abaixo_do_minimo`` de ``linhas`` (padrao: todas) num UPDATE.
+
+        Para alteracoes feitas sem passar por ``save`` ou ``somar``, como
+        recalculos em massa. Com ``minimo`` grava antes esse minimo efetivo.
+        """
+        linhas = cls.objects.all() if linhas is None else linhas
+        campos = {}
+        if minimo is not None:
+            campos['minimo_efetivo'] = minimo
+        limite = F('minimo_efetivo') if minimo is None else Value(minimo)
+        return linhas.update(**campos, **cls._classificacao(Q(quantidade__lt=limite)))
+
+    @classmethod
+    def agendar_alertas(cls, material_ids=None) -> None:
+        """Envia, depois do commit, os alertas pendentes dos materiais (ou de todos)."""
+        ids = None if material_ids is None else list(material_ids)
+        transaction.on_commit(lambda: cls.enviar_alertas(ids))
+
+    @classmethod
+    def enviar_alertas(cls, material_ids=None) -> list:
+        """Entrega pelo notificador configurado as faltas ainda nao alertadas.
+
+        Cada linha e marcada com um UPDATE condicional antes do envio, entao
+        processos concorrentes nao repetem o mesmo alerta. Se a entrega
+        falhar a marca e desfeita: o proximo envio (ou ``estoque_baixo
+        --notificar``) tenta de novo. Retorna os alertas entregues.
+        """
+        pendentes = cls.objects.filter(abaixo_do_minimo=True, alertado=False)
+        if material_ids is not None:
+            pendentes = pendentes.filter(material_id__in=material_ids)
+        marcados = []
+        enviados = []
+        for estoque in pendentes.select_related('material', 'almoxarifado').order_by('material_id', 'almoxarifado_id'):
+            if not cls.objects.filter(pk=estoque.pk, alertado=False).update(alertado=True):
+                continue
+            marcados.append(estoque.pk)
+            enviados.append(
+                alertas.AlertaEstoque(
+                    material_id=estoque.material_id,
+                    material=estoque.material.nome,
+                    almoxarifado_id=estoque.almoxarifado_id,
+                    almoxarifado=estoque.almoxarifado.nome,
+                    quantidade=estoque.quantidade,
+                    minimo=estoque.minimo_efetivo,
+                )
+            )
+        if not alertas.notificar(enviados):
+            cls.objects.filter(pk__in=marcados).update(alertado=False)
+            return []
+        return enviados
+
+    def save(self, *args, **kwargs):
+        update_fields = kwargs.get('update_fields')
+        altera_estoque = update_fields is None or 'quantidade' in update_fields
+        if update_fields is not None and {'quantidade', 'estoque_minimo'} & set(update_fields):
+            kwargs['update_fields'] = {*update_fields, 'minimo_efetivo', 'abaixo_do_minimo', 'alertado'}
+        self.minimo_efetivo = self.material.minimo_efetivo if self.estoque_minimo is None else self.estoque_minimo
+        self.abaixo_do_minimo = self.quantidade < self.minimo_efetivo
+        if not self.abaixo_do_minimo:
+            self.alertado = False
+        with transaction.atomic():
+            anterior = 0
+            if altera_estoque and not self._state.adding:
+                anterior = (
+                    EstoqueAlmoxarifado.objects.filter(pk=self.pk)
+                    .values_list('quantidade', flat=True)
+                    .first()
+                ) or 0
+            super().save(*args, **kwargs)
+            Material.invalidar_mapa_estoques()
+            if self.abaixo_do_minimo and not self.alertado:
+                EstoqueAlmoxarifado.agendar_alertas([self.material_id])
+            # Alteracoes diretas do saldo (cadastro, admin) viram ajustes no
+            # livro de lancamentos para que o historico continue fechando.
+            if altera_estoque and self.quantidade != anterior:
+                LancamentoEstoque.objects.create(
+                    material_id=self.material_id,
+                    almoxarifado_id=self.almoxarifado_id,
+                    origem=LancamentoEstoque.Origem.AJUSTE,
+                    delta=self.quantidade - anterior,
+                )
+
+    def delete(self, *args, **kwargs):
+        Material.invalidar_mapa_estoques()
+        return super().delete(*args, **kwargs)
+
+    @classmethod
+    def somar(cls, material_id: int, almoxarifado_id: int, delta: int) -> None:
+        """Soma ``delta`` ao saldo sem ler a linha antes (e sem gerar ajuste no livro).
+
+        Retiradas usam um UPDATE condicional e falham com ``ValidationError``
+        se o saldo ficaria negativo; entradas criam a linha que faltar.
+        """
+        linhas = cls.objects.filter(material_id=material_id, almoxarifado_id=almoxarifado_id)
+        # No UPDATE as colunas ainda tem o valor anterior: o novo saldo fica
+        # abaixo do minimo se ``quantidade + delta < minimo_efetivo``.
+        campos = {
+            'quantidade': F('quantidade') + delta,
+            **cls._classificacao(Q(quantidade__lt=F('minimo_efetivo') - delta)),
+        }
+        if delta < 0:
+            if not linhas.filter(quantidade__gte=-delta).update(**campos):
+                raise ValidationError("Estoque insuficiente para retirada.")
+            return
+        if linhas.update(**campos):
+            return
+        try:
+            with transaction.atomic():
+                cls.objects.bulk_create([cls.nova_linha(material_id, almoxarifado_id, delta)])
+        except IntegrityError:
+            # Outra transacao criou a linha ao mesmo tempo; basta somar nela.
+            linhas.update(**campos)
 
 
 class Acesso(models.Model):
@@ -79,10 +371,113 @@ class Acesso(models.Model):
 
     class Meta:
         ordering = ['-data_hora']
+        indexes = [
+            models.Index(fields=['data_hora', 'id'], name='acesso_data_hora_idx'),
+            models.Index(fields=['status', 'data_hora'], name='acesso_status_data_idx'),
+            models.Index(fields=['data_saida', 'id'], name='acesso_saida_idx'),
+        ]
+        constraints = [
+            models.UniqueConstraint(
+                fields=['funcionario'],
+                condition=models.Q(status='ABERTO'),
+                name='acesso_aberto_unico_por_funcionario',
+                violation_error_message='Este funcionário já tem um acesso em aberto.',
+            ),
+        ]
+
+    CHAVE_CACHE_ANOS = 'core:acesso:anos'
+    # Campos que compoem a chave do acesso no resumo mensal.
+    CAMPOS_RESUMO = frozenset({'data_hora', 'almoxarifado', 'funcionario', 'tipo'})
 
     def __str__(self) -> str:
         return f"{self.get_tipo_display()} - {self.funcionario.nome} ({self.data_hora:%d/%m/%Y %H:%M})"
 
+    def save(self, *args, **kwargs):
+        criando = self._state.adding
+        campos = kwargs.get('update_fields')
+        with transaction.atomic():
+            anterior = None
+            # ``encerrar`` grava so o status e acumula por conta propria; edicoes
+            # completas (admin) podem mover um acesso encerrado no resumo.
+            if not criando and (
+                campos is None or self.CAMPOS_RESUMO & {campo.removesuffix('_id') for campo in campos}
+            ):
+                anterior = Acesso.objects.select_for_update().filter(pk=self.pk).first()
+            super().save(*args, **kwargs)
+            self._mover_no_resumo(anterior)
+            versoes.marcar_acesso(self.data_hora, anterior and anterior.data_hora)
+        if criando:
+            limites = cache.get(self.CHAVE_CACHE_ANOS)
+            ano = timezone.localtime(self.data_hora).year
+            if limites and not limites[0] <= ano <= limites[1]:
+                # O novo ano aparece na selecao do relatorio de todos os meses.
+                self.limpar_cache_anos()
+
+    def delete(self, *args, **kwargs):
+        # As movimentacoes saem em cascata, sem passar por ``Movimentacao.delete``.
+        with transaction.atomic():
+            gravado = Acesso.objects.select_for_update().get(pk=self.pk)
+            if gravado.status == self.Status.FECHADO:
+                gravado.acumular_no_resumo(-1)
+            versoes.marcar_acesso(gravado.data_hora)
+            return super().delete(*args, **kwargs)
+
+    def _chave_resumo(self) -> tuple:
+        data = timezone.localtime(self.data_hora)
+        return (data.year, data.month, self.almoxarifado_id, self.funcionario_id, self.tipo)
+
+    def _mover_no_resumo(self, anterior) -> None:
+        """Tira o acesso da chave antiga do resumo e o poe na nova quando uma edicao as troca."""
+        if anterior is None:
+            return
+        contava = anterior.status == self.Status.FECHADO
+        conta = self.status == self.Status.FECHADO
+        if contava and conta and anterior._chave_resumo() == self._chave_resumo():
+            return
+        if contava:
+            anterior.acumular_no_resumo(-1)
+        if conta:
+            self.acumular_no_resumo()
+
+    def acumular_no_resumo(self, sinal: int = 1) -> None:
+        """Soma ao resumo mensal (ou subtrai, com ``sinal=-1``) as movimentacoes gravadas do acesso."""
+        totais = (
+            self.movimentacao_set.order_by()
+            .values('material_id', 'tipo')
+            .annotate(quantidade=Sum('quantidade'), total=Count('id'))
+        )
+        for linha in totais:
+            ResumoMensal.acumular(
+                self,
+                linha['material_id'],
+                linha['tipo'],
+                sinal * linha['quantidade'],
+                movimentacoes=sinal * linha['total'],
+            )
+
+    @classmethod
+    def anos_disponiveis(cls) -> list[int]:
+        """Anos entre o primeiro e o ultimo acesso registrados.
+
+        Os limites vem de ``MIN``/``MAX`` sobre ``data_hora`` (resolvidos pelo
+        indice) e ficam em cache; um acesso criado fora do intervalo invalida a
+        chave. Cargas com ``bulk_create`` devem chamar ``limpar_cache_anos``, que
+        tambem invalida os marcadores de ``versoes``.
+        """
+        limites = cache.get(cls.CHAVE_CACHE_ANOS)
+        if limites is None:
+            datas = cls.objects.aggregate(primeiro=Min('data_hora'), ultimo=Max('data_hora'))
+            if datas['primeiro'] is None:
+                return []
+            limites = (timezone.localtime(datas['primeiro']).year, timezone.localtime(datas['ultimo']).year)
+            cache.set(cls.CHAVE_CACHE_ANOS, limites, 60 * 60)
+        return list(range(limites[0], limites[1] + 1))
+
+    @classmethod
+    def limpar_cache_anos(cls):
+        cache.delete(cls.CHAVE_CACHE_ANOS)
+        versoes.marcar_tudo()
+
     def encerrar(self, *, quando=None, usuario=None):
         if self.status == self.Status.FECHADO:
             raise ValidationError('Acesso ja encerrado.')
@@ -93,7 +488,9 @@ class Acesso(models.Model):
         self.ativo = False
         if usuario and not self.encerrado_por:
             self.encerrado_por = usuario
-        self.save(update_fields=['status', 'data_saida', 'ativo', 'encerrado_por'])
+        with transaction.atomic():
+            self.save(update_fields=['status', 'data_saida', 'ativo', 'encerrado_por'])
+            self.acumular_no_resumo()
 
 
 class Movimentacao(models.Model):
@@ -108,45 +505,372 @@ class Movimentacao(models.Model):
 
     class Meta:
         ordering = ['-acesso__data_hora']
+        indexes = [
+            models.Index(fields=['acesso', 'tipo'], name='movimentacao_acesso_tipo_idx'),
+            models.Index(fields=['material', 'tipo'], name='movimentacao_material_tipo_idx'),
+        ]
 
     def __str__(self) -> str:
         return f"{self.material.nome} - {self.get_tipo_display()} ({self.quantidade})"
 
-    def _atualizar_estoque(self, material: Material, quantidade: int, tipo: str, *, reverter: bool = False) -> None:
-        delta = quantidade if tipo == self.Tipo.DEVOLUCAO else -quantidade
-        if reverter:
-            delta = -delta
-        novo_estoque = material.quantidade_estoque + delta
-        if novo_estoque < 0:
-            raise ValidationError("Estoque insuficiente para a operacao.")
-        material.quantidade_estoque = novo_estoque
-        material.save(update_fields=['quantidade_estoque'])
+    @property
+    def delta_estoque(self) -> int:
+        return self.quantidade if self.tipo == self.Tipo.DEVOLUCAO else -self.quantidade
 
     def save(self, *args, **kwargs):
+        criando = self._state.adding
+        try:
+            with transaction.atomic():
+                movimentacao_antiga = None
+                if self.pk and not criando:
+                    movimentacao_antiga = (
+                        Movimentacao.objects.select_for_update()
+                        .select_related('acesso')
+                        .get(pk=self.pk)
+                    )
+                resultado = super().save(*args, **kwargs)
+
+                lancamentos = self._lancamentos(movimentacao_antiga)
+                LancamentoEstoque.objects.bulk_create(lancamentos)
+                self._atualizar_resumo(movimentacao_antiga)
+                versoes.marcar_acesso(
+                    self.acesso.data_hora, movimentacao_antiga and movimentacao_antiga.acesso.data_hora
+                )
+                # O saldo da unidade e atualizado por ultimo: o bloqueio da
+                # linha dura apenas ate o commit, logo em seguida.
+                LancamentoEstoque.aplicar_no_contador(lancamentos)
+                return resultado
+        except Exception:
+            if criando:
+                self.pk = None
+                self._state.adding = True
+            raise
+
+    def _lancamentos(self, movimentacao_antiga) -> list:
+        """Lancamentos do livro para gravar esta movimentacao sobre ``movimentacao_antiga``.
+
+        Uma edicao na mesma unidade e material grava so a diferenca, e nada
+        quando o saldo nao muda; trocar de unidade ou material estorna o
+        lancamento antigo e grava o novo.
+        """
+        unidade = (self.material_id, self.acesso.almoxarifado_id)
+        delta = self.delta_estoque
+        lancamentos = []
+        if movimentacao_antiga:
+            if (movimentacao_antiga.material_id, movimentacao_antiga.acesso.almoxarifado_id) == unidade:
+                delta -= movimentacao_antiga.delta_estoque
+            else:
+                lancamentos.append(
+                    LancamentoEstoque(
+                        material_id=movimentacao_antiga.material_id,
+                        almoxarifado_id=movimentacao_antiga.acesso.almoxarifado_id,
+                        movimentacao=self,
+                        origem=LancamentoEstoque.Origem.ESTORNO,
+                        delta=-movimentacao_antiga.delta_estoque,
+                    )
+                )
+        if delta or not movimentacao_antiga:
+            lancamentos.append(
+                LancamentoEstoque(
+                    material_id=unidade[0],
+                    almoxarifado_id=unidade[1],
+                    movimentacao=self,
+                    origem=LancamentoEstoque.Origem.MOVIMENTACAO,
+                    delta=delta,
+                )
+            )
+        return lancamentos
+
+    def delete(self, *args, **kwargs):
         with transaction.atomic():
-            material = None
-            if self.pk:
-                movimentacao_antiga = (
-                    Movimentacao.objects.select_for_update()
-                    .select_related('material')
-                    .get(pk=self.pk)
+            gravada = Movimentacao.objects.select_for_update().select_related('acesso').get(pk=self.pk)
+            if gravada.acesso.status == Acesso.Status.FECHADO:
+                ResumoMensal.acumular(
+                    gravada.acesso, gravada.material_id, gravada.tipo, -gravada.quantidade, movimentacoes=-1
                 )
-                material_antigo = movimentacao_antiga.material
-                self._atualizar_estoque(
-                    material_antigo,
-                    movimentacao_antiga.quantidade,
-                    movimentacao_antiga.tipo,
-                    reverter=True,
+            versoes.marcar_acesso(gravada.acesso.data_hora)
+            return super().delete(*args, **kwargs)
+
+    def _atualizar_resumo(self, movimentacao_antiga) -> None:
+        # O resumo mensal so contabiliza acessos encerrados; movimentacoes em
+        # acessos abertos entram no resumo quando o acesso e encerrado.
+        if movimentacao_antiga and movimentacao_antiga.acesso.status == Acesso.Status.FECHADO:
+            ResumoMensal.acumular(
+                movimentacao_antiga.acesso,
+                movimentacao_antiga.material_id,
+                movimentacao_antiga.tipo,
+                -movimentacao_antiga.quantidade,
+                movimentacoes=-1,
+            )
+        if self.acesso.status == Acesso.Status.FECHADO:
+            ResumoMensal.acumular(self.acesso, self.material_id, self.tipo, self.quantidade)
+
+
+class ResumoMensal(models.Model):
+    """Totais mensais pre-calculados de movimentacoes de acessos encerrados."""
+
+    ano = models.PositiveSmallIntegerField()
+    mes = models.PositiveSmallIntegerField()
+    almoxarifado = models.ForeignKey(Almoxarifado, on_delete=models.CASCADE)
+    funcionario = models.ForeignKey(Funcionario, on_delete=models.CASCADE)
+    material = models.ForeignKey(Material, on_delete=models.CASCADE)
+    tipo_acesso = models.CharField(max_length=10, choices=Acesso.Tipo.choices)
+    tipo = models.CharField(max_length=10, choices=Movimentacao.Tipo.choices)
+    total_movimentacoes = models.IntegerField(default=0)
+    quantidade = models.IntegerField(default=0)
+
+    class Meta:
+        constraints = [
+            models.UniqueConstraint(
+                fields=['ano', 'mes', 'almoxarifado', 'funcionario', 'material', 'tipo_acesso', 'tipo'],
+                name='resumo_mensal_unico',
+            ),
+        ]
+
+    def __str__(self) -> str:
+        return f"{self.mes:02d}/{self.ano} - {self.get_tipo_display()} ({self.quantidade})"
+
+    @classmethod
+    def acumular(cls, acesso: Acesso, material_id: int, tipo: str, quantidade: int, *, movimentacoes: int = 1) -> None:
+        data = timezone.localtime(acesso.data_hora)
+        chave = {
+            'ano': data.year,
+            'mes': data.month,
+            'almoxarifado_id': acesso.almoxarifado_id,
+            'funcionario_id': acesso.funcionario_id,
+            'material_id': material_id,
+            'tipo_acesso': acesso.tipo,
+            'tipo': tipo,
+        }
+        linhas = cls.objects.filter(**chave)
+        atualizadas = linhas.update(
+            quantidade=F('quantidade') + quantidade,
+            total_movimentacoes=F('total_movimentacoes') + movimentacoes,
+        )
+        if not atualizadas:
+            try:
+                with transaction.atomic():
+                    cls.objects.create(**chave, quantidade=quantidade, total_movimentacoes=movimentacoes)
+            except IntegrityError:
+                # Outra transacao criou a linha ao mesmo tempo; basta somar nela.
+                linhas.update(
+                    quantidade=F('quantidade') + quantidade,
+                    total_movimentacoes=F('total_movimentacoes') + movimentacoes,
                 )
-                if movimentacao_antiga.material_id == self.material_id:
-                    material = material_antigo
+        if movimentacoes < 0:
+            linhas.filter(total_movimentacoes__lte=0).delete()
 
-            if material is None:
-                material = Material.objects.select_for_update().get(pk=self.material_id)
 
-            if self.tipo == self.Tipo.RETIRADA and material.quantidade_estoque < self.quantidade:
-                raise ValidationError("Estoque insuficiente para retirada.")
+class LancamentoEstoque(models.Model):
+    """Livro de estoque: cada alteracao de saldo grava um delta, nunca editado.
+
+    Edicoes de movimentacao gravam a diferenca (ver ``Movimentacao._lancamentos``).
+    """
+
+    class Origem(models.TextChoices):
+        MOVIMENTACAO = 'MOVIMENTACAO', 'Movimentacao'
+        ESTORNO = 'ESTORNO', 'Estorno de movimentacao'
+        AJUSTE = 'AJUSTE', 'Ajuste de saldo'
+        CONCILIACAO = 'CONCILIACAO', 'Correcao da conciliacao'
+
+    material = models.ForeignKey(Material, on_delete=models.CASCADE, related_name='lancamentos')
+    almoxarifado = models.ForeignKey(Almoxarifado, null=True, blank=True, on_delete=models.SET_NULL)
+    movimentacao = models.ForeignKey(Movimentacao, null=True, blank=True, on_delete=models.SET_NULL)
+    origem = models.CharField(max_length=20, choices=Origem.choices)
+    delta = models.IntegerField()
+    criado_em = models.DateTimeField(default=timezone.now)
+
+    class Meta:
+        indexes = [
+            models.Index(fields=['material', 'id'], name='lancamento_material_id_idx'),
+            # Lancamentos de uma unidade depois do snapshot dela (estoque em data por almoxarifado).
+            models.Index(fields=['material', 'almoxarifado', 'id'], name='lancamento_almox_id_idx'),
+        ]
+
+    def __str__(self) -> str:
+        return f"{self.get_origem_display()} {self.delta:+d} (material {self.material_id})"
+
+    @staticmethod
+    def aplicar_no_contador(lancamentos) -> None:
+        """Soma os deltas no ``EstoqueAlmoxarifado`` de cada material e unidade.
+
+        Se uma retirada deixaria algum saldo negativo a transacao inteira e
+        desfeita. Cada ``UPDATE`` trava a linha do saldo ate o commit: ela
+        continua sendo o ponto de serializacao entre retiradas do mesmo
+        material na mesma unidade. As linhas sao atualizadas em ordem de
+        (material, almoxarifado) para evitar deadlocks entre lotes.
+        """
+        por_estoque = {}
+        for lancamento in lancamentos:
+            chave = (lancamento.material_id, lancamento.almoxarifado_id)
+            por_estoque[chave] = por_estoque.get(chave, 0) + lancamento.delta
+        for material_id, almoxarifado_id in sorted(por_estoque):
+            delta = por_estoque[material_id, almoxarifado_id]
+            if delta:
+                EstoqueAlmoxarifado.somar(material_id, almoxarifado_id, delta)
+        if any(por_estoque.values()):
+            Material.invalidar_mapa_estoques()
+        # So retiradas podem levar um saldo para baixo do minimo.
+        retirados = {material_id for (material_id, _), delta in por_estoque.items() if delta < 0}
+        if retirados:
+            EstoqueAlmoxarifado.agendar_alertas(retirados)
+
+
+class SnapshotEstoque(models.Model):
+    """Saldo consolidado de um material ate um lancamento do livro.
+
+    Sem ``almoxarifado`` o saldo e o total do material; com ele, o da unidade.
+    """
+
+    material = models.ForeignKey(Material, on_delete=models.CASCADE, related_name='snapshots')
+    almoxarifado = models.ForeignKey(Almoxarifado, null=True, blank=True, on_delete=models.CASCADE)
+    saldo = models.IntegerField()
+    ate_lancamento = models.BigIntegerField()
+    data_referencia = models.DateTimeField()
+    criado_em = models.DateTimeField(auto_now_add=True)
+
+    class Meta:
+        indexes = [
+            models.Index(fields=['material', 'almoxarifado', '-ate_lancamento'], name='snapshot_material_almox_idx'),
+        ]
+
+    def __str__(self) -> str:
+        unidade = f" em {self.almoxarifado_id}" if self.almoxarifado_id else ''
+        return f"{self.material_id}{unidade}: {self.saldo} ate #{self.ate_lancamento}"
+
+
+class AmostraRequisicao(models.Model):
+    """Medicao de uma requisicao amostrada pelo ``InstrumentacaoMiddleware``."""
+
+    view = models.CharField(max_length=150)
+    metodo = models.CharField(max_length=10)
+    status = models.PositiveSmallIntegerField()
+    duracao_ms = models.FloatField()
+    consultas = models.PositiveIntegerField()
+    tempo_db_ms = models.FloatField()
+    tempo_template_ms = models.FloatField()
+    suspeita_n_mais_1 = models.BooleanField(default=False)
+    consulta_repetida = models.TextField(blank=True)
+    repeticoes = models.PositiveIntegerField(default=0)
+    criado_em = models.DateTimeField(default=timezone.now)
+
+    class Meta:
+        indexes = [
+            models.Index(fields=['view', 'criado_em'], name='amostra_view_data_idx'),
+            models.Index(fields=['criado_em'], name='amostra_data_idx'),
+        ]
+
+    def __str__(self) -> str:
+        return f"{self.metodo} {self.view}: {self.duracao_ms:.0f} ms, {self.consultas} consultas"
+
+
+class Tarefa(models.Model):
+    """Trabalho pesado (exportacao, recalculo) executado pelo ``manage.py worker``.
+
+    A fila e a propria tabela: o worker reserva a tarefa pendente mais antiga
+    com um ``UPDATE`` condicional no status, entao varios processos podem
+    consumir a fila sem broker externo e sem pegar a mesma tarefa.
+    """
+
+    class Tipo(models.TextChoices):
+        EXPORTAR_RELATORIO = 'exportar_relatorio', 'Exportar relatorio'
+        EXPORTAR_HISTORICO = 'exportar_historico', 'Exportar historico'
+        RECALCULAR_ESTOQUE = 'recalcular_estoque', 'Recalcular estoque'
+
+    class Status(models.TextChoices):
+        PENDENTE = 'PENDENTE', 'Pendente'
+        EXECUTANDO = 'EXECUTANDO', 'Executando'
+        CONCLUIDA = 'CONCLUIDA', 'Concluida'
+        FALHOU = 'FALHOU', 'Falhou'
+
+    MAX_TENTATIVAS = 3
+
+    tipo = models.CharField(max_length=30, choices=Tipo.choices)
+    parametros = models.JSONField(default=dict, blank=True)
+    status = models.CharField(max_length=10, choices=Status.choices, default=Status.PENDENTE)
+    progresso = models.PositiveSmallIntegerField(default=0)
+    mensagem = models.TextField(blank=True)
+    arquivo = models.FileField(upload_to='tarefas/%Y/%m/', blank=True)
+    criado_por = models.ForeignKey(
+        settings.AUTH_USER_MODEL, on_delete=models.SET_NULL, null=True, blank=True, related_name='tarefas'
+    )
+    worker = models.CharField(max_length=100, blank=True)
+    tentativas = models.PositiveSmallIntegerField(default=0)
+    criado_em = models.DateTimeField(default=timezone.now)
+    iniciado_em = models.DateTimeField(null=True, blank=True)
+    atualizado_em = models.DateTimeField(null=True, blank=True)
+    concluido_em = models.DateTimeField(null=True, blank=True)
+
+    class Meta:
+        ordering = ['-criado_em', '-id']
+        indexes = [
+            models.Index(fields=['status', 'id'], name='tarefa_fila_idx'),
+            models.Index(fields=['criado_por', 'criado_em'], name='tarefa_usuario_idx'),
+        ]
+
+    def __str__(self) -> str:
+        return f"{self.get_tipo_display()} #{self.pk} ({self.get_status_display()})"
+
+    @property
+    def finalizada(self) -> bool:
+        return self.status in (self.Status.CONCLUIDA, self.Status.FALHOU)
+
+    @classmethod
+    def enfileirar(cls, tipo: str, parametros=None, *, usuario=None) -> 'Tarefa':
+        return cls.objects.create(tipo=tipo, parametros=parametros or {}, criado_por=usuario)
+
+    @classmethod
+    def reservar(cls, worker: str) -> 'Tarefa | None':
+        """Reserva a tarefa pendente mais antiga para ``worker``; ``None`` se a fila estiver vazia."""
+        while True:
+            candidata = (
+                cls.objects.filter(status=cls.Status.PENDENTE).order_by('id').values_list('id', flat=True).first()
+            )
+            if candidata is None:
+                return None
+            agora = timezone.now()
+            reservada = cls.objects.filter(pk=candidata, status=cls.Status.PENDENTE).update(
+                status=cls.Status.EXECUTANDO,
+                worker=worker,
+                tentativas=F('tentativas') + 1,
+                iniciado_em=agora,
+                atualizado_em=agora,
+            )
+            # Outro worker levou a candidata entre a consulta e o UPDATE: tenta a proxima.
+            if reservada:
+                return cls.objects.get(pk=candidata)
+
+    @classmethod
+    def recuperar_presas(cls, limite) -> int:
+        """Devolve a fila as tarefas sem progresso ha mais de ``limite`` (worker morto).
+
+        Depois de ``MAX_TENTATIVAS`` a tarefa e marcada como falha.
+        """
+        presas = cls.objects.filter(status=cls.Status.EXECUTANDO, atualizado_em__lt=timezone.now() - limite)
+        falhas = presas.filter(tentativas__gte=cls.MAX_TENTATIVAS).update(
+            status=cls.Status.FALHOU,
+            mensagem='Worker interrompido repetidas vezes.',
+            concluido_em=timezone.now(),
+        )
+        return falhas + presas.update(status=cls.Status.PENDENTE, worker='')
+
+    def atualizar_progresso(self, progresso: int, mensagem: str | None = None) -> None:
+        self.progresso = max(0, min(int(progresso), 100))
+        self.atualizado_em = timezone.now()
+        campos = {'progresso': self.progresso, 'atualizado_em': self.atualizado_em}
+        if mensagem is not None:
+            self.mensagem = campos['mensagem'] = mensagem
+        Tarefa.objects.filter(pk=self.pk).update(**campos)
+
+    def concluir(self, mensagem: str = '') -> None:
+        self.status = self.Status.CONCLUIDA
+        self.progresso = 100
+        self.mensagem = mensagem
+        self.concluido_em = self.atualizado_em = timezone.now()
+        self.save(update_fields=['status', 'progresso', 'mensagem', 'arquivo', 'concluido_em', 'atualizado_em'])
 
-            resultado = super().save(*args, **kwargs)
-            self._atualizar_estoque(material, self.quantidade, self.tipo)
-            return resultado
+    def falhar(self, mensagem: str) -> None:
+        self.status = self.Status.FALHOU
+        self.mensagem = mensagem
+        self.concluido_em = self.atualizado_em = timezone.now()
+        self.save(update_fields=['status', 'mensagem', 'concluido_em', 'atualizado_em'])
@@ -0,0 +1,177 @@
+"""Paginacao por chave (keyset) para listagens grandes e paginador do admin
+com contagem estimada."""
+
+import base64
+import json
+import math
+from dataclasses import dataclass
+from datetime import datetime
+
+from django.core.paginator import Paginator
+from django.db import connection
+from django.db.models import DateField, F, Max, Q
+from django.utils.functional import cached_property
+
+# Acima disso o admin nao conta as linhas exatamente.
+LIMITE_CONTAGEM = 10000
+# Maior inteiro que cabe numa coluna INTEGER/bigint.
+MAIOR_PK = 2**63 - 1
+
+
+@dataclass
+class PaginaCursor:
+    itens: list
+    cursor_proximo: str | None = None
+    cursor_anterior: str | None = None
+    por_pagina: int = 50
+
+    @property
+    def has_next(self) -> bool:
+        return self.cursor_proximo is not None
+
+    @property
+    def has_previous(self) -> bool:
+        return self.cursor_anterior is not None
+
+    def __iter__(self):
+        return iter(self.itens)
+
+    def __len__(self) -> int:
+        return len(self.itens)
+
+    def __bool__(self) -> bool:
+        return bool(self.itens)
+
+
+def codificar_cursor(valor, pk) -> str:
+    if isinstance(valor, datetime):
+        valor = valor.isoformat()
+    bruto = json.dumps([valor, pk], separators=(',', ':')).encode()
+    return base64.urlsafe_b64encode(bruto).decode().rstrip('=')
+
+
+def decodificar_cursor(cursor: str | None, *, data: bool = True):
+    """Retorna ``(valor, pk)`` ou ``None`` quando o cursor e ausente ou invalido.
+
+    O cursor vem da URL: o valor precisa ser uma data ISO quando ``data`` e
+    verdadeiro (chave de data) ou um numero finito quando nao e, e o pk um
+    inteiro de 64 bits; qualquer outra coisa (lista, objeto, ``null``) e
+    tratada como cursor invalido.
+    """
+    if not cursor:
+        return None
+    try:
+        bruto = base64.urlsafe_b64decode(cursor + '=' * (-len(cursor) % 4))
+        valor, pk = json.loads(bruto)
+    except (ValueError, TypeError):
+        return None
+    if not isinstance(pk, int) or isinstance(pk, bool) or not -MAIOR_PK <= pk <= MAIOR_PK:
+        return None
+    if data:
+        if not isinstance(valor, str):
+            return None
+        try:
+            return datetime.fromisoformat(valor), pk
+        except ValueError:
+            return None
+    if isinstance(valor, (int, float)) and not isinstance(valor, bool) and math.isfinite(valor):
+        return valor, pk
+    return None
+
+
+def _consulta_pagina(queryset, campo, depois, antes, por_pagina, descendente):
+    """Monta a consulta da pagina; devolve ``(queryset, voltando, veio_de_cursor_depois)``."""
+    queryset = queryset.annotate(chave_cursor=F(campo))
+    ordem = ('-chave_cursor', '-id') if descendente else ('chave_cursor', 'id')
+    inversa = tuple(c.lstrip('-') if c.startswith('-') else f'-{c}' for c in ordem)
+
+    data = isinstance(queryset.query.annotations['chave_cursor'].output_field, DateField)
+    posicao_depois = decodificar_cursor(depois, data=data)
+    posicao_antes = None if posicao_depois else decodificar_cursor(antes, data=data)
+    voltando = posicao_antes is not None
+
+    if posicao_depois or posicao_antes:
+        valor, pk = posicao_depois or posicao_antes
+        avancar = 'lt' if descendente else 'gt'
+        recuar = 'gt' if descendente else 'lt'
+        lookup = recuar if voltando else avancar
+        queryset = queryset.filter(
+            Q(**{f'chave_cursor__{lookup}': valor}) | Q(chave_cursor=valor, **{f'id__{lookup}': pk})
+        )
+
+    queryset = queryset.order_by(*(inversa if voltando else ordem))
+    return queryset[: por_pagina + 1], voltando, posicao_depois is not None
+
+
+def _montar_pagina(itens, por_pagina, voltando, veio_de_cursor_depois) -> PaginaCursor:
+    tem_mais = len(itens) > por_pagina
+    itens = itens[:por_pagina]
+    if voltando:
+        itens.reverse()
+
+    pagina = PaginaCursor(itens=itens, por_pagina=por_pagina)
+    if not itens:
+        return pagina
+    primeiro, ultimo = itens[0], itens[-1]
+    if voltando:
+        tem_proxima, tem_anterior = True, tem_mais
+    else:
+        tem_proxima, tem_anterior = tem_mais, veio_de_cursor_depois
+    if tem_proxima:
+        pagina.cursor_proximo = codificar_cursor(ultimo.chave_cursor, ultimo.pk)
+    if tem_anterior:
+        pagina.cursor_anterior = codificar_cursor(primeiro.chave_cursor, primeiro.pk)
+    return pagina
+
+
+def paginar_por_chave(queryset, campo: str, *, depois=None, antes=None, por_pagina: int = 50, descendente: bool = True) -> PaginaCursor:
+    """Pagina ``queryset`` ordenando por ``(campo, id)``.
+
+    ``depois`` e ``antes`` sao cursores gerados por paginas anteriores; cada
+    pagina custa uma consulta com ``LIMIT``, independente de quantas linhas ja
+    ficaram para tras.
+    """
+    consulta, voltando, de_depois = _consulta_pagina(queryset, campo, depois, antes, por_pagina, descendente)
+    return _montar_pagina(list(consulta), por_pagina, voltando, de_depois)
+
+
+async def apaginar_por_chave(queryset, campo: str, *, depois=None, antes=None, por_pagina: int = 50, descendente: bool = True) -> PaginaCursor:
+    """Versao assincrona de ``paginar_por_chave``, para views ``async def``."""
+    consulta, voltando, de_depois = _consulta_pagina(queryset, campo, depois, antes, por_pagina, descendente)
+    itens = [item async for item in consulta.aiterator()]
+    return _montar_pagina(itens, por_pagina, voltando, de_depois)
+
+
+def estimar_linhas(modelo) -> int | None:
+    """Numero aproximado de linhas da tabela de ``modelo``, sem percorre-la.
+
+    No PostgreSQL vem das estatisticas (``reltuples``, atualizadas pelo
+    ANALYZE); no SQLite e o maior id, que so erra pelas linhas excluidas. Em
+    outros bancos, ou sem estatisticas, retorna ``None``.
+    """
+    if connection.vendor == 'postgresql':
+        with connection.cursor() as cursor:
+            cursor.execute('SELECT reltuples FROM pg_class WHERE oid = %s::regclass', [modelo._meta.db_table])
+            linha = cursor.fetchone()
+        return int(linha[0]) if linha and linha[0] >= 0 else None
+    if connection.vendor == 'sqlite':
+        return modelo._default_manager.aggregate(maior=Max('pk'))['maior'] or 0
+    return None
+
+
+class PaginadorEstimado(Paginator):
+    """Paginador do admin que nao faz ``COUNT(*)`` da tabela inteira.
+
+    Sem filtros usa ``estimar_linhas``; com filtros conta no maximo
+    ``LIMITE_CONTAGEM`` linhas, entao as ultimas paginas de um filtro muito
+    amplo so sao alcancadas refinando o filtro.
+    """
+
+    @cached_property
+    def count(self):
+        consulta = self.object_list
+        if not consulta.query.where:
+            estimativa = estimar_linhas(consulta.model)
+            if estimativa is not None and estimativa > LIMITE_CONTAGEM:
+                return estimativa
+        return consulta.order_by()[: LIMITE_CONTAGEM].count()
@@ -0,0 +1,197 @@
+"""Consultas do historico e do relatorio mensal, compartilhadas pelas telas,
+pelas exportacoes em streaming e pelas tarefas em segundo plano."""
+
+from dataclasses import dataclass
+from typing import Callable
+
+from django.db.models import QuerySet
+
+from .busca import buscar_acessos, filtrar_busca
+from .filtros import filtrar_intervalo, intervalo_ano, intervalo_dias, intervalo_mes, ler_data
+from .models import Acesso, Funcionario, Movimentacao
+
+EXPORTACAO_CHUNK = 2000
+
+
+@dataclass
+class Exportacao:
+    """Linhas de uma exportacao: ``consulta`` (``values_list``) convertida por ``converter``."""
+
+    nome_arquivo: str
+    cabecalho: list
+    consulta: QuerySet
+    converter: Callable[[tuple], tuple]
+
+    def linhas(self):
+        return (self.converter(linha) for linha in self.consulta.iterator(chunk_size=EXPORTACAO_CHUNK))
+
+
+def filtrar_historico(acessos_qs, params):
+    """Aplica os filtros da tela de historico e devolve ``(queryset, filtros)``."""
+    status = params.get('status')
+    funcionario = params.get('funcionario')
+    data_inicio = params.get('data_inicio')
+    data_fim = params.get('data_fim')
+    busca = (params.get('q') or '').strip()
+
+    if status in [Acesso.Status.ABERTO, Acesso.Status.FECHADO]:
+        acessos_qs = acessos_qs.filter(status=status)
+    if funcionario:
+        acessos_qs = filtrar_busca(acessos_qs, funcionario, modelo=Funcionario, caminho='funcionario')
+    if busca:
+        acessos_qs = buscar_acessos(acessos_qs, busca)
+
+    inicio, fim = intervalo_dias(ler_data(data_inicio), ler_data(data_fim))
+    acessos_qs = filtrar_intervalo(acessos_qs, 'data_hora', inicio, fim)
+
+    filtros = {
+        'status': status or '',
+        'funcionario': funcionario or '',
+        'data_inicio': data_inicio or '',
+        'data_fim': data_fim or '',
+        'q': busca,
+    }
+    return acessos_qs, filtros
+
+
+def movimentacoes_relatorio(mes, ano, almoxarifado=None, funcionario=None):
+    """Movimentacoes de acessos encerrados no mes (ou no ano inteiro, com ``mes=None``)."""
+    inicio, fim = intervalo_ano(ano) if mes is None else intervalo_mes(ano, mes)
+    movimentacoes = Movimentacao.objects.filter(
+        acesso__data_hora__gte=inicio,
+        acesso__data_hora__lt=fim,
+        acesso__status=Acesso.Status.FECHADO,
+    ).select_related('material', 'acesso', 'acesso__funcionario', 'acesso__almoxarifado')
+    if almoxarifado:
+        movimentacoes = movimentacoes.filter(acesso__almoxarifado=almoxarifado)
+    if funcionario:
+        movimentacoes = movimentacoes.filter(acesso__funcionario=funcionario)
+    return movimentacoes
+
+
+def exportacao_relatorio(mes, ano, almoxarifado=None, funcionario=None) -> Exportacao:
+    justificativas = dict(Acesso.Justificativa.choices)
+    tipos_acesso = dict(Acesso.Tipo.choices)
+    tipos = dict(Movimentacao.Tipo.choices)
+    consulta = (
+        movimentacoes_relatorio(mes, ano, almoxarifado, funcionario)
+        .order_by('acesso__data_hora', 'id')
+        .values_list(
+            'acesso__data_hora',
+            'acesso__funcionario__nome',
+            'acesso__almoxarifado__nome',
+            'material__nome',
+            'acesso__tipo',
+            'tipo',
+            'acesso__justificativa_padrao',
+            'acesso__observacao',
+            'quantidade',
+        )
+    )
+
+    def converter(linha):
+        (
+            data_hora,
+            nome_funcionario,
+            nome_almoxarifado,
+            material,
+            tipo_acesso,
+            tipo,
+            justificativa,
+            observacao,
+            quantidade,
+        ) = linha
+        return (
+            data_hora,
+            nome_funcionario,
+            nome_almoxarifado,
+            material,
+            tipos_acesso.get(tipo_acesso, tipo_acesso),
+            tipos.get(tipo, tipo),
+            justificativas.get(justificativa, justificativa),
+            observacao,
+            quantidade,
+        )
+
+    cabecalho = [
+        'Data',
+        'Funcionario',
+        'Almoxarifado',
+        'Material',
+        'Tipo de acesso',
+        'Tipo',
+        'Justificativa',
+        'Observacao',
+        'Quantidade',
+    ]
+    nome_arquivo = f'relatorio_{ano}' if mes is None else f'relatorio_{ano}_{mes:02d}'
+    return Exportacao(nome_arquivo, cabecalho, consulta, converter)
+
+
+def exportacao_historico(params) -> Exportacao:
+    acessos_qs, _ = filtrar_historico(Acesso.objects.all(), params)
+    justificativas = dict(Acesso.Justificativa.choices)
+    status_labels = dict(Acesso.Status.choices)
+    tipos = dict(Movimentacao.Tipo.choices)
+    # Uma linha por movimentacao; acessos sem movimentacao aparecem com as
+    # colunas de material vazias (LEFT JOIN).
+    consulta = acessos_qs.order_by('data_hora', 'id', 'movimentacao__id').values_list(
+        'id',
+        'data_hora',
+        'data_saida',
+        'status',
+        'funcionario__nome',
+        'autorizador__nome',
+        'almoxarifado__nome',
+        'justificativa_padrao',
+        'observacao',
+        'movimentacao__material__nome',
+        'movimentacao__tipo',
+        'movimentacao__quantidade',
+    )
+
+    def converter(linha):
+        (
+            acesso_id,
+            data_hora,
+            data_saida,
+            status,
+            nome_funcionario,
+            nome_autorizador,
+            nome_almoxarifado,
+            justificativa,
+            observacao,
+            material,
+            tipo,
+            quantidade,
+        ) = linha
+        return (
+            acesso_id,
+            data_hora,
+            data_saida,
+            status_labels.get(status, status),
+            nome_funcionario,
+            nome_autorizador,
+            nome_almoxarifado,
+            justificativas.get(justificativa, justificativa),
+            observacao,
+            material,
+            tipos.get(tipo, tipo),
+            quantidade,
+        )
+
+    cabecalho = [
+        'Acesso',
+        'Entrada',
+        'Saida',
+        'Status',
+        'Funcionario',
+        'Autorizador',
+        'Almoxarifado',
+        'Justificativa',
+        'Observacao',
+        'Material',
+        'Tipo',
+        'Quantidade',
+    ]
+    return Exportacao('historico_acessos', cabecalho, consulta, converter)
@@ -0,0 +1,68 @@
+"""Reconstrucao do resumo mensal de movimentacoes."""
+
+from django.db import transaction
+from django.db.models import Count, Sum
+from django.db.models.functions import ExtractMonth, ExtractYear
+
+from . import versoes
+from .filtros import filtrar_intervalo, intervalo_ano, intervalo_mes
+from .models import Acesso, Movimentacao, ResumoMensal
+
+
+def reconstruir_resumo_mensal(*, ano: int | None = None, mes: int | None = None, lote: int = 1000) -> int:
+    """Recalcula o resumo a partir das movimentacoes e retorna o numero de linhas gravadas."""
+    resumos = ResumoMensal.objects.all()
+    movimentacoes = Movimentacao.objects.filter(acesso__status=Acesso.Status.FECHADO).annotate(
+        ano=ExtractYear('acesso__data_hora'),
+        mes=ExtractMonth('acesso__data_hora'),
+    )
+    if ano is not None:
+        resumos = resumos.filter(ano=ano)
+        inicio, fim = intervalo_mes(ano, mes) if mes is not None else intervalo_ano(ano)
+        movimentacoes = filtrar_intervalo(movimentacoes, 'acesso__data_hora', inicio, fim)
+    if mes is not None:
+        resumos = resumos.filter(mes=mes)
+        if ano is None:
+            movimentacoes = movimentacoes.filter(mes=mes)
+
+    agrupado = (
+        movimentacoes.order_by()
+        .values(
+            'ano',
+            'mes',
+            'acesso__almoxarifado_id',
+            'acesso__funcionario_id',
+            'material_id',
+            'acesso__tipo',
+            'tipo',
+        )
+        .annotate(quantidade_total=Sum('quantidade'), total=Count('id'))
+    )
+
+    gravadas = 0
+    with transaction.atomic():
+        resumos.delete()
+        pendentes = []
+        for linha in agrupado.iterator(chunk_size=lote):
+            pendentes.append(
+                ResumoMensal(
+                    ano=linha['ano'],
+                    mes=linha['mes'],
+                    almoxarifado_id=linha['acesso__almoxarifado_id'],
+                    funcionario_id=linha['acesso__funcionario_id'],
+                    material_id=linha['material_id'],
+                    tipo_acesso=linha['acesso__tipo'],
+                    tipo=linha['tipo'],
+                    quantidade=linha['quantidade_total'],
+                    total_movimentacoes=linha['total'],
+                )
+            )
+            if len(pendentes) >= lote:
+                ResumoMensal.objects.bulk_create(pendentes)
+                gravadas += len(pendentes)
+                pendentes = []
+        if pendentes:
+            ResumoMensal.objects.bulk_create(pendentes)
+            gravadas += len(pendentes)
+        versoes.marcar_tudo()
+    return gravadas
@@ -0,0 +1,184 @@
+"""Execucao das tarefas em segundo plano (modelo ``Tarefa``).
+
+Cada tipo de tarefa tem um executor que recebe a tarefa ja reservada e uma
+funcao ``progresso(percentual, mensagem)``; quando gera arquivo, grava no
+campo ``arquivo``. ``processar_fila`` e o laco de um worker; o comando
+``manage.py worker`` roda um ou varios desses lacos em processos separados.
+"""
+
+import logging
+import os
+import socket
+import tempfile
+import threading
+import time
+
+from django.core.files import File
+from django.db import DatabaseError, connection, connections
+
+from .conciliacao import conciliar_estoque
+from .estoque import gerar_snapshots
+from .exportacao import FORMATOS, gerar_csv, gerar_xlsx
+from .models import Almoxarifado, Funcionario, Tarefa
+from .relatorios import exportacao_historico, exportacao_relatorio
+
+logger = logging.getLogger(__name__)
+
+# Segundos entre duas gravacoes do progresso (e batimento) de uma tarefa.
+INTERVALO_BATIMENTO = 5
+# Linhas entre duas atualizacoes do progresso de uma exportacao.
+PASSO_PROGRESSO = 1000
+
+
+class Batimento:
+    """Grava periodicamente o progresso da tarefa, numa thread com conexao propria.
+
+    O executor so atualiza o valor em memoria. Gravar pela conexao dele
+    falharia no SQLite em WAL: com a leitura de ``iterator()`` aberta, a
+    escrita na mesma conexao recebe "database is locked" assim que outro
+    processo grava no banco. A gravacao periodica tambem mantem
+    ``atualizado_em`` em dia nas fases longas, e ``recuperar_presas`` nao
+    confunde a tarefa com uma de worker morto.
+    """
+
+    def __init__(self, tarefa, intervalo=INTERVALO_BATIMENTO):
+        self.tarefa = tarefa
+        self.intervalo = intervalo
+        self.percentual = tarefa.progresso
+        self.mensagem = None
+        self._parar = threading.Event()
+        self._thread = threading.Thread(target=self._bater, name=f'batimento-{tarefa.pk}', daemon=True)
+
+    def __call__(self, percentual, mensagem=None):
+        self.percentual = percentual
+        if mensagem is not None:
+            self.mensagem = mensagem
+
+    def __enter__(self):
+        self._thread.start()
+        return self
+
+    def __exit__(self, *exc):
+        self._parar.set()
+        self._thread.join()
+
+    def _bater(self):
+        try:
+            while not self._parar.wait(self.intervalo):
+                try:
+                    self.tarefa.atualizar_progresso(self.percentual, self.mensagem)
+                except DatabaseError:
+                    logger.warning('Nao foi possivel gravar o progresso da tarefa %s', self.tarefa.pk, exc_info=True)
+        finally:
+            connection.close()
+
+
+def _gravar_exportacao(exportacao, formato, tarefa, progresso):
+    if formato not in FORMATOS:
+        raise ValueError(f'Formato de exportacao invalido: {formato}')
+    total = exportacao.consulta.count()
+
+    def linhas():
+        for numero, linha in enumerate(exportacao.linhas(), start=1):
+            if numero % PASSO_PROGRESSO == 0:
+                progresso(99 * numero // total, f'{numero} de {total} linhas')
+            yield linha
+
+    if formato == 'csv':
+        partes = (texto.encode('utf-8') for texto in gerar_csv(exportacao.cabecalho, linhas()))
+    else:
+        partes = gerar_xlsx(exportacao.cabecalho, linhas(), nome_planilha=exportacao.nome_arquivo)
+    with tempfile.TemporaryFile() as temporario:
+        for parte in partes:
+            temporario.write(parte)
+        temporario.seek(0)
+        tarefa.arquivo.save(f'{exportacao.nome_arquivo}.{formato}', File(temporario), save=False)
+    return f'{total} linhas exportadas.'
+
+
+def exportar_relatorio(tarefa, progresso):
+    parametros = tarefa.parametros
+    almoxarifado = parametros.get('almoxarifado')
+    funcionario = parametros.get('funcionario')
+    exportacao = exportacao_relatorio(
+        parametros.get('mes'),
+        parametros['ano'],
+        Almoxarifado.objects.get(pk=almoxarifado) if almoxarifado else None,
+        Funcionario.objects.get(pk=funcionario) if funcionario else None,
+    )
+    return _gravar_exportacao(exportacao, parametros['formato'], tarefa, progresso)
+
+
+def exportar_historico(tarefa, progresso):
+    parametros = tarefa.parametros
+    exportacao = exportacao_historico(parametros.get('filtros', {}))
+    return _gravar_exportacao(exportacao, parametros['formato'], tarefa, progresso)
+
+
+def recalcular_estoque_completo(tarefa, progresso):
+    """Alinha os saldos ao historico com o sistema em uso.
+
+    A correcao passa por ``conciliar_estoque``, que reconfere cada saldo
+    divergente com a linha bloqueada: movimentacoes gravadas durante a
+    tarefa nao se perdem. O resumo mensal e mantido a cada alteracao e nao e
+    reconstruido aqui (ver ``recalcular_resumo_mensal``).
+    """
+    progresso(0, 'Conciliando estoque com o historico...')
+    # Sem pool de processos: o worker ja tem a thread do batimento aberta.
+    resultado = conciliar_estoque(processos=1, corrigir=True)
+    progresso(75, 'Gerando snapshots...')
+    gerar_snapshots()
+    negativos = sum(1 for divergencia in resultado.divergencias if divergencia.negativo)
+    mensagem = f'{resultado.corrigidas} saldos corrigidos em {resultado.materiais} materiais.'
+    if negativos:
+        mensagem += f' {negativos} ficaram negativos pelo historico e foram zerados.'
+    return mensagem
+
+
+EXECUTORES = {
+    Tarefa.Tipo.EXPORTAR_RELATORIO: exportar_relatorio,
+    Tarefa.Tipo.EXPORTAR_HISTORICO: exportar_historico,
+    Tarefa.Tipo.RECALCULAR_ESTOQUE: recalcular_estoque_completo,
+}
+
+
+def executar(tarefa) -> None:
+    """Roda ``tarefa`` (ja reservada) e grava o resultado ou a falha."""
+    try:
+        with Batimento(tarefa) as progresso:
+            mensagem = EXECUTORES[tarefa.tipo](tarefa, progresso)
+    except Exception as exc:
+        logger.exception('Tarefa %s falhou', tarefa.pk)
+        tarefa.falhar(f'{type(exc).__name__}: {exc}')
+    else:
+        tarefa.concluir(mensagem or '')
+
+
+def nome_worker(indice: int = 0) -> str:
+    return f'{socket.gethostname()}:{os.getpid()}:{indice}'
+
+
+def processar_fila(*, worker=None, intervalo: float = 2.0, uma_vez: bool = False, parar=None) -> int:
+    """Consome a fila ate ``parar`` (um ``Event``) ser sinalizado.
+
+    Com ``uma_vez`` termina quando a fila esvazia. Retorna quantas tarefas
+    foram executadas.
+    """
+    worker = worker or nome_worker()
+    executadas = 0
+    while not (parar and parar.is_set()):
+        tarefa = Tarefa.reservar(worker)
+        if tarefa is None:
+            if uma_vez:
+                break
+            # Sem tarefa: libera a conexao enquanto espera.
+            connections.close_all()
+            if parar:
+                parar.wait(intervalo)
+            else:
+                time.sleep(intervalo)
+            continue
+        executar(tarefa)
+        executadas += 1
+    return executadas
+
@@ -1,25 +1,70 @@
+import base64
+import json
+import tempfile
+import zipfile
+from datetime import date, datetime, timedelta
+from io import BytesIO, StringIO
+from pathlib import Path
+from unittest.mock import patch
+
+from asgiref.sync import sync_to_async
 from django.contrib.auth.models import User
+from django.core.cache import cache
 from django.core.exceptions import ValidationError
+from django.core.management import call_command
+from django.core.management.base import CommandError
+from django.db import IntegrityError, connection, migrations
+from django.db.migrations.executor import MigrationExecutor
+from django.db.models import CharField, Index, Sum
 from django.urls import reverse
 from django.utils import timezone
-from django.test import TestCase
+from django.test import TestCase, TransactionTestCase, override_settings
+from django.test.utils import CaptureQueriesContext
 
+from . import versoes
+from .admin import DatasPorSaltosQuerySet
+from .alertas import Notificador
+from .checks import migracoes_preservam_busca
+from .conciliacao import conciliar_estoque
+from .desempenho import Medicao
 from .models import (
+    AmostraRequisicao,
     Acesso,
     Almoxarifado,
     Autorizador,
+    EstoqueAlmoxarifado,
     Funcionario,
+    LancamentoEstoque,
     Material,
     Movimentacao,
+    ResumoMensal,
+    SnapshotEstoque,
+    Tarefa,
+)
+from .estoque import (
+    anotar_saldo_livro,
+    gerar_snapshots,
+    registrar_movimentacoes_em_lote,
+    saldo_material,
+    saldos_em,
 )
+from .eventos import CursorEventos, _Fluxo, cursor_atual, ler_eventos, painel
+from .filtros import filtrar_intervalo, intervalo_dias, intervalo_mes
+from .importacao import recalcular_estoque
+from .migrations import _busca
+from .paginacao import PaginadorEstimado, codificar_cursor, decodificar_cursor, paginar_por_chave
 
 
 class BaseSetupMixin:
     def setUp(self):
+        cache.clear()
         self.funcionario = Funcionario.objects.create(nome='Fulano')
         self.autorizador = Autorizador.objects.create(nome='Chefe')
         self.almoxarifado = Almoxarifado.objects.create(nome='Central', localizacao='Base')
-        self.material = Material.objects.create(nome='Cabo', quantidade_estoque=10)
+        self.material = Material.objects.create(nome='Cabo')
+        self.estoque = EstoqueAlmoxarifado.objects.create(
+            material=self.material, almoxarifado=self.almoxarifado, quantidade=10
+        )
         self.acesso = Acesso.objects.create(
             funcionario=self.funcionario,
             autorizador=self.autorizador,
@@ -37,8 +82,8 @@ class MovimentacaoEstoqueTest(BaseSetupMixin, TestCase):
                 quantidade=20,
                 tipo=Movimentacao.Tipo.RETIRADA,
             )
-        self.material.refresh_from_db()
-        self.assertEqual(self.material.quantidade_estoque, 10)
+        self.estoque.refresh_from_db()
+        self.assertEqual(self.estoque.quantidade, 10)
 
     def test_atualiza_estoque_e_rollback_em_edicao(self):
         mov = Movimentacao.objects.create(
@@ -47,21 +92,48 @@ class MovimentacaoEstoqueTest(BaseSetupMixin, TestCase):
             quantidade=3,
             tipo=Movimentacao.Tipo.RETIRADA,
         )
-        self.material.refresh_from_db()
-        self.assertEqual(self.material.quantidade_estoque, 7)
+        self.estoque.refresh_from_db()
+        self.assertEqual(self.estoque.quantidade, 7)
 
         mov.quantidade = 5
         mov.save()
-        self.material.refresh_from_db()
-        self.assertEqual(self.material.quantidade_estoque, 5)
+        self.estoque.refresh_from_db()
+        self.assertEqual(self.estoque.quantidade, 5)
 
         mov.quantidade = 12
         with self.assertRaises(ValidationError):
             mov.save()
         mov.refresh_from_db()
-        self.material.refresh_from_db()
+        self.estoque.refresh_from_db()
         self.assertEqual(mov.quantidade, 5)
-        self.assertEqual(self.material.quantidade_estoque, 5)
+        self.assertEqual(self.estoque.quantidade, 5)
+
+    def test_estoque_separado_por_almoxarifado(self):
+        norte = Almoxarifado.objects.create(nome='Norte', localizacao='Sorriso')
+        acesso_norte = Acesso.objects.create(
+            funcionario=Funcionario.objects.create(nome='Beltrano'),
+            autorizador=self.autorizador,
+            almoxarifado=norte,
+            tipo=Acesso.Tipo.ENTRADA,
+        )
+        with self.assertRaises(ValidationError):
+            Movimentacao.objects.create(
+                acesso=acesso_norte, material=self.material, quantidade=1, tipo=Movimentacao.Tipo.RETIRADA
+            )
+        Movimentacao.objects.create(
+            acesso=acesso_norte, material=self.material, quantidade=4, tipo=Movimentacao.Tipo.DEVOLUCAO
+        )
+        mov = Movimentacao.objects.create(
+            acesso=acesso_norte, material=self.material, quantidade=3, tipo=Movimentacao.Tipo.RETIRADA
+        )
+        estoques = dict(EstoqueAlmoxarifado.objects.values_list('almoxarifado_id', 'quantidade'))
+        self.assertEqual(estoques, {self.almoxarifado.id: 10, norte.id: 1})
+
+        # Trocar o acesso de unidade estorna em uma e retira da outra.
+        mov.acesso = self.acesso
+        mov.save()
+        estoques = dict(EstoqueAlmoxarifado.objects.values_list('almoxarifado_id', 'quantidade'))
+        self.assertEqual(estoques, {self.almoxarifado.id: 7, norte.id: 4})
 
 
 class EncerramentoAcessoTest(BaseSetupMixin, TestCase):
@@ -100,8 +172,9 @@ class RelatorioMensalTest(BaseSetupMixin, TestCase):
             tipo=Movimentacao.Tipo.RETIRADA,
         )
 
+        # Apenas um acesso aberto por funcionario: o fechado usa outro funcionario.
         acesso_fechado = Acesso.objects.create(
-            funcionario=self.funcionario,
+            funcionario=Funcionario.objects.create(nome='Beltrano'),
             autorizador=self.autorizador,
             almoxarifado=self.almoxarifado,
             tipo=Acesso.Tipo.ENTRADA,
@@ -123,3 +196,1642 @@ class RelatorioMensalTest(BaseSetupMixin, TestCase):
         self.assertEqual(totais['total_retiradas'], 4)
         self.assertEqual(totais['total_devolucoes'], 0)
         self.assertEqual(totais['saldo'], -4)
+
+
+class MapaEstoquesTest(BaseSetupMixin, TestCase):
+    def test_mapa_em_cache_ate_movimentacao(self):
+        versao, mapa = Material.mapa_estoques()
+        self.assertEqual(
+            mapa, {self.material.id: {'nome': 'Cabo', 'estoque': 10, 'estoques': {self.almoxarifado.id: 10}}}
+        )
+        with self.assertNumQueries(0):
+            Material.mapa_estoques()
+
+        with self.captureOnCommitCallbacks(execute=True):
+            Movimentacao.objects.create(
+                acesso=self.acesso, material=self.material, quantidade=3, tipo=Movimentacao.Tipo.RETIRADA
+            )
+        nova_versao, mapa = Material.mapa_estoques()
+        self.assertNotEqual(nova_versao, versao)
+        self.assertEqual(mapa[self.material.id]['estoque'], 7)
+
+    def test_endpoint_responde_204_sem_mudanca(self):
+        User.objects.create_user(username='tester', password='123')
+        self.client.login(username='tester', password='123')
+        url = reverse('core:api_estoques_materiais')
+        dados = self.client.get(url).json()
+        self.assertEqual(
+            dados['materiais'],
+            {str(self.material.id): {'nome': 'Cabo', 'estoque': 10, 'estoques': {str(self.almoxarifado.id): 10}}},
+        )
+        self.assertEqual(dados['almoxarifados'], {str(self.almoxarifado.id): 'Central'})
+        self.assertEqual(self.client.get(url, {'versao': dados['versao']}).status_code, 204)
+
+        with self.captureOnCommitCallbacks(execute=True):
+            self.material.nome = 'Cabo flexivel'
+            self.material.save()
+        self.assertEqual(self.client.get(url, {'versao': dados['versao']}).status_code, 200)
+
+
+class RespostaCondicionalTest(BaseSetupMixin, TestCase):
+    def setUp(self):
+        super().setUp()
+        User.objects.create_user(username='tester', password='123')
+        self.client.login(username='tester', password='123')
+
+    def test_historico_responde_304_ate_uma_movimentacao(self):
+        url = reverse('core:historico')
+        # A primeira resposta cria o cookie CSRF, que tambem compoe a ETag.
+        self.client.get(url)
+        response = self.client.get(url)
+        etag = response['ETag']
+        self.assertIn('private', response['Cache-Control'])
+        self.assertEqual(self.client.get(url, HTTP_IF_NONE_MATCH=etag).status_code, 304)
+        # Outra querystring e outra pagina.
+        self.assertEqual(self.client.get(url, {'status': 'ABERTO'}, HTTP_IF_NONE_MATCH=etag).status_code, 200)
+
+        with self.captureOnCommitCallbacks(execute=True):
+            Movimentacao.objects.create(
+                acesso=self.acesso, material=self.material, quantidade=1, tipo=Movimentacao.Tipo.RETIRADA
+            )
+        response = self.client.get(url, HTTP_IF_NONE_MATCH=etag)
+        self.assertEqual(response.status_code, 200)
+        self.assertNotEqual(response['ETag'], etag)
+
+    def test_mensagem_de_redirect_nao_vira_304(self):
+        url = reverse('core:historico')
+        self.client.get(url)
+        etag = self.client.get(url)['ETag']
+
+        # Encerrar por GET falha e redireciona ao historico com uma mensagem de
+        # erro; o navegador segue o redirect revalidando a pagina guardada.
+        response = self.client.get(reverse('core:encerrar_acesso', args=[self.acesso.id]))
+        self.assertRedirects(response, url, fetch_redirect_response=False)
+        response = self.client.get(url, HTTP_IF_NONE_MATCH=etag)
+        self.assertContains(response, 'Metodo invalido para encerrar acesso.')
+        self.assertNotIn('ETag', response)
+
+        # Exibida a mensagem, a pagina volta a ser revalidada.
+        self.assertEqual(self.client.get(url, HTTP_IF_NONE_MATCH=etag).status_code, 304)
+
+    def test_resumo_de_mes_encerrado_em_cache_ate_alteracao_no_mes(self):
+        passado = timezone.now() - timedelta(days=400)
+        Acesso.objects.filter(pk=self.acesso.pk).update(data_hora=passado)
+        self.acesso.refresh_from_db()
+        movimentacao = Movimentacao.objects.create(
+            acesso=self.acesso, material=self.material, quantidade=3, tipo=Movimentacao.Tipo.RETIRADA
+        )
+        self.acesso.encerrar()
+        acesso_atual = Acesso.objects.create(
+            funcionario=Funcionario.objects.create(nome='Beltrano'),
+            autorizador=self.autorizador,
+            almoxarifado=self.almoxarifado,
+            tipo=Acesso.Tipo.ENTRADA,
+        )
+        local = timezone.localtime(passado)
+        url = reverse('core:relatorio_mensal')
+        filtros = {'mes': str(local.month), 'ano': str(local.year)}
+        # Cria o cookie CSRF e guarda os anos disponiveis.
+        self.client.get(url)
+
+        with CaptureQueriesContext(connection) as primeira:
+            response = self.client.get(url, filtros)
+        self.assertContains(response, 'Cabo')
+        with CaptureQueriesContext(connection) as segunda:
+            response = self.client.get(url, filtros)
+        # Os dois agregados e o resumo por material vem do fragmento em cache.
+        self.assertEqual(len(primeira) - len(segunda), 3)
+        self.assertEqual(self.client.get(url, filtros, HTTP_IF_NONE_MATCH=response['ETag']).status_code, 304)
+
+        # Alterar o mes atual nao invalida o mes passado.
+        with self.captureOnCommitCallbacks(execute=True):
+            Movimentacao.objects.create(
+                acesso=acesso_atual, material=self.material, quantidade=1, tipo=Movimentacao.Tipo.RETIRADA
+            )
+        self.assertEqual(self.client.get(url, filtros, HTTP_IF_NONE_MATCH=response['ETag']).status_code, 304)
+
+        # O saldo cai abaixo do minimo: o aviso do NotificadorLog padrao.
+        with self.assertLogs('core.alertas', 'WARNING'), self.captureOnCommitCallbacks(execute=True):
+            movimentacao.quantidade = 5
+            movimentacao.save()
+        response = self.client.get(url, filtros, HTTP_IF_NONE_MATCH=response['ETag'])
+        self.assertEqual(response.status_code, 200)
+        self.assertEqual(response.context['totais']['total_retiradas'], 5)
+
+
+class AutocompleteTest(BaseSetupMixin, TestCase):
+    def setUp(self):
+        super().setUp()
+        User.objects.create_user(username='tester', password='123')
+        self.client.login(username='tester', password='123')
+
+    def _buscar(self, entidade, **params):
+        return self.client.get(reverse('core:api_autocomplete', args=[entidade]), params).json()
+
+    def test_busca_por_prefixo_sem_acento_e_segue_renomeacao(self):
+        eletrico = Material.objects.create(nome='Fio elétrico 2,5mm')
+        Material.objects.create(nome='Fita isolante')
+        resultados = self._buscar('materiais', q='fio eletr')['resultados']
+        self.assertEqual([item['id'] for item in resultados], [eletrico.id])
+
+        eletrico.nome = 'Cabo PP'
+        eletrico.save()
+        self.assertEqual(self._buscar('materiais', q='fio')['resultados'], [])
+        self.assertEqual(len(self._buscar('materiais', q='cab')['resultados']), 2)
+
+    def test_pagina_resultados_e_lista_so_acessos_abertos(self):
+        Funcionario.objects.bulk_create([Funcionario(nome=f'Fulano {i:02d}') for i in range(25)])
+        primeira = self._buscar('funcionarios', q='fulano')
+        self.assertEqual(len(primeira['resultados']), 20)
+        self.assertTrue(primeira['mais'])
+        segunda = self._buscar('funcionarios', q='fulano', pagina=2)
+        self.assertEqual(len(segunda['resultados']), 6)
+        self.assertFalse(segunda['mais'])
+
+        self.acesso.status = Acesso.Status.FECHADO
+        self.acesso.save()
+        self.assertEqual(self._buscar('acessos', q='fulano')['resultados'], [])
+        self.assertEqual(self.client.get(reverse('core:api_autocomplete', args=['usuarios'])).status_code, 404)
+
+    def test_formulario_renderiza_so_a_opcao_escolhida(self):
+        Material.objects.create(nome='Fita isolante')
+        response = self.client.get(reverse('core:registrar_movimentacao_por_acesso', args=[self.acesso.id]))
+        self.assertNotContains(response, 'Fita isolante')
+        self.assertContains(response, 'data-autocomplete-url')
+
+        response = self.client.post(
+            reverse('core:registrar_movimentacao_por_acesso', args=[self.acesso.id]),
+            {'acesso': self.acesso.id, 'material': self.material.id, 'quantidade': 50, 'tipo': 'retirada'},
+        )
+        self.assertContains(response, f'<option value="{self.material.id}" selected>')
+        self.assertNotContains(response, 'Fita isolante')
+
+
+class HistoricoTest(BaseSetupMixin, TestCase):
+    def setUp(self):
+        super().setUp()
+        self.user = User.objects.create_user(username='tester', password='123')
+        self.client.login(username='tester', password='123')
+        self.estoque.quantidade = 100
+        self.estoque.save()
+        Movimentacao.objects.create(
+            acesso=self.acesso, material=self.material, quantidade=4, tipo=Movimentacao.Tipo.RETIRADA
+        )
+        Movimentacao.objects.create(
+            acesso=self.acesso, material=self.material, quantidade=1, tipo=Movimentacao.Tipo.DEVOLUCAO
+        )
+
+    def _criar_fechados(self, quantidade):
+        for _ in range(quantidade):
+            acesso = Acesso.objects.create(
+                funcionario=self.funcionario,
+                autorizador=self.autorizador,
+                almoxarifado=self.almoxarifado,
+                tipo=Acesso.Tipo.ENTRADA,
+                status=Acesso.Status.FECHADO,
+            )
+            Movimentacao.objects.create(
+                acesso=acesso, material=self.material, quantidade=1, tipo=Movimentacao.Tipo.DEVOLUCAO
+            )
+
+    def test_pagina_por_cursor_com_totais(self):
+        self._criar_fechados(10)
+        response = self.client.get(reverse('core:historico'))
+        pagina = response.context['acessos']
+        self.assertEqual(len(pagina), 10)
+        self.assertTrue(pagina.has_next)
+
+        response = self.client.get(reverse('core:historico'), {'depois': pagina.cursor_proximo})
+        segunda = response.context['acessos']
+        self.assertEqual([acesso.id for acesso in segunda], [self.acesso.id])
+        self.assertFalse(segunda.has_next)
+        acesso = segunda.itens[0]
+        self.assertEqual((acesso.total_retiradas, acesso.total_devolucoes, acesso.saldo), (4, 1, -3))
+        self.assertEqual(
+            [(item['material'], item['saldo'], item['estoque_atual']) for item in acesso.saldos_material],
+            [(self.material, -3, 107)],
+        )
+
+    def test_consultas_nao_crescem_com_a_pagina(self):
+        with CaptureQueriesContext(connection) as uma:
+            self.client.get(reverse('core:historico'))
+        self._criar_fechados(9)
+        with CaptureQueriesContext(connection) as dez:
+            self.client.get(reverse('core:historico'))
+        self.assertEqual(len(uma), len(dez))
+        self.assertFalse(any('COUNT(' in consulta['sql'] for consulta in dez.captured_queries))
+
+
+class BuscaHistoricoTest(BaseSetupMixin, TestCase):
+    def setUp(self):
+        super().setUp()
+        User.objects.create_user(username='tester', password='123')
+        self.client.login(username='tester', password='123')
+        self.estoque.quantidade = 100
+        self.estoque.save()
+        Movimentacao.objects.create(
+            acesso=self.acesso, material=self.material, quantidade=1, tipo=Movimentacao.Tipo.RETIRADA
+        )
+        self.outro = Acesso.objects.create(
+            funcionario=Funcionario.objects.create(nome='Mangueira Silva'),
+            autorizador=self.autorizador,
+            almoxarifado=self.almoxarifado,
+            tipo=Acesso.Tipo.ENTRADA,
+            observacao='Conferência da mangueira',
+        )
+
+    def _ids(self, **params):
+        response = self.client.get(reverse('core:historico'), params)
+        return [acesso.id for acesso in response.context['acessos']]
+
+    def test_busca_materiais_e_observacao_sem_acento(self):
+        self.assertEqual(self._ids(q='cabo'), [self.acesso.id])
+        self.assertEqual(self._ids(q='conferencia'), [self.outro.id])
+        self.assertEqual(set(self._ids(q='chefe central')), {self.acesso.id, self.outro.id})
+        self.assertEqual(self._ids(q='inexistente'), [])
+
+    def test_resultados_ordenados_por_relevancia(self):
+        mangueira = Material.objects.create(nome='Mangueira 1/2')
+        EstoqueAlmoxarifado.objects.create(material=mangueira, almoxarifado=self.almoxarifado, quantidade=5)
+        Movimentacao.objects.create(
+            acesso=self.acesso,
+            material=mangueira,
+            quantidade=1,
+            tipo=Movimentacao.Tipo.RETIRADA,
+        )
+        # Nome do funcionario pesa mais que material e observacao.
+        self.assertEqual(self._ids(q='mangueira'), [self.outro.id, self.acesso.id])
+
+    def test_indice_acompanha_renomeacao_e_remocao(self):
+        self.material.nome = 'Cabo flexivel'
+        self.material.save()
+        self.assertEqual(self._ids(q='flexivel'), [self.acesso.id])
+        Movimentacao.objects.filter(acesso=self.acesso).delete()
+        self.assertEqual(self._ids(q='flexivel'), [])
+
+    def test_pagina_resultados_por_cursor(self):
+        for i in range(12):
+            Acesso.objects.create(
+                funcionario=self.funcionario,
+                autorizador=self.autorizador,
+                almoxarifado=self.almoxarifado,
+                tipo=Acesso.Tipo.ENTRADA,
+                status=Acesso.Status.FECHADO,
+                observacao=f'Inventario {i}',
+            )
+        primeira = self.client.get(reverse('core:historico'), {'q': 'inventario'}).context['acessos']
+        segunda = self.client.get(
+            reverse('core:historico'), {'q': 'inventario', 'depois': primeira.cursor_proximo}
+        ).context['acessos']
+        ids = [acesso.id for acesso in primeira] + [acesso.id for acesso in segunda]
+        self.assertEqual(len(ids), 12)
+        self.assertEqual(len(set(ids)), 12)
+        self.assertFalse(segunda.has_next)
+
+
+class ResumoMensalTest(BaseSetupMixin, TestCase):
+    def _resumo(self):
+        return {
+            (linha.material_id, linha.tipo): (linha.quantidade, linha.total_movimentacoes)
+            for linha in ResumoMensal.objects.all()
+        }
+
+    def test_encerramento_acumula_e_edicao_ajusta_resumo(self):
+        mov = Movimentacao.objects.create(
+            acesso=self.acesso,
+            material=self.material,
+            quantidade=3,
+            tipo=Movimentacao.Tipo.RETIRADA,
+        )
+        self.assertFalse(ResumoMensal.objects.exists())
+
+        self.acesso.encerrar()
+        self.assertEqual(self._resumo(), {(self.material.id, Movimentacao.Tipo.RETIRADA): (3, 1)})
+
+        mov.refresh_from_db()
+        mov.tipo = Movimentacao.Tipo.DEVOLUCAO
+        mov.save()
+        self.assertEqual(self._resumo(), {(self.material.id, Movimentacao.Tipo.DEVOLUCAO): (3, 1)})
+
+    def test_reconstrucao_confere_com_incremental(self):
+        Movimentacao.objects.create(
+            acesso=self.acesso,
+            material=self.material,
+            quantidade=2,
+            tipo=Movimentacao.Tipo.RETIRADA,
+        )
+        Movimentacao.objects.create(
+            acesso=self.acesso,
+            material=self.material,
+            quantidade=1,
+            tipo=Movimentacao.Tipo.DEVOLUCAO,
+        )
+        self.acesso.encerrar()
+        incremental = self._resumo()
+
+        call_command('recalcular_resumo_mensal', stdout=StringIO())
+        self.assertEqual(self._resumo(), incremental)
+
+    def _confere_com_reconstrucao(self):
+        incremental = set(
+            ResumoMensal.objects.values_list(
+                'ano', 'mes', 'almoxarifado', 'funcionario', 'material', 'tipo', 'quantidade', 'total_movimentacoes'
+            )
+        )
+        call_command('recalcular_resumo_mensal', stdout=StringIO())
+        self.assertEqual(
+            set(
+                ResumoMensal.objects.values_list(
+                    'ano', 'mes', 'almoxarifado', 'funcionario', 'material', 'tipo', 'quantidade', 'total_movimentacoes'
+                )
+            ),
+            incremental,
+        )
+
+    def test_exclusao_de_movimentacao_desconta_do_relatorio(self):
+        retirada = Movimentacao.objects.create(acesso=self.acesso, material=self.material, quantidade=2, tipo='retirada')
+        Movimentacao.objects.create(acesso=self.acesso, material=self.material, quantidade=3, tipo='retirada')
+        self.acesso.encerrar()
+        retirada.delete()
+        self.assertEqual(self._resumo(), {(self.material.id, Movimentacao.Tipo.RETIRADA): (3, 1)})
+
+        User.objects.create_user(username='tester', password='123')
+        self.client.login(username='tester', password='123')
+        agora = timezone.localtime()
+        response = self.client.get(reverse('core:relatorio_mensal'), {'mes': str(agora.month), 'ano': str(agora.year)})
+        # Total de movimentacoes e de retiradas do mes.
+        self.assertInHTML('<p class="text-2xl font-bold text-gray-900">1</p>', response.content.decode())
+        self.assertInHTML('<p class="text-2xl font-bold text-gray-900">3</p>', response.content.decode())
+        self._confere_com_reconstrucao()
+
+    def test_exclusao_e_edicao_de_acesso_encerrado(self):
+        Movimentacao.objects.create(acesso=self.acesso, material=self.material, quantidade=2, tipo='retirada')
+        self.acesso.encerrar()
+        outro = Almoxarifado.objects.create(nome='Norte', localizacao='Anexo')
+        self.acesso.almoxarifado = outro
+        self.acesso.save()
+        self.assertEqual(list(ResumoMensal.objects.values_list('almoxarifado', flat=True)), [outro.id])
+        self._confere_com_reconstrucao()
+
+        self.acesso.delete()
+        self.assertFalse(ResumoMensal.objects.exists())
+
+    def test_exclusao_em_lote_pelo_admin(self):
+        Movimentacao.objects.create(acesso=self.acesso, material=self.material, quantidade=2, tipo='retirada')
+        Movimentacao.objects.create(acesso=self.acesso, material=self.material, quantidade=1, tipo='devolucao')
+        self.acesso.encerrar()
+        User.objects.create_superuser(username='admin', password='123')
+        self.client.login(username='admin', password='123')
+        selecionadas = Movimentacao.objects.filter(tipo='retirada').values_list('pk', flat=True)
+        self.client.post(
+            reverse('admin:core_movimentacao_changelist'),
+            {'action': 'delete_selected', '_selected_action': list(selecionadas), 'post': 'yes'},
+        )
+        self.assertEqual(self._resumo(), {(self.material.id, Movimentacao.Tipo.DEVOLUCAO): (1, 1)})
+        self._confere_com_reconstrucao()
+
+
+class PaginacaoPorChaveTest(BaseSetupMixin, TestCase):
+    def setUp(self):
+        super().setUp()
+        self.estoque.quantidade = 100
+        self.estoque.save()
+        for quantidade in range(1, 8):
+            Movimentacao.objects.create(
+                acesso=self.acesso,
+                material=self.material,
+                quantidade=quantidade,
+                tipo=Movimentacao.Tipo.RETIRADA,
+            )
+        self.queryset = Movimentacao.objects.all()
+
+    def test_percorre_paginas_sem_repetir_e_volta(self):
+        vistos = []
+        pagina = paginar_por_chave(self.queryset, 'acesso__data_hora', por_pagina=3)
+        paginas = [pagina]
+        vistos.extend(mov.id for mov in pagina)
+        while pagina.has_next:
+            pagina = paginar_por_chave(
+                self.queryset, 'acesso__data_hora', depois=pagina.cursor_proximo, por_pagina=3
+            )
+            paginas.append(pagina)
+            vistos.extend(mov.id for mov in pagina)
+        self.assertEqual(vistos, sorted(self.queryset.values_list('id', flat=True), reverse=True))
+        self.assertEqual([len(p) for p in paginas], [3, 3, 1])
+
+        anterior = paginar_por_chave(
+            self.queryset, 'acesso__data_hora', antes=paginas[-1].cursor_anterior, por_pagina=3
+        )
+        self.assertEqual([mov.id for mov in anterior], [mov.id for mov in paginas[1]])
+        self.assertTrue(anterior.has_previous)
+
+    def test_cursor_invalido_volta_para_primeira_pagina(self):
+        pagina = paginar_por_chave(self.queryset, 'acesso__data_hora', depois='invalido', por_pagina=3)
+        self.assertFalse(pagina.has_previous)
+        self.assertEqual(len(pagina), 3)
+
+    def test_cursor_forjado_volta_para_primeira_pagina(self):
+        for bruto in ([[1], 1], [{'a': 1}, 1], [None, 1], [1, 1], ['2024-01-01', [1]], ['2024-01-01', 2**70]):
+            cursor = base64.urlsafe_b64encode(json.dumps(bruto).encode()).decode()
+            with self.subTest(bruto=bruto):
+                pagina = paginar_por_chave(self.queryset, 'acesso__data_hora', depois=cursor, por_pagina=3)
+                self.assertFalse(pagina.has_previous)
+                self.assertEqual(len(pagina), 3)
+        # Chave numerica (relevancia da busca): texto e valores nao finitos tambem sao invalidos.
+        for bruto in (['2024-01-01', 1], [True, 1], [1e999, 1]):
+            cursor = base64.urlsafe_b64encode(json.dumps(bruto).encode()).decode()
+            self.assertIsNone(decodificar_cursor(cursor, data=False))
+        self.assertEqual(decodificar_cursor(codificar_cursor(-3.5, 7), data=False), (-3.5, 7))
+
+
+class ExportacaoTest(BaseSetupMixin, TestCase):
+    def setUp(self):
+        super().setUp()
+        self.user = User.objects.create_user(username='tester', password='123')
+        self.client.login(username='tester', password='123')
+        Movimentacao.objects.create(
+            acesso=self.acesso,
+            material=self.material,
+            quantidade=4,
+            tipo=Movimentacao.Tipo.RETIRADA,
+        )
+        self.acesso.encerrar()
+
+    def test_exporta_relatorio_em_csv(self):
+        agora = timezone.now()
+        response = self.client.get(
+            reverse('core:exportar_relatorio', args=['csv']),
+            {'mes': str(agora.month), 'ano': str(agora.year)},
+        )
+        self.assertEqual(response.status_code, 200)
+        conteudo = b''.join(response.streaming_content).decode('utf-8-sig')
+        linhas = conteudo.strip().splitlines()
+        self.assertEqual(len(linhas), 2)
+        self.assertIn('Cabo;Entrada;Retirada', linhas[1])
+        self.assertTrue(linhas[1].endswith(';4'))
+
+    def test_exporta_historico_em_xlsx(self):
+        response = self.client.get(
+            reverse('core:exportar_historico', args=['xlsx']),
+            {'status': Acesso.Status.FECHADO},
+        )
+        self.assertEqual(response.status_code, 200)
+        arquivo = zipfile.ZipFile(BytesIO(b''.join(response.streaming_content)))
+        planilha = arquivo.read('xl/worksheets/sheet1.xml').decode()
+        self.assertEqual(planilha.count('<row>'), 2)
+        self.assertIn('Fulano', planilha)
+        self.assertIn('<v>4</v>', planilha)
+
+    async def test_exportacao_sob_asgi_e_um_iterador_async(self):
+        await self.async_client.aforce_login(self.user)
+        with patch('core.exportacao.PARTES_POR_LOTE', 1):
+            response = await self.async_client.get(reverse('core:exportar_historico', args=['csv']))
+            # Um iterador sincrono seria juntado em memoria pelo handler ASGI.
+            self.assertTrue(response.is_async)
+            conteudo = b''.join([parte async for parte in response.streaming_content]).decode('utf-8-sig')
+        self.assertEqual(len(conteudo.strip().splitlines()), 2)
+        self.assertIn('Fulano', conteudo)
+
+    def test_formato_invalido_retorna_404(self):
+        response = self.client.get(reverse('core:exportar_historico', args=['pdf']))
+        self.assertEqual(response.status_code, 404)
+
+
+class LivroEstoqueTest(BaseSetupMixin, TestCase):
+    def test_movimentacoes_e_edicoes_geram_lancamentos(self):
+        mov = Movimentacao.objects.create(
+            acesso=self.acesso,
+            material=self.material,
+            quantidade=3,
+            tipo=Movimentacao.Tipo.RETIRADA,
+        )
+        mov.quantidade = 5
+        mov.save()
+        # Salvar sem mudar o saldo nao grava lancamento.
+        mov.save()
+
+        deltas = list(
+            LancamentoEstoque.objects.filter(material=self.material)
+            .order_by('id')
+            .values_list('origem', 'delta')
+        )
+        self.assertEqual(
+            deltas,
+            [
+                (LancamentoEstoque.Origem.AJUSTE, 10),
+                (LancamentoEstoque.Origem.MOVIMENTACAO, -3),
+                (LancamentoEstoque.Origem.MOVIMENTACAO, -2),
+            ],
+        )
+        self.estoque.refresh_from_db()
+        self.assertEqual(saldo_material(self.material.id), self.estoque.quantidade)
+
+    def test_troca_de_material_estorna_o_antigo(self):
+        outro = Material.objects.create(nome='Fio')
+        EstoqueAlmoxarifado.objects.create(material=outro, almoxarifado=self.almoxarifado, quantidade=4)
+        mov = Movimentacao.objects.create(
+            acesso=self.acesso, material=self.material, quantidade=3, tipo=Movimentacao.Tipo.RETIRADA
+        )
+        mov.material = outro
+        mov.save()
+
+        self.assertEqual(
+            list(mov.lancamentoestoque_set.order_by('id').values_list('material', 'origem', 'delta')),
+            [
+                (self.material.id, LancamentoEstoque.Origem.MOVIMENTACAO, -3),
+                (self.material.id, LancamentoEstoque.Origem.ESTORNO, 3),
+                (outro.id, LancamentoEstoque.Origem.MOVIMENTACAO, -3),
+            ],
+        )
+        self.estoque.refresh_from_db()
+        self.assertEqual(self.estoque.quantidade, 10)
+        self.assertEqual(EstoqueAlmoxarifado.objects.get(material=outro).quantidade, 1)
+
+    def test_retirada_recusada_nao_grava_lancamento(self):
+        mov = Movimentacao(
+            acesso=self.acesso,
+            material=self.material,
+            quantidade=11,
+            tipo=Movimentacao.Tipo.RETIRADA,
+        )
+        with self.assertRaises(ValidationError):
+            mov.save()
+        self.assertIsNone(mov.pk)
+        self.assertEqual(LancamentoEstoque.objects.filter(material=self.material).count(), 1)
+
+    def test_saldo_usa_snapshot_mais_lancamentos_posteriores(self):
+        Movimentacao.objects.create(
+            acesso=self.acesso,
+            material=self.material,
+            quantidade=4,
+            tipo=Movimentacao.Tipo.RETIRADA,
+        )
+        # Um snapshot do total e um da unidade.
+        self.assertEqual(gerar_snapshots(), 2)
+        self.assertEqual(gerar_snapshots(), 0)
+        Movimentacao.objects.create(
+            acesso=self.acesso,
+            material=self.material,
+            quantidade=2,
+            tipo=Movimentacao.Tipo.DEVOLUCAO,
+        )
+        snapshot = SnapshotEstoque.objects.get(material=self.material, almoxarifado=None)
+        self.assertEqual(snapshot.saldo, 6)
+        self.assertEqual(saldo_material(self.material.id), 8)
+
+    def test_saldo_da_unidade_parte_do_snapshot_dela(self):
+        norte = Almoxarifado.objects.create(nome='Norte', localizacao='Sorriso')
+        EstoqueAlmoxarifado.objects.create(material=self.material, almoxarifado=norte, quantidade=4)
+        Movimentacao.objects.create(
+            acesso=self.acesso, material=self.material, quantidade=3, tipo=Movimentacao.Tipo.RETIRADA
+        )
+        gerar_snapshots()
+        unidade = SnapshotEstoque.objects.get(material=self.material, almoxarifado=self.almoxarifado)
+        self.assertEqual(unidade.saldo, 7)
+        self.assertEqual(SnapshotEstoque.objects.get(material=self.material, almoxarifado=norte).saldo, 4)
+        Movimentacao.objects.create(
+            acesso=self.acesso, material=self.material, quantidade=1, tipo=Movimentacao.Tipo.RETIRADA
+        )
+        materiais = Material.objects.filter(pk=self.material.pk)
+        material = anotar_saldo_livro(materiais, almoxarifado=self.almoxarifado).get()
+        # So o lancamento posterior ao snapshot da unidade e somado.
+        self.assertEqual(material.snapshot_ate, unidade.ate_lancamento)
+        self.assertEqual((material.delta_posterior, material.saldo_livro), (-1, 6))
+
+
+class ConciliacaoEstoqueTest(BaseSetupMixin, TestCase):
+    def setUp(self):
+        super().setUp()
+        self.outro = Material.objects.create(nome='Fita')
+        EstoqueAlmoxarifado.objects.create(material=self.outro, almoxarifado=self.almoxarifado, quantidade=5)
+        for material, quantidade in [(self.material, 3), (self.outro, 2)]:
+            Movimentacao.objects.create(
+                acesso=self.acesso, material=material, quantidade=quantidade, tipo=Movimentacao.Tipo.RETIRADA
+            )
+
+    def test_detecta_e_corrige_divergencias_por_faixa(self):
+        self.assertEqual(conciliar_estoque(processos=1, tamanho_faixa=1).divergencias, [])
+
+        # Contador alterado por SQL direto e movimentacao excluida sem estorno no livro.
+        EstoqueAlmoxarifado.objects.filter(pk=self.estoque.pk).update(quantidade=50)
+        Movimentacao.objects.filter(material=self.outro).delete()
+
+        resultado = conciliar_estoque(processos=1, tamanho_faixa=1)
+        self.assertEqual((resultado.materiais, resultado.faixas), (2, 2))
+        divergencias = {
+            (d.material_id, d.almoxarifado_id): (d.contador, d.livro, d.esperado) for d in resultado.divergencias
+        }
+        self.assertEqual(
+            divergencias,
+            {
+                (self.material.pk, self.almoxarifado.pk): (50, 7, 7),
+                (self.outro.pk, self.almoxarifado.pk): (3, 3, 5),
+            },
+        )
+        self.estoque.refresh_from_db()
+        self.assertEqual(self.estoque.quantidade, 50)
+
+        saida = StringIO()
+        call_command('conciliar_estoque', '--processos', '1', '--corrigir', stdout=saida)
+        self.assertIn('2 saldos corrigidos', saida.getvalue())
+        self.assertEqual(EstoqueAlmoxarifado.objects.get(material=self.material).quantidade, 7)
+        self.assertEqual(EstoqueAlmoxarifado.objects.get(material=self.outro).quantidade, 5)
+        self.assertEqual(saldo_material(self.outro.pk), 5)
+        self.assertTrue(
+            LancamentoEstoque.objects.filter(
+                material=self.outro, origem=LancamentoEstoque.Origem.CONCILIACAO, delta=2
+            ).exists()
+        )
+        call_command('conciliar_estoque', '--processos', '1', stdout=StringIO())
+
+
+class EstoqueEmDataTest(BaseSetupMixin, TestCase):
+    def setUp(self):
+        super().setUp()
+        self.agora = timezone.now()
+        LancamentoEstoque.objects.filter(material=self.material).update(
+            criado_em=self.agora - timedelta(days=10)
+        )
+        mov = Movimentacao.objects.create(
+            acesso=self.acesso,
+            material=self.material,
+            quantidade=3,
+            tipo=Movimentacao.Tipo.RETIRADA,
+        )
+        LancamentoEstoque.objects.filter(movimentacao=mov).update(criado_em=self.agora - timedelta(days=5))
+        gerar_snapshots()
+        Movimentacao.objects.create(
+            acesso=self.acesso,
+            material=self.material,
+            quantidade=2,
+            tipo=Movimentacao.Tipo.DEVOLUCAO,
+        )
+
+    def test_saldos_em_instantes_diferentes(self):
+        self.assertEqual(saldos_em(self.agora - timedelta(days=11)), {self.material.id: 0})
+        self.assertEqual(saldos_em(self.agora - timedelta(days=7)), {self.material.id: 10})
+        self.assertEqual(saldos_em(self.agora - timedelta(days=3)), {self.material.id: 7})
+        self.assertEqual(saldos_em(timezone.now()), {self.material.id: 9})
+
+    def test_endpoint_json(self):
+        User.objects.create_user(username='tester', password='123')
+        self.client.login(username='tester', password='123')
+        instante = timezone.localtime(self.agora - timedelta(days=3))
+        response = self.client.get(
+            reverse('core:api_estoque_em_data'),
+            {'data': instante.strftime('%Y-%m-%dT%H:%M'), 'material': [self.material.id]},
+        )
+        self.assertEqual(response.status_code, 200)
+        dados = response.json()
+        self.assertEqual(
+            dados['materiais'],
+            [{'id': self.material.id, 'nome': 'Cabo', 'saldo': 7, 'estoque_atual': 9}],
+        )
+
+        # Por unidade o saldo parte do snapshot dela.
+        norte = Almoxarifado.objects.create(nome='Norte', localizacao='Sorriso')
+        for almoxarifado, esperado in [(self.almoxarifado, (7, 9)), (norte, (0, 0))]:
+            response = self.client.get(
+                reverse('core:api_estoque_em_data'),
+                {
+                    'data': instante.strftime('%Y-%m-%dT%H:%M'),
+                    'material': [self.material.id],
+                    'almoxarifado': almoxarifado.id,
+                },
+            )
+            linha = response.json()['materiais'][0]
+            self.assertEqual((linha['saldo'], linha['estoque_atual']), esperado)
+
+        response = self.client.get(reverse('core:api_estoque_em_data'), {'data': 'ontem'})
+        self.assertEqual(response.status_code, 400)
+
+        response = self.client.get(reverse('core:estoque_em_data'))
+        self.assertContains(response, 'Cabo')
+
+
+class MovimentacaoEmLoteTest(BaseSetupMixin, TestCase):
+    def setUp(self):
+        super().setUp()
+        self.outro_material = Material.objects.create(nome='Luva')
+        EstoqueAlmoxarifado.objects.create(material=self.outro_material, almoxarifado=self.almoxarifado, quantidade=2)
+        self.user = User.objects.create_user(username='tester', password='123')
+        self.client.login(username='tester', password='123')
+
+    def test_lote_e_atomico_quando_falta_estoque(self):
+        with self.assertRaises(ValidationError) as contexto:
+            registrar_movimentacoes_em_lote(
+                self.acesso,
+                [
+                    (self.material.id, 4, Movimentacao.Tipo.RETIRADA),
+                    (self.outro_material.id, 3, Movimentacao.Tipo.RETIRADA),
+                ],
+            )
+        self.assertIn('Linha 2', contexto.exception.messages[0])
+        self.assertFalse(Movimentacao.objects.exists())
+        self.estoque.refresh_from_db()
+        self.assertEqual(self.estoque.quantidade, 10)
+
+    def test_lote_valida_linhas_em_sequencia(self):
+        movimentacoes = registrar_movimentacoes_em_lote(
+            self.acesso,
+            [
+                (self.outro_material.id, 1, Movimentacao.Tipo.DEVOLUCAO),
+                (self.outro_material.id, 3, Movimentacao.Tipo.RETIRADA),
+                (self.material.id, 6, Movimentacao.Tipo.RETIRADA),
+            ],
+        )
+        self.assertEqual(len(movimentacoes), 3)
+        estoques = dict(EstoqueAlmoxarifado.objects.values_list('material_id', 'quantidade'))
+        self.assertEqual(estoques, {self.outro_material.id: 0, self.material.id: 4})
+        self.assertEqual(saldo_material(self.material.id), 4)
+
+    def test_endpoint_json(self):
+        url = reverse('core:api_registrar_movimentacoes_lote', args=[self.acesso.id])
+        response = self.client.post(
+            url,
+            {'itens': [{'material': self.material.id, 'quantidade': 2, 'tipo': 'retirada'}]},
+            content_type='application/json',
+        )
+        self.assertEqual(response.status_code, 201)
+        self.assertEqual(len(response.json()['movimentacoes']), 1)
+
+        response = self.client.post(
+            url,
+            {'itens': [{'material': self.outro_material.id, 'quantidade': 5, 'tipo': 'retirada'}]},
+            content_type='application/json',
+        )
+        self.assertEqual(response.status_code, 409)
+
+        response = self.client.post(url, {'itens': [{'quantidade': 0}]}, content_type='application/json')
+        self.assertEqual(response.status_code, 400)
+
+    def test_formset(self):
+        url = reverse('core:registrar_movimentacoes_lote', args=[self.acesso.id])
+        self.assertEqual(self.client.get(url).status_code, 200)
+        dados = {
+            'itens-TOTAL_FORMS': '3',
+            'itens-INITIAL_FORMS': '0',
+            'itens-MIN_NUM_FORMS': '1',
+            'itens-MAX_NUM_FORMS': '200',
+            'itens-0-material': self.material.id,
+            'itens-0-quantidade': '2',
+            'itens-0-tipo': 'retirada',
+            'itens-1-material': self.outro_material.id,
+            'itens-1-quantidade': '1',
+            'itens-1-tipo': 'retirada',
+            'itens-2-tipo': 'retirada',
+        }
+        response = self.client.post(url, dados)
+        self.assertEqual(response.status_code, 302)
+        self.assertEqual(Movimentacao.objects.filter(acesso=self.acesso).count(), 2)
+
+
+class ImportacaoTest(TestCase):
+    def _arquivo(self, nome, conteudo):
+        diretorio = tempfile.TemporaryDirectory()
+        self.addCleanup(diretorio.cleanup)
+        caminho = Path(diretorio.name) / nome
+        caminho.write_text(conteudo, encoding='utf-8')
+        return str(caminho)
+
+    def test_importa_cadastros_e_historico(self):
+        almoxarifados = self._arquivo('almoxarifados.csv', 'nome;localizacao\nCentral;Sinop\nNorte;Sorriso\n')
+        call_command('importar', 'almoxarifados', almoxarifados, stdout=StringIO())
+        almoxarifados = self._arquivo('almoxarifados.csv', 'nome;localizacao\nCentral;Sinop - MT\n')
+        call_command('importar', 'almoxarifados', almoxarifados, stdout=StringIO())
+        self.assertEqual(Almoxarifado.objects.get(nome='Central').localizacao, 'Sinop - MT')
+        self.assertEqual(Almoxarifado.objects.count(), 2)
+
+        materiais = self._arquivo('materiais.csv', 'nome;estoque_inicial\nCabo;10\n')
+        with self.assertRaisesMessage(CommandError, 'informe o almoxarifado'):
+            call_command('importar', 'materiais', materiais, stdout=StringIO())
+        materiais = self._arquivo(
+            'materiais.csv', 'nome;almoxarifado;estoque_inicial\nCabo;Central;8\nCabo;Norte;2\nLuva;;\n'
+        )
+        call_command('importar', 'materiais', materiais, '--data-estoque-inicial', '2020-01-01', stdout=StringIO())
+
+        linhas = [
+            {'acesso': 'A1', 'data_hora': '2024-03-05T08:00', 'funcionario': 'Fulano', 'autorizador': 'Chefe',
+             'almoxarifado': 'Central', 'material': 'Cabo', 'tipo': 'retirada', 'quantidade': 4},
+            {'acesso': 'A1', 'data_hora': '2024-03-05T08:00', 'funcionario': 'Fulano', 'autorizador': 'Chefe',
+             'almoxarifado': 'Central', 'material': 'Luva', 'tipo': 'devolucao', 'quantidade': 3},
+            {'acesso': 'A1', 'data_hora': '2024-03-05T08:00', 'funcionario': 'Fulano', 'autorizador': 'Chefe',
+             'almoxarifado': 'Central', 'material': 'Cabo', 'tipo': 'devolucao', 'quantidade': 1},
+            {'acesso': 'A2', 'data_hora': '2024-04-10T09:30', 'funcionario': 'Beltrano', 'autorizador': 'Chefe',
+             'almoxarifado': 'Norte', 'material': 'Cabo', 'tipo': 'retirada', 'quantidade': 2},
+        ]
+        historico = self._arquivo('historico.jsonl', '\n'.join(json.dumps(linha) for linha in linhas))
+        saida = StringIO()
+        call_command('importar', 'movimentacoes', historico, '--lote', '2', stdout=saida)
+        self.assertIn('4 registros', saida.getvalue())
+
+        self.assertEqual(Acesso.objects.count(), 2)
+        self.assertEqual(Movimentacao.objects.count(), 4)
+        primeiro = Acesso.objects.get(funcionario__nome='Fulano')
+        self.assertEqual(timezone.localtime(primeiro.data_hora).strftime('%Y-%m-%d %H:%M'), '2024-03-05 08:00')
+        self.assertEqual(primeiro.status, Acesso.Status.FECHADO)
+        estoques = EstoqueAlmoxarifado.objects.values_list('material__nome', 'almoxarifado__nome', 'quantidade')
+        self.assertEqual(set(estoques), {('Cabo', 'Central', 5), ('Cabo', 'Norte', 0), ('Luva', 'Central', 3)})
+        self.assertEqual(
+            ResumoMensal.objects.filter(ano=2024, mes=3).aggregate(total=Sum('total_movimentacoes'))['total'],
+            3,
+        )
+        self.assertEqual(saldos_em(timezone.make_aware(datetime(2024, 4, 1))), {
+            Material.objects.get(nome='Cabo').id: 7,
+            Material.objects.get(nome='Luva').id: 3,
+        })
+
+    def test_pessoas_por_matricula_e_marcadores(self):
+        base = versoes.versao(versoes.CHAVE_BASE)
+        funcionarios = self._arquivo(
+            'funcionarios.csv', 'nome;matricula\nJoao Silva;101\nJoao Silva;102\nMaria;\n'
+        )
+        with self.captureOnCommitCallbacks(execute=True):
+            call_command('importar', 'funcionarios', funcionarios, stdout=StringIO())
+        self.assertNotEqual(versoes.versao(versoes.CHAVE_BASE), base)
+        funcionarios = self._arquivo('funcionarios.csv', 'nome;matricula\nJoao da Silva;101\nMaria;\n')
+        call_command('importar', 'funcionarios', funcionarios, stdout=StringIO())
+        self.assertEqual(
+            sorted(Funcionario.objects.values_list('nome', 'matricula')),
+            [('Joao Silva', '102'), ('Joao da Silva', '101'), ('Maria', None)],
+        )
+
+    def test_conflito_informa_o_registro(self):
+        linhas = [
+            {'acesso': 'A1', 'data_hora': '2024-03-05T08:00', 'funcionario': 'Fulano', 'autorizador': 'Chefe',
+             'almoxarifado': 'Central', 'material': 'Cabo', 'tipo': 'retirada', 'quantidade': 1, 'status': 'ABERTO'},
+            {'acesso': 'A2', 'data_hora': '2024-03-06T08:00', 'funcionario': 'Fulano', 'autorizador': 'Chefe',
+             'almoxarifado': 'Central', 'material': 'Cabo', 'tipo': 'retirada', 'quantidade': 1, 'status': 'ABERTO'},
+        ]
+        historico = self._arquivo('historico.jsonl', '\n'.join(json.dumps(linha) for linha in linhas))
+        with self.assertRaisesMessage(CommandError, "Conflito no registro 2 ({'acesso': 'A2'"):
+            call_command('importar', 'movimentacoes', historico, stdout=StringIO())
+        self.assertFalse(Acesso.objects.exists())
+
+    def test_opcao_invalida_informa_o_registro(self):
+        linhas = [
+            {'acesso': 'A1', 'data_hora': '2024-03-05T08:00', 'funcionario': 'Fulano', 'autorizador': 'Chefe',
+             'almoxarifado': 'Central', 'material': 'Cabo', 'tipo': 'retirada', 'quantidade': 1},
+            {'acesso': 'A1', 'data_hora': '2024-03-05T08:00', 'funcionario': 'Fulano', 'autorizador': 'Chefe',
+             'almoxarifado': 'Central', 'material': 'Cabo', 'tipo': 'Retirada', 'quantidade': 1},
+        ]
+        historico = self._arquivo('historico.jsonl', '\n'.join(json.dumps(linha) for linha in linhas))
+        with self.assertRaisesMessage(CommandError, "Registro 2 invalido ({'acesso': 'A1'"):
+            call_command('importar', 'movimentacoes', historico, stdout=StringIO())
+        self.assertFalse(Movimentacao.objects.exists())
+        self.assertFalse(LancamentoEstoque.objects.exists())
+
+
+class BuscaMigracoesTest(TestCase):
+    def test_operacao_fora_do_par_de_buscas(self):
+        alterar = migrations.AlterField(model_name='material', name='nome', field=CharField(max_length=150))
+        indice = migrations.AddIndex(model_name='material', index=Index(fields=['nome'], name='material_nome_idx'))
+        remover = migrations.RunPython(_busca.remover_buscas, _busca.criar_buscas)
+        criar = migrations.RunPython(_busca.criar_buscas, _busca.remover_buscas)
+
+        self.assertEqual(_busca.desprotegidas([alterar, indice]), [alterar])
+        self.assertEqual(_busca.desprotegidas([remover, alterar]), [alterar])
+        self.assertEqual(_busca.desprotegidas([remover, alterar, criar]), [])
+        self.assertEqual(migracoes_preservam_busca(None), [])
+
+
+class MigracoesTest(TransactionTestCase):
+    """Migracoes de dados partindo de um estado antigo; o tearDown volta o banco para a ultima."""
+
+    def _migrar(self, alvo):
+        executor = MigrationExecutor(connection)
+        executor.migrate([('core', alvo)])
+        return executor.loader.project_state([('core', alvo)]).apps
+
+    def tearDown(self):
+        executor = MigrationExecutor(connection)
+        executor.migrate(executor.loader.graph.leaf_nodes('core'))
+
+    def test_nomes_repetidos_antes_da_unicidade(self):
+        apps = self._migrar('0007_livro_estoque')
+        Material = apps.get_model('core', 'Material')
+        Funcionario = apps.get_model('core', 'Funcionario')
+        cabos = [Material.objects.create(nome='Cabo') for _ in range(2)]
+        Funcionario.objects.create(nome='Joao Silva')
+        Funcionario.objects.create(nome='Joao Silva')
+
+        apps = self._migrar('0008_nomes_unicos')
+        Material = apps.get_model('core', 'Material')
+        self.assertEqual(
+            list(Material.objects.order_by('id').values_list('nome', flat=True)),
+            ['Cabo', f'Cabo ({cabos[1].id})'],
+        )
+        # Homonimos continuam validos.
+        self.assertEqual(apps.get_model('core', 'Funcionario').objects.filter(nome='Joao Silva').count(), 2)
+
+    def test_acessos_abertos_repetidos_antes_da_restricao(self):
+        apps = self._migrar('0008_nomes_unicos')
+        funcionario = apps.get_model('core', 'Funcionario').objects.create(nome='Maria')
+        autorizador = apps.get_model('core', 'Autorizador').objects.create(nome='Chefe')
+        almoxarifado = apps.get_model('core', 'Almoxarifado').objects.create(nome='Central')
+        material = apps.get_model('core', 'Material').objects.create(nome='Luva')
+        Acesso = apps.get_model('core', 'Acesso')
+        antigo, recente = [
+            Acesso.objects.create(funcionario=funcionario, autorizador=autorizador, almoxarifado=almoxarifado, tipo='entrada')
+            for _ in range(2)
+        ]
+        apps.get_model('core', 'Movimentacao').objects.create(acesso=antigo, material=material, quantidade=3, tipo='retirada')
+
+        apps = self._migrar('0009_indices_consultas')
+        Acesso = apps.get_model('core', 'Acesso')
+        self.assertEqual(list(Acesso.objects.filter(status='ABERTO').values_list('id', flat=True)), [recente.id])
+        encerrado = Acesso.objects.get(id=antigo.id)
+        self.assertEqual((encerrado.status, encerrado.ativo), ('FECHADO', False))
+        self.assertIsNotNone(encerrado.data_saida)
+        resumo = apps.get_model('core', 'ResumoMensal').objects.get(material_id=material.id)
+        self.assertEqual((resumo.quantidade, resumo.total_movimentacoes), (3, 1))
+
+
+class PlanoConsultasTest(BaseSetupMixin, TestCase):
+    TABELAS_GRANDES = ('core_acesso', 'core_movimentacao', 'core_resumomensal', 'core_lancamentoestoque')
+
+    def setUp(self):
+        super().setUp()
+        self.user = User.objects.create_user(username='tester', password='123')
+        self.client.login(username='tester', password='123')
+        Movimentacao.objects.create(
+            acesso=self.acesso,
+            material=self.material,
+            quantidade=1,
+            tipo=Movimentacao.Tipo.RETIRADA,
+        )
+
+    def _planos(self, metodo, url, dados=None):
+        with CaptureQueriesContext(connection) as consultas:
+            getattr(self.client, metodo)(url, dados or {})
+        planos = []
+        with connection.cursor() as cursor:
+            for consulta in consultas.captured_queries:
+                if not consulta['sql'].startswith('SELECT') or 'core_' not in consulta['sql']:
+                    continue
+                cursor.execute(f"EXPLAIN QUERY PLAN {consulta['sql']}")
+                planos.append(' | '.join(linha[3] for linha in cursor.fetchall()))
+        return planos
+
+    def _sem_varredura_completa(self, planos):
+        for plano in planos:
+            for passo in plano.split(' | '):
+                for tabela in self.TABELAS_GRANDES:
+                    self.assertFalse(
+                        passo.startswith(f'SCAN {tabela}') and 'INDEX' not in passo,
+                        f'Varredura completa de {tabela}: {plano}',
+                    )
+
+    def test_verificacao_de_acesso_aberto_usa_indice_parcial(self):
+        planos = self._planos(
+            'post',
+            reverse('core:registrar_acesso'),
+            {
+                'funcionario': self.funcionario.id,
+                'autorizador': self.autorizador.id,
+                'almoxarifado': self.almoxarifado.id,
+                'tipo': Acesso.Tipo.ENTRADA,
+                'justificativa_padrao': Acesso.Justificativa.RETIRADA_CAMPO,
+            },
+        )
+        self.assertTrue(any('acesso_aberto_unico_por_funcionario' in plano for plano in planos), planos)
+        self._sem_varredura_completa(planos)
+
+    def test_historico_filtra_status_pelo_indice(self):
+        planos = self._planos('get', reverse('core:historico'), {'status': Acesso.Status.ABERTO})
+        self.assertTrue(any('acesso_status_data_idx' in plano for plano in planos), planos)
+        self._sem_varredura_completa(planos)
+
+    def test_historico_por_periodo_usa_indice_de_data(self):
+        hoje = timezone.localdate().isoformat()
+        planos = self._planos('get', reverse('core:historico'), {'data_inicio': hoje, 'data_fim': hoje})
+        self.assertTrue(any('acesso_data_hora_idx' in plano for plano in planos), planos)
+        self._sem_varredura_completa(planos)
+
+    def test_busca_textual_parte_do_indice_fts(self):
+        planos = self._planos('get', reverse('core:historico'), {'q': 'cabo'})
+        self.assertTrue(any('VIRTUAL TABLE INDEX' in plano for plano in planos), planos)
+        self._sem_varredura_completa(planos)
+        response = self.client.get(reverse('core:exportar_historico', args=['csv']), {'q': 'cabo'})
+        self.assertIn('Cabo', b''.join(response.streaming_content).decode())
+
+    def test_relatorio_e_formulario_nao_varrem_tabelas_grandes(self):
+        agora = timezone.now()
+        self._sem_varredura_completa(
+            self._planos('get', reverse('core:relatorio_mensal'), {'mes': str(agora.month), 'ano': str(agora.year)})
+        )
+        self._sem_varredura_completa(self._planos('get', reverse('core:registrar_movimentacao')))
+
+    def test_soma_por_material_e_tipo_usa_indice_composto(self):
+        plano = (
+            Movimentacao.objects.filter(material=self.material, tipo=Movimentacao.Tipo.RETIRADA)
+            .order_by()
+            .values('material')
+            .annotate(total=Sum('quantidade'))
+            .explain()
+        )
+        self.assertIn('movimentacao_material_tipo_idx', plano)
+
+    def test_apenas_um_acesso_aberto_por_funcionario(self):
+        with self.assertRaises(IntegrityError):
+            Acesso.objects.create(
+                funcionario=self.funcionario,
+                autorizador=self.autorizador,
+                almoxarifado=self.almoxarifado,
+                tipo=Acesso.Tipo.ENTRADA,
+            )
+
+
+class FiltrosDataTest(BaseSetupMixin, TestCase):
+    def setUp(self):
+        super().setUp()
+        # 31/01 as 23:30 no horario local: ja e 01/02 em UTC.
+        self.acesso.data_hora = timezone.make_aware(datetime(2024, 1, 31, 23, 30))
+        self.acesso.save(update_fields=['data_hora'])
+
+    def test_intervalo_de_dias_respeita_fuso_local(self):
+        qs = Acesso.objects.all()
+        inicio, fim = intervalo_dias(date(2024, 1, 31), date(2024, 1, 31))
+        self.assertEqual(list(filtrar_intervalo(qs, 'data_hora', inicio, fim)), [self.acesso])
+        inicio, fim = intervalo_dias(date(2024, 2, 1), None)
+        self.assertFalse(filtrar_intervalo(qs, 'data_hora', inicio, fim).exists())
+
+    def test_data_maxima_vira_intervalo_aberto(self):
+        self.assertEqual(intervalo_dias(None, date.max), (None, None))
+        self.client.force_login(User.objects.create_user(username='tester', password='123'))
+        response = self.client.get(reverse('core:historico'), {'data_fim': '9999-12-31'})
+        self.assertEqual(response.status_code, 200)
+        self.assertContains(response, self.funcionario.nome)
+
+    def test_intervalo_de_mes_e_semiaberto(self):
+        qs = Acesso.objects.all()
+        self.assertTrue(filtrar_intervalo(qs, 'data_hora', *intervalo_mes(2024, 1)).exists())
+        self.assertFalse(filtrar_intervalo(qs, 'data_hora', *intervalo_mes(2024, 2)).exists())
+        self.assertEqual(intervalo_mes(2024, 12)[1], timezone.make_aware(datetime(2025, 1, 1)))
+
+    def test_anos_disponiveis_em_cache_e_invalidado_por_novo_acesso(self):
+        self.assertEqual(Acesso.anos_disponiveis(), [2024])
+        with self.assertNumQueries(0):
+            Acesso.anos_disponiveis()
+        Acesso.objects.create(
+            funcionario=Funcionario.objects.create(nome='Beltrano'),
+            autorizador=self.autorizador,
+            almoxarifado=self.almoxarifado,
+            tipo=Acesso.Tipo.ENTRADA,
+        )
+        self.assertEqual(Acesso.anos_disponiveis(), list(range(2024, timezone.localdate().year + 1)))
+
+
+@override_settings(INSTRUMENTACAO_AMOSTRAGEM=1.0, INSTRUMENTACAO_LIMITE_REPETICOES=3)
+class InstrumentacaoTest(BaseSetupMixin, TestCase):
+    def setUp(self):
+        super().setUp()
+        self.user = User.objects.create_user(username='tester', password='123', is_staff=True)
+        self.client.login(username='tester', password='123')
+
+    def test_server_timing_so_para_equipe_ou_debug(self):
+        comum = User.objects.create_user(username='comum', password='123')
+        self.client.force_login(comum)
+        self.assertNotIn('Server-Timing', self.client.get(reverse('core:historico')))
+        with override_settings(DEBUG=True):
+            self.assertIn('Server-Timing', self.client.get(reverse('core:historico')))
+
+    def test_registra_amostra_da_requisicao(self):
+        response = self.client.get(reverse('core:historico'))
+        self.assertIn('db;dur=', response['Server-Timing'])
+        amostra = AmostraRequisicao.objects.get(view='core:historico')
+        self.assertEqual((amostra.metodo, amostra.status), ('GET', 200))
+        self.assertGreater(amostra.consultas, 0)
+        self.assertGreater(amostra.tempo_template_ms, 0)
+        self.assertFalse(amostra.suspeita_n_mais_1)
+
+    def test_marca_consulta_repetida_como_n_mais_1(self):
+        outros = Funcionario.objects.bulk_create([Funcionario(nome=f'F{i}') for i in range(3)])
+        medicao = Medicao()
+        with connection.execute_wrapper(medicao):
+            for funcionario in outros:
+                Funcionario.objects.get(pk=funcionario.pk)
+        amostra = medicao.registrar('teste', 'GET', 200, limite_repeticoes=3)
+        self.assertTrue(amostra.suspeita_n_mais_1)
+        self.assertEqual(amostra.repeticoes, 3)
+        self.assertIn('core_funcionario', amostra.consulta_repetida)
+
+    def test_relatorio_por_comando_e_pagina(self):
+        for _ in range(3):
+            self.client.get(reverse('core:historico'))
+        saida = StringIO()
+        call_command('relatorio_desempenho', '--json', stdout=saida)
+        linha = next(item for item in json.loads(saida.getvalue()) if item['view'] == 'core:historico')
+        self.assertEqual(linha['amostras'], 3)
+        self.assertLessEqual(linha['p50_ms'], linha['p95_ms'])
+
+        self.assertContains(self.client.get(reverse('core:desempenho')), 'core:historico')
+        self.user.is_staff = False
+        self.user.save()
+        self.assertEqual(self.client.get(reverse('core:desempenho')).status_code, 302)
+
+
+class ViewsAssincronasTest(BaseSetupMixin, TestCase):
+    """Views de leitura pelo ``AsyncClient``: middleware e views no caminho ASGI."""
+
+    def setUp(self):
+        super().setUp()
+        self.user = User.objects.create_user(username='tester', password='123')
+        Movimentacao.objects.create(
+            acesso=self.acesso, material=self.material, quantidade=2, tipo=Movimentacao.Tipo.RETIRADA
+        )
+
+    async def test_views_de_leitura_async(self):
+        response = await self.async_client.get(reverse('core:historico'))
+        self.assertEqual(response.status_code, 302)
+
+        await self.async_client.aforce_login(self.user)
+        response = await self.async_client.get(reverse('core:historico'))
+        self.assertContains(response, 'Fulano')
+        self.assertEqual(response.context['acessos'].itens[0].total_retiradas, 2)
+
+        response = await self.async_client.get(reverse('core:relatorio_mensal'))
+        self.assertEqual(response.status_code, 200)
+
+        response = await self.async_client.get(reverse('core:api_autocomplete', args=['materiais']), {'q': 'cab'})
+        self.assertEqual([item['id'] for item in response.json()['resultados']], [self.material.pk])
+
+        response = await self.async_client.get(reverse('core:api_estoques_materiais'))
+        versao = response.json()['versao']
+        self.assertEqual(response.json()['materiais'][str(self.material.pk)]['estoque'], 8)
+        response = await self.async_client.get(reverse('core:api_estoques_materiais'), {'versao': versao})
+        self.assertEqual(response.status_code, 204)
+
+        response = await self.async_client.get(reverse('core:api_estoque_em_data'))
+        self.assertEqual(response.json()['materiais'][0]['saldo'], 8)
+
+    async def test_versao_do_mapa_pelo_cache_async(self):
+        versao = await Material.aversao_mapa_estoques()
+        self.assertEqual(versao, await sync_to_async(Material.versao_mapa_estoques)())
+        await sync_to_async(Material._nova_versao_mapa)()
+        self.assertNotEqual(await Material.aversao_mapa_estoques(), versao)
+
+    @override_settings(INSTRUMENTACAO_AMOSTRAGEM=1.0)
+    async def test_instrumentacao_no_caminho_async(self):
+        await self.async_client.aforce_login(self.user)
+        response = await self.async_client.get(reverse('core:historico'))
+        # Usuario comum: a amostra e gravada, mas os tempos nao vao no cabecalho.
+        self.assertNotIn('Server-Timing', response)
+        amostra = await AmostraRequisicao.objects.aget(view='core:historico')
+        self.assertGreater(amostra.consultas, 0)
+        self.assertGreater(amostra.tempo_template_ms, 0)
+
+
+class TarefaTest(BaseSetupMixin, TestCase):
+    def setUp(self):
+        super().setUp()
+        self.media = tempfile.TemporaryDirectory()
+        self.addCleanup(self.media.cleanup)
+        configuracao = override_settings(MEDIA_ROOT=self.media.name)
+        configuracao.enable()
+        self.addCleanup(configuracao.disable)
+        self.user = User.objects.create_user(username='tester', password='123')
+        self.client.login(username='tester', password='123')
+        Movimentacao.objects.create(
+            acesso=self.acesso, material=self.material, quantidade=4, tipo=Movimentacao.Tipo.RETIRADA
+        )
+        self.acesso.encerrar()
+
+    def test_exportacao_enfileirada_e_baixada_apos_o_worker(self):
+        agora = timezone.now()
+        url = reverse('core:enfileirar_exportacao', args=['relatorio', 'csv'])
+        response = self.client.post(f'{url}?mes={agora.month}&ano={agora.year}', {'periodo': 'ano'})
+        self.assertRedirects(response, reverse('core:tarefas'))
+        tarefa = Tarefa.objects.get()
+        self.assertEqual((tarefa.status, tarefa.parametros['mes']), (Tarefa.Status.PENDENTE, None))
+        self.assertEqual(self.client.get(reverse('core:api_tarefa', args=[tarefa.pk])).json()['status'], 'PENDENTE')
+
+        call_command('worker', '--uma-vez', stdout=StringIO())
+        tarefa.refresh_from_db()
+        self.assertEqual((tarefa.status, tarefa.progresso), (Tarefa.Status.CONCLUIDA, 100))
+        dados = self.client.get(reverse('core:api_tarefa', args=[tarefa.pk])).json()
+        self.assertEqual(dados['arquivo'], reverse('core:baixar_tarefa', args=[tarefa.pk]))
+        response = self.client.get(dados['arquivo'])
+        conteudo = b''.join(response.streaming_content).decode('utf-8-sig')
+        self.assertIn('Cabo;Entrada;Retirada', conteudo)
+        self.assertContains(self.client.get(reverse('core:tarefas')), 'Baixar')
+
+        User.objects.create_user(username='outro', password='123')
+        self.client.login(username='outro', password='123')
+        self.assertEqual(self.client.get(dados['arquivo']).status_code, 404)
+        self.assertEqual(self.client.get(reverse('core:api_tarefa', args=[tarefa.pk])).status_code, 404)
+
+    def test_reserva_unica_recuperacao_e_falha(self):
+        tarefa = Tarefa.enfileirar(Tarefa.Tipo.EXPORTAR_HISTORICO, {'formato': 'pdf'})
+        self.assertEqual(Tarefa.reservar('a').pk, tarefa.pk)
+        self.assertIsNone(Tarefa.reservar('b'))
+
+        # Worker morreu no meio: volta para a fila ate esgotar as tentativas.
+        Tarefa.objects.filter(pk=tarefa.pk).update(atualizado_em=timezone.now() - timedelta(hours=1))
+        self.assertEqual(Tarefa.recuperar_presas(timedelta(minutes=30)), 1)
+        tarefa.refresh_from_db()
+        self.assertEqual(tarefa.status, Tarefa.Status.PENDENTE)
+        Tarefa.objects.filter(pk=tarefa.pk).update(
+            status=Tarefa.Status.EXECUTANDO,
+            tentativas=Tarefa.MAX_TENTATIVAS,
+            atualizado_em=timezone.now() - timedelta(hours=1),
+        )
+        Tarefa.recuperar_presas(timedelta(minutes=30))
+        tarefa.refresh_from_db()
+        self.assertEqual(tarefa.status, Tarefa.Status.FALHOU)
+
+        # Erro no executor vira falha com mensagem, sem derrubar o worker.
+        outra = Tarefa.enfileirar(Tarefa.Tipo.EXPORTAR_HISTORICO, {'formato': 'pdf'})
+        with self.assertLogs('core.tarefas', 'ERROR'):
+            call_command('worker', '--uma-vez', stdout=StringIO())
+        outra.refresh_from_db()
+        self.assertEqual(outra.status, Tarefa.Status.FALHOU)
+        self.assertIn('Formato de exportacao invalido', outra.mensagem)
+
+    def test_recalculo_de_estoque_so_pela_equipe(self):
+        url = reverse('core:enfileirar_recalculo_estoque')
+        self.client.post(url)
+        self.assertFalse(Tarefa.objects.exists())
+
+        self.user.is_staff = True
+        self.user.save()
+        self.assertRedirects(self.client.post(url), reverse('core:tarefas'))
+        EstoqueAlmoxarifado.objects.filter(pk=self.estoque.pk).update(quantidade=999)
+        resumo = list(ResumoMensal.objects.values_list('pk', 'quantidade'))
+        self.assertTrue(resumo)
+        call_command('worker', '--uma-vez', stdout=StringIO())
+        self.estoque.refresh_from_db()
+        self.assertEqual(self.estoque.quantidade, 6)
+        tarefa = Tarefa.objects.get()
+        self.assertEqual(tarefa.status, Tarefa.Status.CONCLUIDA)
+        self.assertEqual(tarefa.mensagem, '1 saldos corrigidos em 1 materiais.')
+        # O resumo mensal nao e apagado e reconstruido pela tarefa.
+        self.assertEqual(list(ResumoMensal.objects.values_list('pk', 'quantidade')), resumo)
+
+
+class BenchmarkTest(TestCase):
+    def test_gera_dados_e_roda_cenarios_sem_alterar_o_banco(self):
+        call_command(
+            'gerar_dados_sinteticos',
+            '--funcionarios', '8',
+            '--materiais', '20',
+            '--anos', '1',
+            '--acessos-por-dia', '2',
+            stdout=StringIO(),
+        )
+        self.assertEqual(Material.objects.count(), 20)
+        self.assertEqual(EstoqueAlmoxarifado.objects.count(), 20 * 3)
+        self.assertFalse(EstoqueAlmoxarifado.objects.filter(quantidade=0).exists())
+        self.assertLessEqual(Acesso.objects.filter(status=Acesso.Status.ABERTO).count(), 8)
+        acessos = Acesso.objects.count()
+
+        with tempfile.TemporaryDirectory() as diretorio:
+            saida = Path(diretorio) / 'benchmark.json'
+            call_command(
+                'benchmark', '--repeticoes', '2', '--aquecimento', '0', '--saida', str(saida), stdout=StringIO()
+            )
+            relatorio = json.loads(saida.read_text(encoding='utf-8'))
+        self.assertEqual(relatorio['banco']['acessos'], acessos)
+        self.assertTrue(all(m['dentro_orcamento'] for m in relatorio['cenarios'].values()), relatorio['cenarios'])
+        self.assertEqual(Acesso.objects.count(), acessos)
+        self.assertFalse(User.objects.exists())
+
+
+class NotificadorQuebrado(Notificador):
+    def enviar(self, alertas):
+        raise OSError('servidor de e-mail fora do ar')
+
+
+class AlertasEstoqueTest(BaseSetupMixin, TestCase):
+    def setUp(self):
+        super().setUp()
+        self.saida = StringIO()
+        configuracao = {'BACKEND': 'core.alertas.NotificadorConsole', 'OPCOES': {'saida': self.saida}}
+        self.enterContext(override_settings(ALERTAS_ESTOQUE=configuracao))
+
+    def _movimentar(self, quantidade, tipo='retirada'):
+        with self.captureOnCommitCallbacks(execute=True):
+            Movimentacao.objects.create(acesso=self.acesso, material=self.material, quantidade=quantidade, tipo=tipo)
+        self.estoque.refresh_from_db()
+
+    def test_alerta_uma_vez_por_falta(self):
+        self._movimentar(5)
+        self.assertFalse(self.estoque.abaixo_do_minimo)
+        self._movimentar(1)
+        self.assertTrue(self.estoque.abaixo_do_minimo)
+        self.assertEqual(self.saida.getvalue(), 'Estoque baixo: Cabo com 4 unidades em Central (minimo 5).\n')
+
+        self._movimentar(1)
+        self.assertEqual(self.saida.getvalue().count('Estoque baixo'), 1)
+
+        self._movimentar(7, 'devolucao')
+        self.assertFalse(self.estoque.abaixo_do_minimo)
+        self.assertFalse(self.estoque.alertado)
+        self._movimentar(7)
+        self.assertEqual(self.saida.getvalue().count('Estoque baixo'), 2)
+
+    def test_minimo_do_material_e_da_unidade(self):
+        outro = Almoxarifado.objects.create(nome='Norte', localizacao='Anexo')
+        proprio = EstoqueAlmoxarifado.objects.create(
+            material=self.material, almoxarifado=outro, quantidade=10, estoque_minimo=2
+        )
+        with self.captureOnCommitCallbacks(execute=True):
+            self.material.estoque_minimo = 12
+            self.material.save()
+        self.estoque.refresh_from_db()
+        proprio.refresh_from_db()
+        self.assertEqual((self.estoque.minimo_efetivo, self.estoque.abaixo_do_minimo), (12, True))
+        self.assertEqual((proprio.minimo_efetivo, proprio.abaixo_do_minimo), (2, False))
+        self.assertIn('Cabo com 10 unidades em Central (minimo 12)', self.saida.getvalue())
+        self.assertEqual(list(EstoqueAlmoxarifado.objects.filter(abaixo_do_minimo=True)), [self.estoque])
+
+    def test_recalculo_reclassifica(self):
+        LancamentoEstoque.objects.create(
+            material=self.material, almoxarifado=self.almoxarifado, origem=LancamentoEstoque.Origem.AJUSTE, delta=-8
+        )
+        with self.captureOnCommitCallbacks(execute=True):
+            recalcular_estoque()
+        self.estoque.refresh_from_db()
+        self.assertEqual(self.estoque.quantidade, 2)
+        self.assertTrue(self.estoque.alertado)
+        self.assertIn('Cabo com 2 unidades', self.saida.getvalue())
+
+    def test_notificador_log_padrao(self):
+        with override_settings(ALERTAS_ESTOQUE={'BACKEND': 'core.alertas.NotificadorLog'}):
+            with self.assertLogs('core.alertas', 'WARNING') as logs:
+                self._movimentar(6)
+        self.assertEqual(logs.output, ['WARNING:core.alertas:Estoque baixo: Cabo com 4 unidades em Central (minimo 5).'])
+
+    def test_falha_na_entrega_deixa_o_alerta_pendente(self):
+        with override_settings(ALERTAS_ESTOQUE={'BACKEND': 'core.tests.NotificadorQuebrado'}):
+            with self.assertLogs('core.alertas', 'ERROR'):
+                self._movimentar(6)
+        self.assertEqual((self.estoque.abaixo_do_minimo, self.estoque.alertado), (True, False))
+
+        saida = StringIO()
+        call_command('estoque_baixo', '--notificar', stdout=saida)
+        self.assertIn('1 alertas enviados.', saida.getvalue())
+        self.assertIn('Cabo com 4 unidades', self.saida.getvalue())
+
+    def test_notificador_arquivo(self):
+        with tempfile.TemporaryDirectory() as pasta:
+            caminho = Path(pasta) / 'alertas.jsonl'
+            configuracao = {'BACKEND': 'core.alertas.NotificadorArquivo', 'OPCOES': {'caminho': caminho}}
+            with override_settings(ALERTAS_ESTOQUE=configuracao):
+                self._movimentar(6)
+            linha = json.loads(caminho.read_text(encoding='utf-8'))
+        self.assertEqual((linha['material'], linha['quantidade'], linha['minimo']), ('Cabo', 4, 5))
+
+    def test_comando_estoque_baixo(self):
+        # Saldo marcado sem alerta, como se a entrega tivesse sido perdida.
+        EstoqueAlmoxarifado.objects.filter(pk=self.estoque.pk).update(quantidade=3, abaixo_do_minimo=True)
+        saida = StringIO()
+        call_command('estoque_baixo', '--notificar', stdout=saida)
+        self.assertIn('Cabo em Central: 3 de minimo 5 (alerta pendente)', saida.getvalue())
+        self.assertIn('1 alertas enviados.', saida.getvalue())
+        self.assertIn('Cabo com 3 unidades', self.saida.getvalue())
+        call_command('estoque_baixo', '--notificar', stdout=saida)
+        self.assertEqual(self.saida.getvalue().count('Estoque baixo'), 1)
+
+
+class FluxoEventosTest(BaseSetupMixin, TestCase):
+    def test_eventos_desde_o_cursor(self):
+        cursor = cursor_atual()
+        Movimentacao.objects.create(acesso=self.acesso, material=self.material, quantidade=2, tipo='retirada')
+        self.acesso.encerrar()
+        outro = Funcionario.objects.create(nome='Beltrano')
+        novo = Acesso.objects.create(
+            funcionario=outro, autorizador=self.autorizador, almoxarifado=self.almoxarifado, tipo=Acesso.Tipo.ENTRADA
+        )
+
+        eventos, cursor, ha_mais = ler_eventos(cursor)
+        self.assertEqual([tipo for tipo, _ in eventos], ['acesso', 'movimentacao', 'encerramento'])
+        self.assertEqual(eventos[0][1]['funcionario'], 'Beltrano')
+        self.assertEqual(eventos[2][1]['id'], self.acesso.id)
+        self.assertFalse(ha_mais)
+        self.assertEqual(cursor.acesso, novo.id)
+        self.assertEqual(ler_eventos(CursorEventos.decodificar(cursor.codificar()))[0], [])
+
+    def test_linha_confirmada_fora_de_ordem_nao_se_perde(self):
+        # No PostgreSQL uma transacao com id menor pode confirmar depois de
+        # outra; aqui os ids sao escolhidos para simular isso.
+        cursor = cursor_atual()
+        fluxo = _Fluxo(cursor, None)
+        fluxo.abrir(())
+        dados = {'acesso': self.acesso, 'material': self.material, 'quantidade': 1, 'tipo': 'retirada'}
+        posterior = Movimentacao.objects.create(id=cursor.movimentacao + 10, **dados)
+        texto = ''.join(fluxo.consultar(())[0])
+        self.assertIn(f'"id": {posterior.id}', texto)
+
+        atrasada = Movimentacao.objects.create(id=cursor.movimentacao + 5, **dados)
+        self.acesso.encerrar()
+        texto = ''.join(fluxo.consultar(())[0])
+        self.assertEqual(texto.count('event: movimentacao'), 1)
+        self.assertIn(f'"id": {atrasada.id}', texto)
+        self.assertEqual(texto.count('event: encerramento'), 1)
+
+        # Passada a janela o horizonte alcanca tudo e nada se repete.
+        with patch('core.eventos.JANELA_ATRASO', 0):
+            texto = ''.join(fluxo.consultar(())[0])
+        self.assertNotIn('event: movimentacao', texto)
+        self.assertNotIn('event: encerramento', texto)
+        self.assertEqual(fluxo.cursor.movimentacao, posterior.id)
+        self.assertEqual(fluxo.enviados, {'acesso': set(), 'movimentacao': set(), 'encerramento': {}})
+
+    def test_cursor_invalido(self):
+        self.assertIsNone(CursorEventos.decodificar('abc'))
+        self.assertIsNone(CursorEventos.decodificar(None))
+
+    def test_painel(self):
+        self.estoque.quantidade = 3
+        self.estoque.save()
+        dados = painel()
+        self.assertEqual([acesso['funcionario'] for acesso in dados['dentro']], ['Fulano'])
+        self.assertEqual(dados['estoque_baixo'][0]['quantidade'], 3)
+
+    async def test_fluxo_sse_retoma_do_last_event_id(self):
+        user = await sync_to_async(User.objects.create_user)(username='tester', password='123')
+        await self.async_client.aforce_login(user)
+        cursor = await sync_to_async(cursor_atual)()
+        await Movimentacao.objects.acreate(acesso=self.acesso, material=self.material, quantidade=1, tipo='retirada')
+        with patch('core.eventos.INTERVALO_FLUXO', 0), patch('core.eventos.DURACAO_FLUXO', 0.5):
+            response = await self.async_client.get(reverse('core:api_eventos'), headers={'last-event-id': cursor.codificar()})
+            texto = b''.join([parte async for parte in response.streaming_content]).decode()
+        self.assertEqual(response['Content-Type'], 'text/event-stream')
+        self.assertIn('event: painel', texto)
+        self.assertIn('event: movimentacao', texto)
+        self.assertIn('"material": "Cabo"', texto)
+        self.assertTrue(response.is_async)
+
+    def test_fluxo_sse_sob_wsgi_envia_antes_do_fim(self):
+        user = User.objects.create_user(username='tester', password='123')
+        self.client.force_login(user)
+        with patch('core.eventos.INTERVALO_FLUXO', 0.01), patch('core.eventos.DURACAO_FLUXO', 60):
+            response = self.client.get(reverse('core:api_eventos'))
+            # Um iterador async seria lido inteiro pelo handler WSGI.
+            self.assertFalse(response.is_async)
+            partes = iter(response.streaming_content)
+            self.assertTrue(next(partes).startswith(b'retry:'))
+            self.assertIn(b'event: painel', next(partes))
+            with self.captureOnCommitCallbacks(execute=True):
+                Movimentacao.objects.create(acesso=self.acesso, material=self.material, quantidade=1, tipo='retirada')
+            self.assertIn(b'event: movimentacao', next(partes))
+            response.close()
+
+
+class AdminEscalaTest(BaseSetupMixin, TestCase):
+    def setUp(self):
+        super().setUp()
+        User.objects.create_superuser(username='admin', password='123')
+        self.client.login(username='admin', password='123')
+
+    def _criar_acessos(self, quantidade):
+        return [
+            Acesso.objects.create(
+                funcionario=self.funcionario,
+                autorizador=self.autorizador,
+                almoxarifado=self.almoxarifado,
+                tipo=Acesso.Tipo.ENTRADA,
+                status=Acesso.Status.FECHADO,
+            )
+            for _ in range(quantidade)
+        ]
+
+    def test_datas_por_saltos_iguais_ao_distinct(self):
+        fuso = timezone.get_current_timezone()
+        dias = [datetime(2024, 12, 31, 23, 30), datetime(2025, 1, 1, 0, 30), datetime(2025, 3, 15, 8), datetime(2025, 3, 16, 9)]
+        for acesso, dia in zip(self._criar_acessos(len(dias)), dias):
+            Acesso.objects.filter(pk=acesso.pk).update(data_hora=timezone.make_aware(dia, fuso))
+        consulta = Acesso.objects.filter(data_hora__year__lte=2025)
+        saltos = DatasPorSaltosQuerySet(model=Acesso, query=consulta.query)
+        for nivel in ('year', 'month', 'day'):
+            self.assertEqual(saltos.datetimes('data_hora', nivel), list(consulta.datetimes('data_hora', nivel)))
+
+    def test_paginador_estima_sem_filtro_e_limita_com_filtro(self):
+        with patch('core.paginacao.LIMITE_CONTAGEM', 0):
+            self.assertEqual(PaginadorEstimado(Acesso.objects.all(), 10).count, self.acesso.pk)
+        with patch('core.paginacao.LIMITE_CONTAGEM', 1):
+            self._criar_acessos(3)
+            self.assertEqual(PaginadorEstimado(Acesso.objects.filter(tipo=Acesso.Tipo.ENTRADA), 10).count, 1)
+
+    def test_busca_indexada_de_movimentacoes(self):
+        outro = Material.objects.create(nome='Luva')
+        EstoqueAlmoxarifado.objects.create(material=outro, almoxarifado=self.almoxarifado, quantidade=5)
+        Movimentacao.objects.create(acesso=self.acesso, material=self.material, quantidade=1, tipo='retirada')
+        Movimentacao.objects.create(acesso=self.acesso, material=outro, quantidade=1, tipo='retirada')
+        url = reverse('admin:core_movimentacao_changelist')
+        response = self.client.get(url, {'q': 'cab'})
+        self.assertEqual([m.material for m in response.context['cl'].result_list], [self.material])
+        response = self.client.get(url, {'q': 'fulano'})
+        self.assertEqual(len(response.context['cl'].result_list), 2)
+
+    def test_filtro_de_material_so_renderiza_o_escolhido(self):
+        Material.objects.bulk_create([Material(nome=f'Material {i:04d}') for i in range(50)])
+        response = self.client.get(
+            reverse('admin:core_movimentacao_changelist'), {'material__id__exact': self.material.id}
+        )
+        self.assertContains(response, 'data-filtro-autocomplete')
+        self.assertContains(response, '>Cabo</a>')
+        self.assertNotContains(response, 'Material 0001')
+
+
+class ConsultasPorTelaTest(BaseSetupMixin, TestCase):
+    """Fixa o numero de consultas das telas principais com volumes maiores.
+
+    Se alguma tela voltar a acessar relacoes por linha (por exemplo via
+    ``Acesso.__str__`` ou ``Movimentacao.__str__``), a contagem cresce com os
+    dados e estes testes falham.
+    """
+
+    def setUp(self):
+        super().setUp()
+        User.objects.create_user(username='tester', password='123')
+        self.client.login(username='tester', password='123')
+
+    def _criar_historico(self, acessos, movimentacoes_por_acesso, *, status=Acesso.Status.FECHADO):
+        materiais = Material.objects.bulk_create(
+            [Material(nome=f'Material {i:04d}') for i in range(movimentacoes_por_acesso)]
+        )
+        funcionarios = Funcionario.objects.bulk_create(
+            [Funcionario(nome=f'Funcionario {i:04d}') for i in range(acessos)]
+        )
+        criados = Acesso.objects.bulk_create(
+            [
+                Acesso(
+                    funcionario=funcionario,
+                    autorizador=self.autorizador,
+                    almoxarifado=self.almoxarifado,
+                    tipo=Acesso.Tipo.ENTRADA,
+                    status=status,
+                )
+                for funcionario in funcionarios
+            ]
+        )
+        Movimentacao.objects.bulk_create(
+            [
+                Movimentacao(acesso=acesso, material=material, quantidade=1, tipo=Movimentacao.Tipo.RETIRADA)
+                for acesso in criados
+                for material in materiais
+            ]
+        )
+        return criados
+
+    def test_historico_com_10_acessos_de_20_movimentacoes(self):
+        self._criar_historico(10, 20)
+        # sessao, usuario, pagina de ids, acessos da pagina, movimentacoes e
+        # estoque dos materiais na unidade
+        with self.assertNumQueries(6):
+            response = self.client.get(reverse('core:historico'))
+        self.assertEqual(len(response.context['acessos']), 10)
+        self.assertEqual(sum(len(a.movimentacao_set.all()) for a in response.context['acessos']), 200)
+
+    def test_relatorio_mensal_com_filtros(self):
+        acessos = self._criar_historico(10, 20)
+        call_command('recalcular_resumo_mensal', stdout=StringIO())
+        agora = timezone.localtime()
+        filtros = {
+            'mes': str(agora.month),
+            'ano': str(agora.year),
+            'almoxarifado': self.almoxarifado.id,
+            'funcionario': acessos[0].funcionario_id,
+        }
+        # sessao, usuario, anos disponiveis, validacao do almoxarifado e do
+        # funcionario, dois totais, pagina de movimentacoes, opcao escolhida
+        # de cada select e resumo por material.
+        with self.assertNumQueries(11):
+            response = self.client.get(reverse('core:relatorio_mensal'), filtros)
+        self.assertEqual(response.context['totais']['total_retiradas'], 20)
+
+    def test_formulario_de_movimentacao_com_1000_materiais(self):
+        Material.objects.bulk_create([Material(nome=f'Material {i:04d}') for i in range(1000)])
+        url = reverse('core:registrar_movimentacao_por_acesso', args=[self.acesso.id])
+        # sessao, usuario, acesso
+        with self.assertNumQueries(3):
+            self.client.get(url)
+        dados = {'acesso': self.acesso.id, 'material': self.material.id, 'quantidade': 50, 'tipo': 'retirada'}
+        # Erro de estoque: sessao, usuario, acesso, validacao dos selects e das
+        # FKs do modelo, tentativa de gravar (savepoint, insercoes, UPDATE
+        # condicional, rollback) e a opcao escolhida do material.
+        with self.assertNumQueries(14):
+            response = self.client.post(url, dados)
+        self.assertContains(response, 'Estoque insuficiente')
+
+    def test_formulario_sem_acesso_nao_cresce_com_acessos_abertos(self):
+        self._criar_historico(30, 1, status=Acesso.Status.ABERTO)
+        dados = {'acesso': self.acesso.id, 'material': self.material.id, 'quantidade': '', 'tipo': 'retirada'}
+        # sessao, usuario, validacao dos selects e das FKs do modelo e a opcao
+        # escolhida de cada select (o rotulo do acesso usa o funcionario ja
+        # carregado pelo select_related).
+        with self.assertNumQueries(8):
+            response = self.client.post(reverse('core:registrar_movimentacao'), dados)
+        self.assertContains(response, f'<option value="{self.acesso.id}" selected>')
+
+    def test_admin_de_movimentacoes_nao_cresce_com_as_linhas(self):
+        self._criar_historico(10, 20)
+        User.objects.create_superuser(username='admin', password='123')
+        self.client.login(username='admin', password='123')
+        # sessao, usuario, contagem (limitada pelo filtro), pagina com material
+        # e funcionario e os almoxarifados do filtro
+        with self.assertNumQueries(5):
+            response = self.client.get(reverse('admin:core_movimentacao_changelist'), {'tipo__exact': 'retirada'})
+        self.assertEqual(len(response.context['cl'].result_list), 100)
@@ -10,7 +10,23 @@ urlpatterns = [
     path('acessos/', views.registrar_acesso, name='registrar_acesso'),
     path('acessos/<int:id>/encerrar/', views.encerrar_acesso, name='encerrar_acesso'),
     path('historico/', views.historico, name='historico'),
+    path('historico/exportar/<str:formato>/', views.exportar_historico, name='exportar_historico'),
     path('movimentacoes/', views.registrar_movimentacao, name='registrar_movimentacao'),
     path('movimentacoes/<int:acesso_id>/', views.registrar_movimentacao, name='registrar_movimentacao_por_acesso'),
+    path('movimentacoes/<int:acesso_id>/lote/', views.registrar_movimentacoes_lote, name='registrar_movimentacoes_lote'),
+    path('api/acessos/<int:acesso_id>/movimentacoes/', views.api_registrar_movimentacoes_lote, name='api_registrar_movimentacoes_lote'),
     path('relatorio/', views.relatorio_mensal, name='relatorio_mensal'),
+    path('relatorio/exportar/<str:formato>/', views.exportar_relatorio, name='exportar_relatorio'),
+    path('desempenho/', views.desempenho, name='desempenho'),
+    path('estoque/em-data/', views.estoque_em_data, name='estoque_em_data'),
+    path('api/estoque/em-data/', views.api_estoque_em_data, name='api_estoque_em_data'),
+    path('api/materiais/estoques/', views.api_estoques_materiais, name='api_estoques_materiais'),
+    path('api/autocomplete/<str:entidade>/', views.api_autocomplete, name='api_autocomplete'),
+    path('tarefas/', views.tarefas, name='tarefas'),
+    path('tarefas/exportar/<str:origem>/<str:formato>/', views.enfileirar_exportacao, name='enfileirar_exportacao'),
+    path('tarefas/recalcular-estoque/', views.enfileirar_recalculo_estoque, name='enfileirar_recalculo_estoque'),
+    path('tarefas/<int:id>/arquivo/', views.baixar_tarefa, name='baixar_tarefa'),
+    path('api/tarefas/<int:id>/', views.api_tarefa, name='api_tarefa'),
+    path('painel/', views.painel, name='painel'),
+    path('api/eventos/', views.api_eventos, name='api_eventos'),
 ]
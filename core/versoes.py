@@ -0,0 +1,70 @@
+"""Marcadores de alteracao dos dados, guardados no cache.
+
+Cada marcador e o instante (em ns) da ultima alteracao do que ele cobre:
+
+- ``base``: cadastros e reconstrucoes em massa (aparecem em todas as telas);
+- ``acessos``: qualquer acesso ou movimentacao;
+- ``mes``: acessos e movimentacoes de acessos iniciados naquele mes.
+
+As telas derivam ETag/Last-Modified e chaves de cache de fragmentos desses
+marcadores, sem consultar o banco. Um marcador ausente (cache limpo ou
+expirado) e recriado com o instante atual, o que so invalida mais do que o
+necessario. Com mais de um processo o cache precisa ser compartilhado (ver
+``DJANGO_CACHE`` nas configuracoes).
+"""
+
+import time
+
+from django.core.cache import cache
+from django.db import transaction
+from django.utils import timezone
+
+CHAVE_BASE = 'core:versao:base'
+CHAVE_ACESSOS = 'core:versao:acessos'
+
+
+def chave_mes(ano: int, mes: int) -> str:
+    return f'core:versao:mes:{ano}-{mes:02d}'
+
+
+def versao(chave: str) -> int:
+    valor = cache.get(chave)
+    if valor is None:
+        cache.add(chave, time.time_ns(), None)
+        valor = cache.get(chave)
+    return valor
+
+
+def versoes(*chaves: str) -> tuple[int, ...]:
+    valores = cache.get_many(chaves)
+    return tuple(valores[chave] if chave in valores else versao(chave) for chave in chaves)
+
+
+async def aversoes(*chaves: str) -> tuple[int, ...]:
+    """``versoes`` para codigo async, pelos metodos ``a*`` do cache."""
+    valores = await cache.aget_many(chaves)
+    for chave in chaves:
+        if chave not in valores:
+            await cache.aadd(chave, time.time_ns(), None)
+            valores[chave] = await cache.aget(chave)
+    return tuple(valores[chave] for chave in chaves)
+
+
+def _marcar(chaves) -> None:
+    agora = time.time_ns()
+    cache.set_many({chave: agora for chave in chaves}, None)
+
+
+def marcar_acesso(*datas) -> None:
+    """Marca a alteracao de acessos iniciados em ``datas`` quando a transacao confirmar."""
+    chaves = {CHAVE_ACESSOS}
+    for data in datas:
+        if data is not None:
+            local = timezone.localtime(data)
+            chaves.add(chave_mes(local.year, local.month))
+    transaction.on_commit(lambda: _marcar(chaves))
+
+
+def marcar_tudo() -> None:
+    """Invalida todas as telas (cadastros alterados, cargas e reconstrucoes em massa)."""
+    transaction.on_commit(lambda: _marcar([CHAVE_BASE]))
@@ -1,18 +1,69 @@
-from datetime import datetime
+import hashlib
+import json
+import os
 
+from asgiref.sync import sync_to_async
+from django.conf import settings
 from django.contrib import messages
+from django.contrib.admin.views.decorators import staff_member_required
 from django.contrib.auth import authenticate, login, logout
 from django.contrib.auth.decorators import login_required
+from django.core.cache import cache
 from django.core.exceptions import ValidationError
-from django.core.paginator import Paginator
-from django.db.models import F, Q, Sum, Value
-from django.db.models.functions import Coalesce
+from django.core.handlers.asgi import ASGIRequest
+from django.db import IntegrityError, transaction
+from django.db.models import Prefetch, Q, Sum
+from django.http import FileResponse, Http404, HttpResponse, JsonResponse, StreamingHttpResponse
 from django.shortcuts import get_object_or_404, redirect, render
+from django.template.loader import render_to_string
 from django.urls import reverse
 from django.utils import timezone
-
-from .forms import AcessoForm, MovimentacaoForm, RelatorioMensalForm
-from .models import Acesso, Movimentacao
+from django.utils.cache import get_conditional_response, patch_cache_control
+from django.utils.http import http_date
+from django.views.decorators.http import require_POST
+
+from . import versoes
+from .busca import filtrar_busca
+from .desempenho import resumo_desempenho
+from .estoque import anotar_estoque_atual, anotar_saldo_livro, registrar_movimentacoes_em_lote
+from .eventos import CursorEventos, fluxo_eventos, fluxo_eventos_sincrono
+from .exportacao import FORMATOS, resposta_exportacao
+from .filtros import intervalo_mes
+from .forms import (
+    AcessoForm,
+    EstoqueEmDataForm,
+    ItemMovimentacaoForm,
+    ItemMovimentacaoFormSet,
+    MovimentacaoForm,
+    RelatorioMensalForm,
+)
+from .models import (
+    Acesso,
+    Almoxarifado,
+    Autorizador,
+    EstoqueAlmoxarifado,
+    Funcionario,
+    Material,
+    Movimentacao,
+    ResumoMensal,
+    Tarefa,
+)
+from .paginacao import apaginar_por_chave
+from .relatorios import exportacao_historico, exportacao_relatorio, filtrar_historico, movimentacoes_relatorio
+
+MOVIMENTACOES_POR_PAGINA = 50
+HISTORICO_POR_PAGINA = 10
+AUTOCOMPLETE_POR_PAGINA = 20
+TAREFAS_POR_PAGINA = 50
+# Segundos que o resumo renderizado de um mes encerrado fica no cache; a chave
+# muda quando o mes e alterado, entao o prazo so limita o espaco ocupado.
+RESUMO_MES_FECHADO_TTL = 24 * 60 * 60
+AUTOCOMPLETE_CADASTROS = {
+    'funcionarios': Funcionario,
+    'autorizadores': Autorizador,
+    'almoxarifados': Almoxarifado,
+    'materiais': Material,
+}
 
 
 def login_view(request):
@@ -58,11 +109,20 @@ def registrar_acesso(request):
                 acesso.status = Acesso.Status.ABERTO
                 acesso.data_saida = None
                 acesso.ativo = True
-                acesso.save()
-                messages.success(request, 'Acesso registrado com sucesso.')
-                return redirect(
-                    'core:registrar_movimentacao_por_acesso', acesso_id=acesso.id
-                )
+                try:
+                    with transaction.atomic():
+                        acesso.save()
+                except IntegrityError:
+                    # Outro registro abriu um acesso para o funcionario ao mesmo tempo.
+                    messages.error(
+                        request,
+                        'Este funcionário já tem um acesso em aberto.',
+                    )
+                else:
+                    messages.success(request, 'Acesso registrado com sucesso.')
+                    return redirect(
+                        'core:registrar_movimentacao_por_acesso', acesso_id=acesso.id
+                    )
             else:
                 messages.error(
                     request,
@@ -74,9 +134,29 @@ def registrar_acesso(request):
     return render(request, 'core/registrar_acesso.html', {'form': form})
 
 
+def _avisar_estoque_baixo(request, movimentacoes):
+    # As movimentacoes sao de um mesmo acesso, logo de uma mesma unidade. Os
+    # alertas para o restante da equipe saem pelo notificador (core.alertas).
+    em_falta = (
+        EstoqueAlmoxarifado.objects.filter(
+            almoxarifado_id=movimentacoes[0].acesso.almoxarifado_id,
+            material_id__in={movimentacao.material_id for movimentacao in movimentacoes},
+            abaixo_do_minimo=True,
+        )
+        .order_by('material__nome')
+        .values_list('material__nome', 'quantidade', 'almoxarifado__nome', 'minimo_efetivo')
+    )
+    for nome, quantidade, almoxarifado, minimo in em_falta:
+        messages.warning(request, f'Estoque baixo: {nome} com {quantidade} unidades em {almoxarifado} (minimo {minimo}).')
+
+
 @login_required
 def registrar_movimentacao(request, acesso_id=None):
-    acesso = get_object_or_404(Acesso, pk=acesso_id) if acesso_id else None
+    acesso = (
+        get_object_or_404(Acesso.objects.select_related('funcionario', 'almoxarifado'), pk=acesso_id)
+        if acesso_id
+        else None
+    )
     if acesso and acesso.status != Acesso.Status.ABERTO:
         messages.error(request, 'Nao e possivel registrar movimentacoes em um acesso encerrado.')
         return redirect('core:historico')
@@ -99,11 +179,6 @@ def registrar_movimentacao(request, acesso_id=None):
         form.fields['acesso'].disabled = True
         form.fields['acesso'].widget.attrs['disabled'] = True
 
-    material_estoques = {
-        material.id: material.quantidade_estoque
-        for material in form.fields['material'].queryset
-    }
-
     if request.method == 'POST' and form.is_valid():
         acesso_escolhido = form.cleaned_data['acesso']
         if acesso_escolhido.status != Acesso.Status.ABERTO:
@@ -116,118 +191,274 @@ def registrar_movimentacao(request, acesso_id=None):
                 form.add_error(None, mensagem)
         else:
             messages.success(request, 'Movimentacao registrada com sucesso.')
-            estoque_restante = movimentacao.material.quantidade_estoque
-            if estoque_restante < 5:
-                messages.warning(
-                    request,
-                    f'Estoque baixo: {movimentacao.material.nome} com {estoque_restante} unidades.',
-                )
+            _avisar_estoque_baixo(request, [movimentacao])
             anchor_url = f"{reverse('core:historico')}#acesso-{acesso_escolhido.id}"
             return redirect(anchor_url)
 
     context = {
         'form': form,
         'acesso': acesso,
-        'material_estoques': material_estoques,
-        'estoque_limite': 5,
     }
     return render(request, 'core/registrar_movimentacao.html', context)
 
 
-@login_required
-def historico(request):
-    acessos_qs = (
-        Acesso.objects.select_related('funcionario', 'autorizador', 'almoxarifado')
-        .prefetch_related('movimentacao_set__material')
-        .annotate(
-            total_retiradas=Coalesce(
-                Sum(
-                    'movimentacao__quantidade',
-                    filter=Q(movimentacao__tipo=Movimentacao.Tipo.RETIRADA),
-                ),
-                Value(0),
-            ),
-            total_devolucoes=Coalesce(
-                Sum(
-                    'movimentacao__quantidade',
-                    filter=Q(movimentacao__tipo=Movimentacao.Tipo.DEVOLUCAO),
-                ),
-                Value(0),
-            ),
+def _consulta_autocomplete(entidade, texto):
+    if entidade == 'acessos':
+        acessos = (
+            Acesso.objects.filter(status=Acesso.Status.ABERTO)
+            .select_related('funcionario')
+            .order_by('-data_hora', '-id')
         )
-        .annotate(saldo=F('total_devolucoes') - F('total_retiradas'))
+        return filtrar_busca(acessos, texto, modelo=Funcionario, caminho='funcionario')
+    modelo = AUTOCOMPLETE_CADASTROS.get(entidade)
+    if modelo is None:
+        raise Http404('Cadastro desconhecido.')
+    return filtrar_busca(modelo.objects.order_by('nome', 'id'), texto)
+
+
+async def _arender(request, template, context):
+    """``render`` para views async.
+
+    A renderizacao roda em thread porque os widgets de selecao consultam a
+    opcao escolhida durante o template. O ``login_required`` async ja carregou
+    o usuario por ``request.auser()``; trocar o ``request.user`` preguicoso por
+    ele evita que o context processor de autenticacao repita a consulta.
+    """
+    request.user = await request.auser()
+    return await sync_to_async(render)(request, template, context)
+
+
+def _validadores(request, usuario, *marcadores) -> tuple[str, int]:
+    """ETag e Last-Modified (em segundos) de uma pagina de leitura.
+
+    ``marcadores`` sao as versoes (``versoes``) dos dados exibidos. O HTML
+    tambem depende do usuario, da querystring e do token CSRF dos
+    formularios, que entram no hash.
+    """
+    partes = [
+        str(usuario.pk),
+        request.get_full_path(),
+        request.COOKIES.get(settings.CSRF_COOKIE_NAME, ''),
+        *map(str, marcadores),
+    ]
+    etag = '"%s"' % hashlib.sha256('|'.join(partes).encode()).hexdigest()[:32]
+    return etag, max(marcadores) // 1_000_000_000
+
+
+async def _mensagens_pendentes(request) -> bool:
+    """Se a resposta vai exibir mensagens (``messages``) de um redirect anterior.
+
+    Essa resposta nao pode virar 304 nem ficar guardada para revalidacao: a
+    mensagem nao apareceria e continuaria na fila. ``len`` le o armazenamento
+    (cookie e sessao) sem marcar as mensagens como lidas.
+    """
+    return await sync_to_async(lambda: len(messages.get_messages(request)) > 0)()
+
+
+def _com_validadores(response, etag, modificado):
+    response['ETag'] = etag
+    response['Last-Modified'] = http_date(modificado)
+    # A pagina e por usuario: o navegador guarda, mas revalida a cada acesso.
+    patch_cache_control(response, private=True, no_cache=True)
+    return response
+
+
+@login_required
+async def api_autocomplete(request, entidade):
+    """Opcoes de um campo de selecao filtradas por ``q``, em paginas (``pagina``)."""
+    try:
+        pagina = max(int(request.GET.get('pagina', 1)), 1)
+    except ValueError:
+        pagina = 1
+    # Montar a consulta pode ler o catalogo do banco (fts_disponivel) na primeira busca.
+    consulta = await sync_to_async(_consulta_autocomplete)(entidade, request.GET.get('q', ''))
+    inicio = (pagina - 1) * AUTOCOMPLETE_POR_PAGINA
+    itens = [obj async for obj in consulta[inicio : inicio + AUTOCOMPLETE_POR_PAGINA + 1].aiterator()]
+    return JsonResponse(
+        {
+            'resultados': [{'id': obj.pk, 'texto': str(obj)} for obj in itens[:AUTOCOMPLETE_POR_PAGINA]],
+            'mais': len(itens) > AUTOCOMPLETE_POR_PAGINA,
+        }
     )
-    status = request.GET.get('status')
-    funcionario = request.GET.get('funcionario')
-    data_inicio = request.GET.get('data_inicio')
-    data_fim = request.GET.get('data_fim')
 
-    if status in [Acesso.Status.ABERTO, Acesso.Status.FECHADO]:
-        acessos_qs = acessos_qs.filter(status=status)
-    if funcionario:
-        acessos_qs = acessos_qs.filter(funcionario__nome__icontains=funcionario)
 
-    if data_inicio:
-        try:
-            data_ini = datetime.fromisoformat(data_inicio).date()
-        except ValueError:
-            data_ini = None
-        if data_ini:
-            acessos_qs = acessos_qs.filter(data_hora__date__gte=data_ini)
-    if data_fim:
+@login_required
+async def api_estoques_materiais(request):
+    """Mapa ``id -> {nome, estoque, estoques}`` dos materiais, servido do cache,
+    e os nomes dos almoxarifados citados em ``estoques``.
+
+    Com ``?versao=`` igual a versao atual responde 204, sem corpo, para que a
+    tela possa consultar periodicamente sem baixar o mapa de novo.
+    """
+    versao, mapa = await sync_to_async(Material.mapa_estoques)()
+    if request.GET.get('versao') == str(versao):
+        return HttpResponse(status=204)
+    almoxarifados = {id: nome async for id, nome in Almoxarifado.objects.values_list('id', 'nome')}
+    return JsonResponse({'versao': versao, 'almoxarifados': almoxarifados, 'materiais': mapa})
+
+
+@login_required
+def registrar_movimentacoes_lote(request, acesso_id):
+    acesso = get_object_or_404(
+        Acesso.objects.select_related('funcionario', 'almoxarifado'), pk=acesso_id
+    )
+    if acesso.status != Acesso.Status.ABERTO:
+        messages.error(request, 'Nao e possivel registrar movimentacoes em um acesso encerrado.')
+        return redirect('core:historico')
+
+    formset = ItemMovimentacaoFormSet(request.POST or None, prefix='itens')
+    erros_lote = []
+    if request.method == 'POST' and formset.is_valid():
+        itens = [
+            (dados['material'].pk, dados['quantidade'], dados['tipo'])
+            for dados in formset.cleaned_data
+            if dados and not dados.get('DELETE')
+        ]
         try:
-            data_final = datetime.fromisoformat(data_fim).date()
-        except ValueError:
-            data_final = None
-        if data_final:
-            acessos_qs = acessos_qs.filter(data_hora__date__lte=data_final)
-
-    paginator = Paginator(acessos_qs, 10)
-    page_number = request.GET.get('page')
-    acessos = paginator.get_page(page_number)
-
-    acessos_ids = [acesso.id for acesso in acessos]
-    saldos_por_acesso = {}
-    if acessos_ids:
-        saldos_qs = (
-            Movimentacao.objects.filter(acesso_id__in=acessos_ids)
-            .values('acesso_id', 'material__nome', 'material__quantidade_estoque')
-            .annotate(
-                retiradas=Coalesce(
-                    Sum('quantidade', filter=Q(tipo=Movimentacao.Tipo.RETIRADA)),
-                    Value(0),
-                ),
-                devolucoes=Coalesce(
-                    Sum('quantidade', filter=Q(tipo=Movimentacao.Tipo.DEVOLUCAO)),
-                    Value(0),
-                ),
+            movimentacoes = registrar_movimentacoes_em_lote(acesso, itens)
+        except ValidationError as exc:
+            erros_lote = exc.messages
+        else:
+            messages.success(request, f'{len(movimentacoes)} movimentacoes registradas com sucesso.')
+            _avisar_estoque_baixo(request, movimentacoes)
+            return redirect(f"{reverse('core:historico')}#acesso-{acesso.id}")
+
+    context = {
+        'acesso': acesso,
+        'formset': formset,
+        'erros_lote': erros_lote,
+    }
+    return render(request, 'core/registrar_movimentacoes_lote.html', context)
+
+
+@login_required
+@require_POST
+def api_registrar_movimentacoes_lote(request, acesso_id):
+    acesso = get_object_or_404(Acesso, pk=acesso_id)
+    try:
+        dados = json.loads(request.body)
+        linhas = dados['itens']
+    except (ValueError, KeyError, TypeError):
+        return JsonResponse({'erros': ['Envie um JSON no formato {"itens": [...]}.']}, status=400)
+    if not isinstance(linhas, list):
+        return JsonResponse({'erros': ['"itens" deve ser uma lista.']}, status=400)
+
+    itens = []
+    erros = []
+    for numero, linha in enumerate(linhas, start=1):
+        form = ItemMovimentacaoForm(linha if isinstance(linha, dict) else {})
+        if form.is_valid():
+            itens.append(
+                (form.cleaned_data['material'].pk, form.cleaned_data['quantidade'], form.cleaned_data['tipo'])
             )
-            .annotate(
-                saldo=F('devolucoes') - F('retiradas'),
-                estoque_atual=F('material__quantidade_estoque'),
+        else:
+            erros.append({'linha': numero, 'erros': form.errors.get_json_data()})
+    if erros:
+        return JsonResponse({'erros': erros}, status=400)
+
+    try:
+        movimentacoes = registrar_movimentacoes_em_lote(acesso, itens)
+    except ValidationError as exc:
+        return JsonResponse({'erros': exc.messages}, status=409)
+    return JsonResponse(
+        {'movimentacoes': [movimentacao.pk for movimentacao in movimentacoes]},
+        status=201,
+    )
+
+
+async def _detalhar_acessos(ids):
+    """Carrega os acessos de uma pagina com movimentacoes e totais calculados.
+
+    Sao tres consultas (acessos, movimentacoes e o estoque dos materiais na
+    unidade de cada acesso) limitadas aos ``ids`` da pagina; os totais por
+    acesso e por material saem das movimentacoes ja carregadas, sem
+    ``GROUP BY`` no banco.
+    """
+    acessos = (
+        Acesso.objects.filter(id__in=ids)
+        .select_related('funcionario', 'autorizador', 'almoxarifado')
+        .prefetch_related(
+            Prefetch(
+                'movimentacao_set',
+                queryset=Movimentacao.objects.select_related('material').order_by('id'),
             )
         )
-        for row in saldos_qs:
-            saldos_por_acesso.setdefault(row['acesso_id'], []).append(row)
-        for acesso in acessos:
-            acesso.saldos_material = saldos_por_acesso.get(acesso.id, [])
+    )
+    por_id = {acesso.id: acesso async for acesso in acessos}
+    estoques = EstoqueAlmoxarifado.objects.filter(
+        material_id__in={m.material_id for acesso in por_id.values() for m in acesso.movimentacao_set.all()},
+        almoxarifado_id__in={acesso.almoxarifado_id for acesso in por_id.values()},
+    ).values_list('material_id', 'almoxarifado_id', 'quantidade')
+    saldos = {(material_id, almoxarifado_id): quantidade async for material_id, almoxarifado_id, quantidade in estoques}
+    for acesso in por_id.values():
+        acesso.total_retiradas = acesso.total_devolucoes = 0
+        por_material = {}
+        for movimentacao in acesso.movimentacao_set.all():
+            item = por_material.setdefault(
+                movimentacao.material_id,
+                {
+                    'material': movimentacao.material,
+                    'retiradas': 0,
+                    'devolucoes': 0,
+                    'estoque_atual': saldos.get((movimentacao.material_id, acesso.almoxarifado_id), 0),
+                },
+            )
+            if movimentacao.tipo == Movimentacao.Tipo.RETIRADA:
+                item['retiradas'] += movimentacao.quantidade
+                acesso.total_retiradas += movimentacao.quantidade
+            else:
+                item['devolucoes'] += movimentacao.quantidade
+                acesso.total_devolucoes += movimentacao.quantidade
+        for item in por_material.values():
+            item['saldo'] = item['devolucoes'] - item['retiradas']
+        acesso.saldo = acesso.total_devolucoes - acesso.total_retiradas
+        acesso.saldos_material = sorted(por_material.values(), key=lambda item: item['material'].nome)
+    return [por_id[id] for id in ids if id in por_id]
+
+
+@login_required
+async def historico(request):
+    # A pagina mostra acessos de qualquer mes e o estoque atual dos materiais.
+    etag, modificado = _validadores(
+        request,
+        await request.auser(),
+        *await versoes.aversoes(versoes.CHAVE_BASE, versoes.CHAVE_ACESSOS),
+        await Material.aversao_mapa_estoques(),
+    )
+    com_mensagens = await _mensagens_pendentes(request)
+    if not com_mensagens:
+        nao_modificada = get_conditional_response(request, etag=etag, last_modified=modificado)
+        if nao_modificada is not None:
+            return nao_modificada
+
+    acessos_qs, filtros = await sync_to_async(filtrar_historico)(
+        Acesso.objects.only('id', 'data_hora'), request.GET
+    )
+
+    # Pagina apenas com ids (sem COUNT); os detalhes vem em uma carga unica.
+    # Com busca textual a ordem e pela relevancia (bm25 crescente).
+    ordenar_por_relevancia = bool(filtros['q'])
+    pagina = await apaginar_por_chave(
+        acessos_qs,
+        'relevancia' if ordenar_por_relevancia else 'data_hora',
+        depois=request.GET.get('depois'),
+        antes=request.GET.get('antes'),
+        por_pagina=HISTORICO_POR_PAGINA,
+        descendente=not ordenar_por_relevancia,
+    )
+    pagina.itens = await _detalhar_acessos([acesso.id for acesso in pagina.itens])
 
-    params_sem_pagina = request.GET.copy()
-    params_sem_pagina.pop('page', None)
-    querystring_sem_pagina = params_sem_pagina.urlencode()
+    params_sem_cursor = request.GET.copy()
+    params_sem_cursor.pop('depois', None)
+    params_sem_cursor.pop('antes', None)
 
     context = {
-        'acessos': acessos,
-        'filtros': {
-            'status': status or '',
-            'funcionario': funcionario or '',
-            'data_inicio': data_inicio or '',
-            'data_fim': data_fim or '',
-        },
-        'querystring_sem_pagina': querystring_sem_pagina,
-        'saldos_por_acesso': saldos_por_acesso,
+        'acessos': pagina,
+        'filtros': filtros,
+        'querystring_sem_cursor': params_sem_cursor.urlencode(),
     }
-    return render(request, 'core/historico.html', context)
+    response = await _arender(request, 'core/historico.html', context)
+    return response if com_mensagens else _com_validadores(response, etag, modificado)
 
 
 @login_required
@@ -249,18 +480,19 @@ def encerrar_acesso(request, id):
     return redirect('core:historico')
 
 
-@login_required
-def relatorio_mensal(request):
+def _filtros_relatorio(params):
+    """Valida os filtros do relatorio mensal.
+
+    Retorna ``(form, mes, ano, almoxarifado, funcionario)``; filtros invalidos
+    caem no mes corrente do ano mais recente com acessos.
+    """
     agora = timezone.now()
-    anos_disponiveis = list(
-        {data.year for data in Acesso.objects.dates('data_hora', 'year')}
-    ) or [agora.year]
-    anos_disponiveis = sorted(anos_disponiveis)
+    anos_disponiveis = Acesso.anos_disponiveis() or [agora.year]
     ano_choices = [(str(ano), str(ano)) for ano in anos_disponiveis]
 
     initial = {'mes': f"{agora.month:02d}", 'ano': str(anos_disponiveis[-1])}
-    if request.GET:
-        form = RelatorioMensalForm(request.GET)
+    if params:
+        form = RelatorioMensalForm(params)
     else:
         form = RelatorioMensalForm(initial=initial)
     form.fields['ano'].choices = ano_choices
@@ -275,21 +507,21 @@ def relatorio_mensal(request):
         ano_selecionado = int(form.initial.get('ano', initial['ano']))
         almoxarifado = None
         funcionario = None
+    return form, mes_selecionado, ano_selecionado, almoxarifado, funcionario
 
-    movimentacoes = Movimentacao.objects.filter(
-        acesso__data_hora__year=ano_selecionado,
-        acesso__data_hora__month=mes_selecionado,
-        acesso__status=Acesso.Status.FECHADO,
-    ).select_related('material', 'acesso', 'acesso__funcionario', 'acesso__almoxarifado')
+
+async def _resumo_relatorio(mes, ano, almoxarifado, funcionario):
+    """Totais e resumo por material do relatorio, ja renderizados."""
+    resumos = ResumoMensal.objects.filter(ano=ano, mes=mes)
     if almoxarifado:
-        movimentacoes = movimentacoes.filter(acesso__almoxarifado=almoxarifado)
+        resumos = resumos.filter(almoxarifado=almoxarifado)
     if funcionario:
-        movimentacoes = movimentacoes.filter(acesso__funcionario=funcionario)
+        resumos = resumos.filter(funcionario=funcionario)
 
     resumo_por_tipo_acesso = []
     # Mantemos apenas acessos de entrada, que sao os usados no fluxo atual.
-    qs_entrada = movimentacoes.filter(acesso__tipo=Acesso.Tipo.ENTRADA)
-    agregados_entrada = qs_entrada.aggregate(
+    agregados_entrada = await resumos.filter(tipo_acesso=Acesso.Tipo.ENTRADA).aaggregate(
+        movimentacoes=Sum('total_movimentacoes'),
         retiradas=Sum('quantidade', filter=Q(tipo=Movimentacao.Tipo.RETIRADA)),
         devolucoes=Sum('quantidade', filter=Q(tipo=Movimentacao.Tipo.DEVOLUCAO)),
     )
@@ -297,39 +529,293 @@ def relatorio_mensal(request):
         {
             'tipo': Acesso.Tipo.ENTRADA,
             'label': dict(Acesso.Tipo.choices)[Acesso.Tipo.ENTRADA],
-            'total_movimentacoes': qs_entrada.count(),
+            'total_movimentacoes': agregados_entrada['movimentacoes'] or 0,
             'total_retiradas': agregados_entrada['retiradas'] or 0,
             'total_devolucoes': agregados_entrada['devolucoes'] or 0,
         }
     )
 
-    totais = movimentacoes.aggregate(
+    totais = await resumos.aaggregate(
+        total_movimentacoes=Sum('total_movimentacoes'),
         total_retiradas=Sum('quantidade', filter=Q(tipo=Movimentacao.Tipo.RETIRADA)),
         total_devolucoes=Sum('quantidade', filter=Q(tipo=Movimentacao.Tipo.DEVOLUCAO)),
     )
     totais = {chave: valor or 0 for chave, valor in totais.items()}
     totais['saldo'] = totais['total_devolucoes'] - totais['total_retiradas']
 
-    resumo_por_material = (
-        movimentacoes.values('material__nome')
+    resumo_por_material = [
+        linha
+        async for linha in resumos.values('material__nome')
         .annotate(
             retiradas=Sum('quantidade', filter=Q(tipo=Movimentacao.Tipo.RETIRADA)),
             devolucoes=Sum('quantidade', filter=Q(tipo=Movimentacao.Tipo.DEVOLUCAO)),
         )
         .order_by('material__nome')
+        .aiterator()
+    ]
+    return render_to_string(
+        'core/relatorio_resumo.html',
+        {
+            'totais': totais,
+            'resumo_por_material': resumo_por_material,
+            'resumo_por_tipo_acesso': resumo_por_tipo_acesso,
+            'mes_selecionado': mes,
+            'ano_selecionado': ano,
+            'filtros': {'almoxarifado': almoxarifado, 'funcionario': funcionario},
+        },
+    )
+
+
+@login_required
+async def relatorio_mensal(request):
+    # A validacao do formulario consulta os cadastros escolhidos; roda em thread.
+    form, mes_selecionado, ano_selecionado, almoxarifado, funcionario = await sync_to_async(_filtros_relatorio)(
+        request.GET
+    )
+    marcadores = await versoes.aversoes(versoes.CHAVE_BASE, versoes.chave_mes(ano_selecionado, mes_selecionado))
+    etag, modificado = _validadores(request, await request.auser(), *marcadores)
+    com_mensagens = await _mensagens_pendentes(request)
+    if not com_mensagens:
+        nao_modificada = get_conditional_response(request, etag=etag, last_modified=modificado)
+        if nao_modificada is not None:
+            return nao_modificada
+
+    # O resumo de um mes encerrado so muda com alteracoes naquele mes (ou nos
+    # cadastros), que trocam os marcadores da chave; o mes corrente muda a
+    # todo momento e e sempre recalculado.
+    mes_encerrado = intervalo_mes(ano_selecionado, mes_selecionado)[1] <= timezone.now()
+    chave_resumo = 'core:relatorio:resumo:{}-{:02d}:{}:{}:{}:{}'.format(
+        ano_selecionado,
+        mes_selecionado,
+        almoxarifado.pk if almoxarifado else '',
+        funcionario.pk if funcionario else '',
+        *marcadores,
+    )
+    resumo = await cache.aget(chave_resumo) if mes_encerrado else None
+    if resumo is None:
+        resumo = await _resumo_relatorio(mes_selecionado, ano_selecionado, almoxarifado, funcionario)
+        if mes_encerrado:
+            await cache.aset(chave_resumo, resumo, RESUMO_MES_FECHADO_TTL)
+
+    movimentacoes = movimentacoes_relatorio(mes_selecionado, ano_selecionado, almoxarifado, funcionario)
+    pagina_movimentacoes = await apaginar_por_chave(
+        movimentacoes,
+        'acesso__data_hora',
+        depois=request.GET.get('depois'),
+        antes=request.GET.get('antes'),
+        por_pagina=MOVIMENTACOES_POR_PAGINA,
     )
+    params_sem_cursor = request.GET.copy()
+    params_sem_cursor.pop('depois', None)
+    params_sem_cursor.pop('antes', None)
 
     context = {
         'form': form,
-        'movimentacoes': movimentacoes,
-        'totais': totais,
-        'resumo_por_material': resumo_por_material,
-        'resumo_por_tipo_acesso': resumo_por_tipo_acesso,
-        'mes_selecionado': mes_selecionado,
-        'ano_selecionado': ano_selecionado,
-        'filtros': {
-            'almoxarifado': almoxarifado,
-            'funcionario': funcionario,
-        },
+        'resumo': resumo,
+        'movimentacoes': pagina_movimentacoes,
+        'querystring_sem_cursor': params_sem_cursor.urlencode(),
+    }
+    response = await _arender(request, 'core/relatorio_mensal.html', context)
+    return response if com_mensagens else _com_validadores(response, etag, modificado)
+
+
+@login_required
+def exportar_relatorio(request, formato):
+    _, mes, ano, almoxarifado, funcionario = _filtros_relatorio(request.GET)
+    exportacao = exportacao_relatorio(mes, ano, almoxarifado, funcionario)
+    return resposta_exportacao(
+        formato,
+        exportacao.nome_arquivo,
+        exportacao.cabecalho,
+        exportacao.linhas(),
+        assincrona=isinstance(request, ASGIRequest),
+    )
+
+
+@login_required
+def exportar_historico(request, formato):
+    exportacao = exportacao_historico(request.GET)
+    return resposta_exportacao(
+        formato,
+        exportacao.nome_arquivo,
+        exportacao.cabecalho,
+        exportacao.linhas(),
+        assincrona=isinstance(request, ASGIRequest),
+    )
+
+
+def _tarefas_visiveis(usuario):
+    """Tarefas que ``usuario`` pode acompanhar e baixar: as proprias, ou todas para a equipe."""
+    tarefas = Tarefa.objects.all()
+    if not usuario.is_staff:
+        tarefas = tarefas.filter(criado_por=usuario)
+    return tarefas
+
+
+@login_required
+def tarefas(request):
+    context = {
+        'tarefas': _tarefas_visiveis(request.user).select_related('criado_por')[:TAREFAS_POR_PAGINA],
+    }
+    return render(request, 'core/tarefas.html', context)
+
+
+@login_required
+@require_POST
+def enfileirar_exportacao(request, origem, formato):
+    """Enfileira a exportacao com os filtros da querystring e volta na hora para a lista de tarefas."""
+    if formato not in FORMATOS:
+        raise Http404('Formato de exportacao invalido.')
+    if origem == 'relatorio':
+        _, mes, ano, almoxarifado, funcionario = _filtros_relatorio(request.GET)
+        ano_inteiro = request.POST.get('periodo') == 'ano'
+        tipo = Tarefa.Tipo.EXPORTAR_RELATORIO
+        parametros = {
+            'formato': formato,
+            'ano': ano,
+            'mes': None if ano_inteiro else mes,
+            'almoxarifado': almoxarifado.pk if almoxarifado else None,
+            'funcionario': funcionario.pk if funcionario else None,
+        }
+    elif origem == 'historico':
+        filtros = request.GET.dict()
+        filtros.pop('depois', None)
+        filtros.pop('antes', None)
+        tipo = Tarefa.Tipo.EXPORTAR_HISTORICO
+        parametros = {'formato': formato, 'filtros': filtros}
+    else:
+        raise Http404('Exportacao desconhecida.')
+    tarefa = Tarefa.enfileirar(tipo, parametros, usuario=request.user)
+    messages.success(request, f'Exportacao enfileirada (tarefa #{tarefa.pk}). O arquivo aparece aqui quando ficar pronto.')
+    return redirect('core:tarefas')
+
+
+@staff_member_required
+@require_POST
+def enfileirar_recalculo_estoque(request):
+    tarefa = Tarefa.enfileirar(Tarefa.Tipo.RECALCULAR_ESTOQUE, usuario=request.user)
+    messages.success(request, f'Recalculo de estoque enfileirado (tarefa #{tarefa.pk}).')
+    return redirect('core:tarefas')
+
+
+@login_required
+async def api_tarefa(request, id):
+    """Status e progresso de uma tarefa, consultado periodicamente pela tela de tarefas."""
+    tarefa = await _tarefas_visiveis(await request.auser()).filter(pk=id).afirst()
+    if tarefa is None:
+        raise Http404('Tarefa nao encontrada.')
+    return JsonResponse(
+        {
+            'id': tarefa.pk,
+            'status': tarefa.status,
+            'status_display': tarefa.get_status_display(),
+            'progresso': tarefa.progresso,
+            'mensagem': tarefa.mensagem,
+            'finalizada': tarefa.finalizada,
+            'arquivo': reverse('core:baixar_tarefa', args=[tarefa.pk]) if tarefa.arquivo else None,
+        }
+    )
+
+
+@login_required
+def painel(request):
+    """Quem esta nos almoxarifados, estoque baixo e eventos ao vivo, pelo fluxo de ``api_eventos``."""
+    return render(request, 'core/painel.html')
+
+
+@login_required
+async def api_eventos(request):
+    """Fluxo SSE de acessos, movimentacoes, encerramentos e do painel (ver ``core.eventos``).
+
+    Retoma do cursor em ``Last-Event-ID`` (reconexao do ``EventSource``) ou
+    ``?cursor=``; sem cursor valido comeca do estado atual. Sob WSGI o fluxo
+    e um gerador sincrono: o handler leria um gerador async ate o fim antes
+    de enviar o primeiro evento.
+    """
+    cursor = CursorEventos.decodificar(request.headers.get('Last-Event-ID') or request.GET.get('cursor'))
+    fluxo = fluxo_eventos if isinstance(request, ASGIRequest) else fluxo_eventos_sincrono
+    response = StreamingHttpResponse(fluxo(cursor), content_type='text/event-stream')
+    response['Cache-Control'] = 'no-cache'
+    # Proxies como o nginx guardariam os eventos ate completar o buffer.
+    response['X-Accel-Buffering'] = 'no'
+    return response
+
+
+@login_required
+def baixar_tarefa(request, id):
+    tarefa = get_object_or_404(_tarefas_visiveis(request.user), pk=id, status=Tarefa.Status.CONCLUIDA)
+    if not tarefa.arquivo:
+        raise Http404('Esta tarefa nao gerou arquivo.')
+    return FileResponse(tarefa.arquivo.open('rb'), as_attachment=True, filename=os.path.basename(tarefa.arquivo.name))
+
+
+def _estoque_em_data(params):
+    """Valida os filtros e devolve ``(form, instante, almoxarifado, consulta)`` com o saldo de cada material."""
+    form = EstoqueEmDataForm(params or None)
+    instante = timezone.now()
+    almoxarifado = None
+    materiais = Material.objects.all()
+    if form.is_valid():
+        instante = form.cleaned_data['data'] or instante
+        almoxarifado = form.cleaned_data['almoxarifado']
+        if form.cleaned_data['busca']:
+            materiais = materiais.filter(nome__icontains=form.cleaned_data['busca'])
+        if form.cleaned_data['material']:
+            materiais = materiais.filter(pk__in=[m.pk for m in form.cleaned_data['material']])
+    consulta = (
+        anotar_estoque_atual(
+            anotar_saldo_livro(materiais, em=instante, almoxarifado=almoxarifado), almoxarifado=almoxarifado
+        )
+        .order_by('nome', 'id')
+        .values('id', 'nome', 'estoque_atual', 'saldo_livro')
+    )
+    return form, instante, almoxarifado, consulta
+
+
+@login_required
+def estoque_em_data(request):
+    form, instante, almoxarifado, consulta = _estoque_em_data(request.GET)
+    context = {
+        'form': form,
+        'instante': instante,
+        'almoxarifado': almoxarifado,
+        'linhas': list(consulta),
+    }
+    return render(request, 'core/estoque_em_data.html', context)
+
+
+@login_required
+async def api_estoque_em_data(request):
+    form, instante, almoxarifado, consulta = await sync_to_async(_estoque_em_data)(request.GET)
+    if form.is_bound and not form.is_valid():
+        return JsonResponse({'erros': form.errors.get_json_data()}, status=400)
+    linhas = [linha async for linha in consulta.aiterator()]
+    return JsonResponse(
+        {
+            'instante': instante.isoformat(),
+            'almoxarifado': almoxarifado.pk if almoxarifado else None,
+            'materiais': [
+                {
+                    'id': linha['id'],
+                    'nome': linha['nome'],
+                    'saldo': linha['saldo_livro'],
+                    'estoque_atual': linha['estoque_atual'],
+                }
+                for linha in linhas
+            ],
+        }
+    )
+
+
+@staff_member_required
+def desempenho(request):
+    try:
+        dias = max(int(request.GET.get('dias', 7)), 1)
+    except ValueError:
+        dias = 7
+    context = {
+        'linhas': resumo_desempenho(dias=dias),
+        'dias': dias,
+        'amostragem': settings.INSTRUMENTACAO_AMOSTRAGEM,
     }
-    return render(request, 'core/relatorio_mensal.html', context)
+    return render(request, 'core/desempenho.html', context)
@@ -11,7 +11,7 @@ def configurar_django() -> None:
 
 
 def popular_dados() -> None:
-    from core.models import Almoxarifado, Autorizador, Funcionario, Material
+    from core.models import Almoxarifado, Autorizador, EstoqueAlmoxarifado, Funcionario, Material
 
     funcionarios = [
         'Bruno Lima',
@@ -42,16 +42,22 @@ def popular_dados() -> None:
     for nome in autorizadores:
         Autorizador.objects.get_or_create(nome=nome)
 
-    for nome, localizacao in almoxarifados:
+    unidades = [
         Almoxarifado.objects.get_or_create(
             nome=nome,
             defaults={'localizacao': localizacao},
-        )
+        )[0]
+        for nome, localizacao in almoxarifados
+    ]
 
     for nome, quantidade in materiais:
         material, _ = Material.objects.get_or_create(nome=nome)
-        material.quantidade_estoque = quantidade
-        material.save(update_fields=['quantidade_estoque'])
+        for unidade in unidades:
+            EstoqueAlmoxarifado.objects.update_or_create(
+                material=material,
+                almoxarifado=unidade,
+                defaults={'quantidade': quantidade},
+            )
 
     print('Cadastros basicos populados com sucesso! Pronto para registrar acessos e movimentacoes.')
 